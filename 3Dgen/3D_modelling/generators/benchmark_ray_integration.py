@@ -0,0 +1,96 @@
+# Benchmark of the hierarchical-sampling ray integration of Map3DGenerator.render:
+# concatenation + torch.sort + gather + cumprod integration (previous implementation)
+# vs. merge of the sorted coarse / fine samples + cumsum integration (ray_integration_merged)
+
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+import lib.generators.volume_rendering as vr
+
+
+def reference_ray_integration(input, z_vals, last_back=False):
+
+    features = input[..., :-1]
+    sigmas = input[..., -1:]
+    deltas = z_vals[:, :, 1:] - z_vals[:, :, :-1]
+    deltas = torch.cat([deltas, 1e9 * torch.ones_like(deltas[:, :, :1])], -2)
+    alphas = 1 - torch.exp(-deltas * F.softplus(sigmas))
+    alphas_shifted = torch.cat([torch.ones_like(alphas[:, :, :1]), 1 - alphas + 1e-12], -2)
+    weights = alphas * torch.cumprod(alphas_shifted, -2)[:, :, :-1]
+    weights_sum = weights.sum(2)
+    if last_back:
+        weights[:, :, -1] += (1 - weights_sum)
+        return torch.sum(weights * features, -2), torch.sum(weights * z_vals, -2), weights
+    weights_depth = weights.clone()
+    weights_depth[:, :, -1] += (1 - weights_sum)
+    return torch.sum(weights * features, -2), torch.sum(weights_depth * z_vals, -2), weights
+
+
+def reference(fine_output, fine_z_vals, coarse_output, z_vals):
+
+    all_outputs = torch.cat([fine_output, coarse_output], dim=-2)
+    all_z_vals = torch.cat([fine_z_vals, z_vals], dim=-2)
+    _, indices = torch.sort(all_z_vals, dim=-2)
+    all_z_vals = torch.gather(all_z_vals, -2, indices)
+    all_outputs = torch.gather(all_outputs, -2, indices.expand(-1, -1, -1, all_outputs.shape[-1]))
+    return reference_ray_integration(all_outputs, all_z_vals)
+
+
+def merged(fine_output, fine_z_vals, coarse_output, z_vals):
+
+    return vr.ray_integration_merged(fine_output, fine_z_vals, coarse_output, z_vals, device=z_vals.device,
+                                     noise_std=0., clamp_mode='softplus')
+
+
+def measure(fn, inputs, n_iter, device):
+
+    def step():
+        outputs = fn(*inputs)
+        (outputs[0].sum() + outputs[1].sum()).backward()
+
+    for _ in range(3):
+        step()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    tic = time.perf_counter()
+    for _ in range(n_iter):
+        step()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    elapsed = (time.perf_counter() - tic) / n_iter * 1e3
+    peak = torch.cuda.max_memory_allocated(device) / 2 ** 20 if device.type == "cuda" else float("nan")
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-gpu", "--gpu_device", type=int, default=0)
+    parser.add_argument("-n", "--n_iter", type=int, default=20)
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--num_steps", type=int, default=24)
+    parser.add_argument("--feature_dim", type=int, default=32)
+    args = parser.parse_args()
+
+    device = torch.device(f"cuda:{args.gpu_device}" if torch.cuda.is_available() else "cpu")
+
+    print(f"{'res':>6s}{'max diff':>12s}{'sort (ms)':>12s}{'merge (ms)':>12s}{'sort (MB)':>12s}{'merge (MB)':>12s}")
+    for res in [32, 64, 128]:
+        shape = (args.batch_size, res * res, args.num_steps)
+        z_vals = torch.linspace(0.5, 1.5, args.num_steps, device=device).expand(*shape).unsqueeze(-1)
+        z_vals = z_vals + (torch.rand(*shape, 1, device=device) - 0.5) / args.num_steps
+        fine_z_vals, _ = torch.sort(torch.rand(*shape, device=device) + 0.5, dim=-1)
+        fine_z_vals = fine_z_vals.unsqueeze(-1)
+        coarse_output = torch.randn(*shape, args.feature_dim + 4, device=device, requires_grad=True)
+        fine_output = torch.randn(*shape, args.feature_dim + 4, device=device, requires_grad=True)
+        inputs = (fine_output, fine_z_vals, coarse_output, z_vals)
+
+        with torch.no_grad():
+            diff = max((a - b).abs().max().item() for a, b in zip(reference(*inputs), merged(*inputs)))
+        time_ref, mem_ref = measure(reference, inputs, args.n_iter, device)
+        time_new, mem_new = measure(merged, inputs, args.n_iter, device)
+        print(f"{res:6d}{diff:12.2e}{time_ref:12.3f}{time_new:12.3f}{mem_ref:12.1f}{mem_new:12.1f}")
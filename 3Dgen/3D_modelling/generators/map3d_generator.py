@@ -450,7 +450,7 @@ class Map3DGenerator(nn.Module):
         if hierarchical_sample:
             with torch.no_grad():
 
-                _, _, weights = vr.ray_integration(coarse_output, z_vals, device=self.device, clamp_mode=kwargs['clamp_mode'], noise_std=kwargs['nerf_noise'])
+                weights = vr.integration_weights(coarse_output[..., -1:], z_vals, device=self.device, clamp_mode=kwargs['clamp_mode'], noise_std=kwargs['nerf_noise'])
 
                 weights = weights.reshape(batch_size * render_width * render_height, coarse_steps) + 1e-5
 
@@ -459,6 +459,8 @@ class Map3DGenerator(nn.Module):
                 z_vals_mid = 0.5 * (z_vals[: ,:-1] + z_vals[: ,1:])
                 z_vals = z_vals.reshape(batch_size, render_width * render_height, coarse_steps, 1)
                 fine_z_vals = vr.sample_pdf(z_vals_mid, weights[:, 1:-1], fine_steps, det=False).detach()
+                # sorted here (depths only), so the fine outputs can be merged with the coarse ones
+                fine_z_vals, _ = torch.sort(fine_z_vals, dim=-1)
                 fine_z_vals = fine_z_vals.reshape(batch_size, render_width * render_height, fine_steps, 1)
 
                 fine_points = transformed_ray_origins.unsqueeze(2).contiguous() + transformed_ray_directions.unsqueeze(
@@ -500,19 +502,17 @@ class Map3DGenerator(nn.Module):
 
             fine_output = fine_output.reshape(batch_size, render_width * render_height, -1, self.feature_dim + 4)
 
-            # Combine course and fine points
-            all_outputs = torch.cat([fine_output, coarse_output], dim=-2)
-            all_z_vals = torch.cat([fine_z_vals, z_vals], dim=-2)
-            _, indices = torch.sort(all_z_vals, dim=-2)
-            all_z_vals = torch.gather(all_z_vals, -2, indices)
-            all_outputs = torch.gather(all_outputs, -2, indices.expand(-1, -1, -1, self.feature_dim + 4))
+            # Perform ray integration over the merged course and fine points
+            render_outputs, depths, weights = vr.ray_integration_merged(
+                fine_output, fine_z_vals, coarse_output, z_vals, device=self.device,
+                white_back=kwargs.get('white_back', False), last_back=kwargs.get('last_back', False), clamp_mode=kwargs['clamp_mode'],
+                noise_std=kwargs['nerf_noise'], transmittance_threshold=kwargs.get('transmittance_threshold', 0.))
         else:
-            all_outputs = coarse_output
-            all_z_vals = z_vals
-
-
-        # Perform ray integration
-        render_outputs, depths, weights = vr.ray_integration(all_outputs, all_z_vals, device=self.device, white_back=kwargs.get('white_back', False), last_back=kwargs.get('last_back', False), clamp_mode=kwargs['clamp_mode'], noise_std=kwargs['nerf_noise'])
+            # Perform ray integration
+            render_outputs, depths, weights = vr.ray_integration(
+                coarse_output, z_vals, device=self.device,
+                white_back=kwargs.get('white_back', False), last_back=kwargs.get('last_back', False), clamp_mode=kwargs['clamp_mode'],
+                noise_std=kwargs['nerf_noise'], transmittance_threshold=kwargs.get('transmittance_threshold', 0.))
 
         render_outputs = render_outputs.reshape(batch_size, render_height, render_width, self.feature_dim + 3)
         render_outputs = render_outputs.permute(0, 3, 1, 2)
@@ -9,41 +9,68 @@ import random
 from lib.components.util import normalize_vecs
 
 
-def ray_integration(input, z_vals, device, noise_std=0.5, last_back=False, white_back=False, clamp_mode=None, fill_mode=None):
-    """Performs NeRF volumetric rendering."""
-
-    # [ batch_size, num_rays, num_steps, num_channels ]
-    features = input[..., :-1]
-    sigmas = input[..., -1:]
+def integration_weights(sigmas, z_vals, device, noise_std=0.5, clamp_mode=None, transmittance_threshold=0.):
+    """
+    NeRF compositing weights of depth-sorted samples [ batch_size, num_rays, num_steps, 1 ],
+    transmittance is computed from a cumulative sum of optical depths instead of a cumprod of
+    shifted alphas; samples behind a transmittance below transmittance_threshold get weight 0
+    """
 
-    # [ batch_size, num_rays, num_steps, num_channels ]
-    deltas = z_vals[:, :, 1:] - z_vals[:, :, :-1]
-    delta_inf = 1e9 * torch.ones_like(deltas[:, :, :1])
-    deltas = torch.cat([deltas, delta_inf], -2)
+    # the last sample extends to infinity
+    deltas = F.pad(z_vals[:, :, 1:] - z_vals[:, :, :-1], (0, 0, 0, 1), value=1e9)
 
     noise = torch.randn(sigmas.shape, device=device) * noise_std
 
     if clamp_mode == 'softplus':
-        alphas = 1 - torch.exp(-deltas * (F.softplus(sigmas + noise)))
+        optical_depths = deltas * F.softplus(sigmas + noise)
     elif clamp_mode == 'relu':
-        alphas = 1 - torch.exp(-deltas * (F.relu(sigmas + noise)))
+        optical_depths = deltas * F.relu(sigmas + noise)
     else:
         raise Exception("Need to choose clamp mode")
 
-    # alphas_shifted (~termination prob): step[0] = 1, step[1:] = exp(-sigmas)
-    alphas_shifted = torch.cat([torch.ones_like(alphas[:, :, :1]), 1-alphas + 1e-12], -2)
-    weights = alphas * torch.cumprod(alphas_shifted, -2)[:, :, :-1]
-    weights_sum = weights.sum(2)
+    alphas = -torch.expm1(-optical_depths)
+    # transmittance before every sample: step[0] = 1, step[i] = exp(-sum_{j<i} sigma_j delta_j)
+    transmittance = torch.exp(-F.pad(torch.cumsum(optical_depths[:, :, :-1], -2), (0, 0, 1, 0)))
+    weights = alphas * transmittance
+
+    if transmittance_threshold > 0:
+        weights = weights * (transmittance > transmittance_threshold)
+
+    return weights
+
+
+def merge_sorted_indices(z_vals_a, z_vals_b):
+    """
+    positions of two depth-sorted sample sets [ ..., num_steps_a / num_steps_b, 1 ] in their merged
+    order (samples of a first on ties), from two searchsorted calls instead of a sort
+    """
+
+    z_a = z_vals_a.squeeze(-1).contiguous()
+    z_b = z_vals_b.squeeze(-1).contiguous()
+    index_a = torch.arange(z_a.shape[-1], device=z_a.device) + torch.searchsorted(z_b, z_a, right=False)
+    index_b = torch.arange(z_b.shape[-1], device=z_b.device) + torch.searchsorted(z_a, z_b, right=True)
+    return index_a.unsqueeze(-1), index_b.unsqueeze(-1)
+
+
+def merge_sorted(a, b, index_a, index_b):
+    """scatters a and b [ ..., num_steps, C ] to the merged positions given by merge_sorted_indices"""
+
+    shape = a.shape[:-2] + (a.shape[-2] + b.shape[-2], a.shape[-1])
+    merged = a.new_zeros(shape).scatter(-2, index_a.expand(*index_a.shape[:-1], a.shape[-1]), a)
+    return merged.scatter(-2, index_b.expand(*index_b.shape[:-1], b.shape[-1]), b)
 
-    if last_back: # whether or not to render the last sampled step as background
-        weights[:, :, -1] += (1 - weights_sum)
-        features_final = torch.sum(weights * features, -2)
+
+def _accumulate(weights, features):
+    # sum over the samples of weights * features as a batched matmul, without the product tensor
+    return (weights.transpose(-1, -2) @ features).squeeze(-2)
+
+
+def _composite(features_final, weights, weights_sum, z_vals, last_back, white_back, fill_mode):
+
+    if last_back: # the last sampled step is rendered as background, weights are already updated
         depth_final = torch.sum(weights * z_vals, -2)
     else:
-        features_final = torch.sum(weights * features, -2)
-        weights_depth = weights.clone()
-        weights_depth[:, :, -1] += (1 - weights_sum)
-        depth_final = torch.sum(weights_depth * z_vals, -2)
+        depth_final = torch.sum(weights * z_vals, -2) + (1 - weights_sum) * z_vals[:, :, -1]
 
     if white_back:
         features_final = features_final + 1 - weights_sum
@@ -53,6 +80,52 @@ def ray_integration(input, z_vals, device, noise_std=0.5, last_back=False, white
     elif fill_mode == 'weight':
         features_final = weights_sum.expand_as(features_final)
 
+    return features_final, depth_final
+
+
+def _add_background(weights, weights_sum):
+
+    return torch.cat([weights[:, :, :-1], weights[:, :, -1:] + (1 - weights_sum).unsqueeze(-2)], -2)
+
+
+def ray_integration(input, z_vals, device, noise_std=0.5, last_back=False, white_back=False, clamp_mode=None, fill_mode=None, transmittance_threshold=0.):
+    """Performs NeRF volumetric rendering."""
+
+    # [ batch_size, num_rays, num_steps, num_channels ]
+    weights = integration_weights(input[..., -1:], z_vals, device, noise_std, clamp_mode, transmittance_threshold)
+    weights_sum = weights.sum(2)
+
+    if last_back:
+        weights = _add_background(weights, weights_sum)
+
+    features_final = _accumulate(weights, input[..., :-1])
+    features_final, depth_final = _composite(features_final, weights, weights_sum, z_vals, last_back, white_back, fill_mode)
+
+    return features_final, depth_final, weights
+
+
+def ray_integration_merged(fine_input, fine_z_vals, coarse_input, coarse_z_vals, device, noise_std=0.5, last_back=False, white_back=False, clamp_mode=None, fill_mode=None, transmittance_threshold=0.):
+    """
+    ray_integration of the union of two depth-sorted sample sets (fine and coarse samples of
+    hierarchical sampling), same result as sorting their concatenation first, but only depths
+    and densities are merged, the features of both sets are composited where they are
+    returns features, depth, and the weights in merged order
+    """
+
+    fine_index, coarse_index = merge_sorted_indices(fine_z_vals, coarse_z_vals)
+    z_vals = merge_sorted(fine_z_vals, coarse_z_vals, fine_index, coarse_index)
+    sigmas = merge_sorted(fine_input[..., -1:], coarse_input[..., -1:], fine_index, coarse_index)
+
+    weights = integration_weights(sigmas, z_vals, device, noise_std, clamp_mode, transmittance_threshold)
+    weights_sum = weights.sum(2)
+
+    if last_back:
+        weights = _add_background(weights, weights_sum)
+
+    features_final = _accumulate(weights.gather(-2, fine_index), fine_input[..., :-1]) + \
+                     _accumulate(weights.gather(-2, coarse_index), coarse_input[..., :-1])
+    features_final, depth_final = _composite(features_final, weights, weights_sum, z_vals, last_back, white_back, fill_mode)
+
     return features_final, depth_final, weights
 
 
@@ -32,6 +32,7 @@ from pytorch3d.structures import Meshes
 from scipy.spatial import cKDTree
 
 import smplx as smplx
+from smplx.asset_registry import load_array, load_object
 from render_utils import Pytorch3dRasterizer, face_vertices
 
 
@@ -66,26 +67,29 @@ class SMPLX:
             self.current_dir, "smpl_data/smplx_vertex_lmkid.npy"
         )
 
-        self.smplx_faces = np.load(self.smplx_faces_path)
-        self.smplx_verts = np.load(self.smplx_verts_path)
-        self.smpl_verts = np.load(self.smpl_verts_path)
-        self.smpl_faces = np.load(self.smpl_faces_path)
-        self.smplx_vertex_lmkid = np.load(self.smplx_vertex_lmkid_path)
+        # shared, read-only assets: every SMPLX() of the process maps the same arrays
+        self.smplx_faces = load_array(self.smplx_faces_path)
+        self.smplx_verts = load_array(self.smplx_verts_path)
+        self.smpl_verts = load_array(self.smpl_verts_path)
+        self.smpl_faces = load_array(self.smpl_faces_path)
+        self.smplx_vertex_lmkid = load_array(self.smplx_vertex_lmkid_path)
 
-        self.smpl_vert_seg = json.load(open(self.smpl_vert_seg_path))
+        self.smpl_vert_seg = load_object(self.smpl_vert_seg_path, lambda path: json.load(open(path)))
         self.smpl_mano_vid = np.concatenate([
             self.smpl_vert_seg["rightHand"], self.smpl_vert_seg["rightHandIndex1"],
             self.smpl_vert_seg["leftHand"], self.smpl_vert_seg["leftHandIndex1"]
         ])
 
-        self.smplx_eyeball_fid_mask = np.load(self.smplx_eyeball_fid_path)
-        self.smplx_mouth_fid = np.load(self.smplx_fill_mouth_fid_path)
-        self.smplx_mano_vid_dict = np.load(self.smplx_mano_vid_path, allow_pickle=True)
+        self.smplx_eyeball_fid_mask = load_array(self.smplx_eyeball_fid_path)
+        self.smplx_mouth_fid = load_array(self.smplx_fill_mouth_fid_path)
+        self.smplx_mano_vid_dict = load_object(
+            self.smplx_mano_vid_path, lambda path: np.load(path, allow_pickle=True)
+        )
         self.smplx_mano_vid = np.concatenate([
             self.smplx_mano_vid_dict["left_hand"], self.smplx_mano_vid_dict["right_hand"]
         ])
-        self.smplx_flame_vid = np.load(self.smplx_flame_vid_path, allow_pickle=True)
-        self.smplx_front_flame_vid = self.smplx_flame_vid[np.load(self.front_flame_path)]
+        self.smplx_flame_vid = load_array(self.smplx_flame_vid_path)
+        self.smplx_front_flame_vid = self.smplx_flame_vid[load_array(self.front_flame_path)]
 
         # hands
         self.smplx_mano_vertex_mask = torch.zeros(self.smplx_verts.shape[0], ).index_fill_(
@@ -103,7 +107,9 @@ class SMPLX:
             0, torch.tensor(self.smplx_faces[self.smplx_eyeball_fid_mask].flatten()), 1.0
         )
 
-        self.smplx_to_smpl = cPickle.load(open(self.smplx_to_smplx_path, "rb"))
+        self.smplx_to_smpl = load_object(
+            self.smplx_to_smplx_path, lambda path: cPickle.load(open(path, "rb"))
+        )
 
         self.model_dir = osp.join(self.current_dir, "models")
 
@@ -27,6 +27,7 @@ import torch.nn as nn
 
 logging.getLogger("smplx").setLevel(logging.ERROR)
 
+from .asset_registry import load_model_data, asset_tensor
 from .lbs import find_dynamic_lmk_idx_and_bcoords, lbs, vertices2landmarks
 from .utils import (
     Array,
@@ -156,8 +157,7 @@ class SMPL(nn.Module):
                 smpl_path = model_path
             assert osp.exists(smpl_path), "Path {} does not exist!".format(smpl_path)
 
-            with open(smpl_path, "rb") as smpl_file:
-                data_struct = Struct(**pickle.load(smpl_file, encoding="latin1"))
+            data_struct = load_model_data(smpl_path)
 
         super(SMPL, self).__init__()
         self.batch_size = batch_size
@@ -179,7 +179,7 @@ class SMPL(nn.Module):
         self._num_betas = num_betas
         shapedirs = shapedirs[:, :, :num_betas]
         # The shape components
-        self.register_buffer("shapedirs", to_tensor(to_np(shapedirs), dtype=dtype))
+        self.register_buffer("shapedirs", asset_tensor(shapedirs, dtype=dtype))
 
         if vertex_ids is None:
             # SMPL and SMPL-H share the same topology, so any extra joints can
@@ -247,30 +247,30 @@ class SMPL(nn.Module):
             v_template = data_struct.v_template
 
         if not torch.is_tensor(v_template):
-            v_template = to_tensor(to_np(v_template), dtype=dtype)
+            v_template = asset_tensor(v_template, dtype=dtype)
 
         if v_personal is not None:
             v_personal = to_tensor(to_np(v_personal), dtype=dtype)
-            v_template += v_personal
+            v_template = v_template + v_personal
 
         # The vertices of the template model
         self.register_buffer("v_template", v_template)
 
-        j_regressor = to_tensor(to_np(data_struct.J_regressor), dtype=dtype)
+        j_regressor = asset_tensor(data_struct.J_regressor, dtype=dtype)
         self.register_buffer("J_regressor", j_regressor)
 
         # Pose blend shape basis: 6890 x 3 x 207, reshaped to 6890*3 x 207
         num_pose_basis = data_struct.posedirs.shape[-1]
         # 207 x 20670
         posedirs = np.reshape(data_struct.posedirs, [-1, num_pose_basis]).T
-        self.register_buffer("posedirs", to_tensor(to_np(posedirs), dtype=dtype))
+        self.register_buffer("posedirs", asset_tensor(posedirs, dtype=dtype))
 
         # indices of parents for each joints
         parents = to_tensor(to_np(data_struct.kintree_table[0])).long()
         parents[0] = -1
         self.register_buffer("parents", parents)
 
-        self.register_buffer("lbs_weights", to_tensor(to_np(data_struct.weights), dtype=dtype))
+        self.register_buffer("lbs_weights", asset_tensor(data_struct.weights, dtype=dtype))
 
     @property
     def num_betas(self):
@@ -598,14 +598,10 @@ class SMPLH(SMPL):
                 smplh_path = model_path
             assert osp.exists(smplh_path), "Path {} does not exist!".format(smplh_path)
 
-            if ext == "pkl":
-                with open(smplh_path, "rb") as smplh_file:
-                    model_data = pickle.load(smplh_file, encoding="latin1")
-            elif ext == "npz":
-                model_data = np.load(smplh_path, allow_pickle=True)
-            else:
+            if ext not in ("pkl", "npz"):
                 raise ValueError("Unknown extension: {}".format(ext))
-            data_struct = Struct(**model_data)
+            model_data = load_model_data(smplh_path)
+            data_struct = model_data
 
         if vertex_ids is None:
             vertex_ids = VERTEX_IDS["smplh"]
@@ -1022,15 +1018,11 @@ class SMPLX(SMPLH):
             smplx_path = model_path
         assert osp.exists(smplx_path), "Path {} does not exist!".format(smplx_path)
 
-        if ext == "pkl":
-            with open(smplx_path, "rb") as smplx_file:
-                model_data = pickle.load(smplx_file, encoding="latin1")
-        elif ext == "npz":
-            model_data = np.load(smplx_path, allow_pickle=True)
-        else:
+        if ext not in ("pkl", "npz"):
             raise ValueError("Unknown extension: {}".format(ext))
+        model_data = load_model_data(smplx_path)
 
-        data_struct = Struct(**model_data)
+        data_struct = model_data
 
         super(SMPLX, self).__init__(
             model_path=model_path,
@@ -1104,7 +1096,7 @@ class SMPLX(SMPLH):
         self._num_expression_coeffs = num_expression_coeffs
 
         expr_dirs = shapedirs[:, :, expr_start_idx:expr_end_idx]
-        self.register_buffer("expr_dirs", to_tensor(to_np(expr_dirs), dtype=dtype))
+        self.register_buffer("expr_dirs", asset_tensor(expr_dirs, dtype=dtype))
 
         if create_expression:
             if expression is None:
@@ -1682,14 +1674,10 @@ class MANO(SMPL):
                 self.is_rhand = (True if "RIGHT" in os.path.basename(model_path) else False)
             assert osp.exists(mano_path), "Path {} does not exist!".format(mano_path)
 
-            if ext == "pkl":
-                with open(mano_path, "rb") as mano_file:
-                    model_data = pickle.load(mano_file, encoding="latin1")
-            elif ext == "npz":
-                model_data = np.load(mano_path, allow_pickle=True)
-            else:
+            if ext not in ("pkl", "npz"):
                 raise ValueError("Unknown extension: {}".format(ext))
-            data_struct = Struct(**model_data)
+            model_data = load_model_data(mano_path)
+            data_struct = model_data
 
         if vertex_ids is None:
             vertex_ids = VERTEX_IDS["smplh"]
@@ -1983,14 +1971,9 @@ class FLAME(SMPL):
         model_fn = f"FLAME_{gender.upper()}.{ext}"
         flame_path = os.path.join(model_path, model_fn)
         assert osp.exists(flame_path), "Path {} does not exist!".format(flame_path)
-        if ext == "npz":
-            file_data = np.load(flame_path, allow_pickle=True)
-        elif ext == "pkl":
-            with open(flame_path, "rb") as smpl_file:
-                file_data = pickle.load(smpl_file, encoding="latin1")
-        else:
+        if ext not in ("pkl", "npz"):
             raise ValueError("Unknown extension: {}".format(ext))
-        data_struct = Struct(**file_data)
+        data_struct = load_model_data(flame_path)
 
         super(FLAME, self).__init__(
             model_path=model_path,
@@ -2055,7 +2038,7 @@ class FLAME(SMPL):
         self._num_expression_coeffs = num_expression_coeffs
 
         expr_dirs = shapedirs[:, :, expr_start_idx:expr_end_idx]
-        self.register_buffer("expr_dirs", to_tensor(to_np(expr_dirs), dtype=dtype))
+        self.register_buffer("expr_dirs", asset_tensor(expr_dirs, dtype=dtype))
 
         if create_expression:
             if expression is None:
@@ -1,6 +1,10 @@
 import argparse
+import hashlib
+import json
 import logging
 import os, sys
+import time
+from contextlib import contextmanager
 os.environ['TORCH_HOME'] = './Weights/TorchHub'
 os.environ['WEIGHT_PATH'] = './Weights'
 os.environ['ECON_PATH'] = './data/Results_ECON'  # Path saving Results_ECON
@@ -39,6 +43,78 @@ class ColoredFilter(logging.Filter):
         return True
 
 
+class StartupProfile:
+    """
+    Wall-clock time of every startup stage, printed once the trainer is about to run.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        tic = time.perf_counter()
+        yield
+        self.stages.append((name, time.perf_counter() - tic))
+
+    def report(self, mode):
+        lines = [f"Startup profile ({mode}):"]
+        lines += [f"  {name:<24s}{sec:8.2f}s" for name, sec in self.stages]
+        lines.append(f"  {'total':<24s}{time.perf_counter() - self.start:8.2f}s")
+        print("\n".join(lines))
+
+
+CAPTION_CACHE = os.environ.get(
+    "CAPTION_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "humanref", "captions.json")
+)
+
+
+def caption_image(image_path: str) -> str:
+    """
+    BLIP-2 caption of the reference image, persisted in CAPTION_CACHE keyed by the
+    image content hash, so BLIP-2 (OPT-2.7B) is only loaded for unseen images.
+    """
+    with open(image_path, "rb") as f:
+        image_hash = hashlib.sha256(f.read()).hexdigest()
+
+    cache = {}
+    if os.path.exists(CAPTION_CACHE):
+        with open(CAPTION_CACHE, "r") as f:
+            cache = json.load(f)
+    if image_hash in cache:
+        print("*** Cached Caption: ", cache[image_hash])
+        return cache[image_hash]
+
+    import torch
+    from PIL import Image
+    from transformers import Blip2Processor, Blip2ForConditionalGeneration
+
+    print("load blip2 for image caption...")
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    processor = Blip2Processor.from_pretrained(os.path.join(os.getenv('WEIGHT_PATH'),"blip2-opt-2.7b"))
+    blip_model = Blip2ForConditionalGeneration.from_pretrained(os.path.join(os.getenv('WEIGHT_PATH'),"blip2-opt-2.7b"), torch_dtype=torch.float16).to(device)
+    image_pil = Image.open(image_path).convert("RGB")
+    inputs = processor(image_pil, return_tensors="pt").to(device, torch.float16)
+    out = blip_model.generate(**inputs)
+    caption = processor.batch_decode(out, skip_special_tokens=True)[0].strip()
+    caption = caption.replace("there is ", "")
+    caption = caption.replace("close up", "photo")
+    for d in ["black background", "white background"]:
+        if d in caption:
+            caption = caption.replace(d, "ground")
+    print("*** Predicted Caption: ", caption)
+    del blip_model, processor, inputs, out
+    torch.cuda.empty_cache()
+
+    cache[image_hash] = caption
+    os.makedirs(os.path.dirname(CAPTION_CACHE), exist_ok=True)
+    tmp_path = f"{CAPTION_CACHE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, CAPTION_CACHE)
+    return caption
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", default='configs/humanref.yaml', help="path to config file")
@@ -58,29 +134,33 @@ def main() -> None:
     os.environ["CUDA_DEVICE_ORDER"] = "PCI_BUS_ID"
     os.environ["CUDA_VISIBLE_DEVICES"] = args.gpu
     n_gpus = len(args.gpu.split(","))
+    mode = next(m for m in ["train", "validate", "test", "export", "none"] if m == "none" or getattr(args, m))
+    profile = StartupProfile()
 
-    import pytorch_lightning as pl
-    import torch
-    from PIL import Image
-    from pytorch_lightning import Trainer
-    from pytorch_lightning.callbacks import LearningRateMonitor, ModelCheckpoint
-    from pytorch_lightning.loggers import CSVLogger, TensorBoardLogger
-    from pytorch_lightning.utilities.rank_zero import rank_zero_only
-    from transformers import Blip2Processor, Blip2ForConditionalGeneration
+    # heavy dependencies of a single mode (BLIP-2, CLIP, LPIPS, diffusion guidance)
+    # are imported / loaded lazily where they are first used
+    with profile.stage("import lightning"):
+        import pytorch_lightning as pl
+        import torch
+        from pytorch_lightning import Trainer
+        from pytorch_lightning.callbacks import LearningRateMonitor, ModelCheckpoint
+        from pytorch_lightning.loggers import CSVLogger, TensorBoardLogger
+        from pytorch_lightning.utilities.rank_zero import rank_zero_only
 
     if args.typecheck:
         from jaxtyping import install_import_hook
         install_import_hook("threestudio", "typeguard.typechecked")
 
-    import threestudio
-    from threestudio.systems.base import BaseSystem
-    from threestudio.utils.callbacks import (
-        CodeSnapshotCallback,
-        ConfigSnapshotCallback,
-        CustomProgressBar,
-    )
-    from threestudio.utils.config import ExperimentConfig, load_yaml, resolve_config
-    from threestudio.utils.typing import Optional
+    with profile.stage("import threestudio"):
+        import threestudio
+        from threestudio.systems.base import BaseSystem
+        from threestudio.utils.callbacks import (
+            CodeSnapshotCallback,
+            ConfigSnapshotCallback,
+            CustomProgressBar,
+        )
+        from threestudio.utils.config import ExperimentConfig, load_yaml, resolve_config
+        from threestudio.utils.typing import Optional
     import warnings
     warnings.filterwarnings('ignore')
 
@@ -103,34 +183,22 @@ def main() -> None:
         print('Training from scratch!')
     
     # caption generation (require large memery, you can input a given prompt to skip this step!)
+    # the prompt names the trial dir, so every mode needs it, but it is cached per image
     if cfg.prompt is None or cfg.prompt == '':
-        print("load blip2 for image caption...")
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        processor = Blip2Processor.from_pretrained(os.path.join(os.getenv('WEIGHT_PATH'),"blip2-opt-2.7b"))
-        blip_model = Blip2ForConditionalGeneration.from_pretrained(os.path.join(os.getenv('WEIGHT_PATH'),"blip2-opt-2.7b"), torch_dtype=torch.float16).to(device)
-        image_pil = Image.open(cfg.image_path).convert("RGB")
-        inputs = processor(image_pil, return_tensors="pt").to(device, torch.float16)
-        out = blip_model.generate(**inputs)
-        caption = processor.batch_decode(out, skip_special_tokens=True)[0].strip()
-        caption = caption.replace("there is ", "")
-        caption = caption.replace("close up", "photo")
-        for d in ["black background", "white background"]:
-            if d in caption:
-                caption = caption.replace(d, "ground")
-        print("*** Predicted Caption: ", caption)
-        cfg.prompt = caption + ', high quality'
-        del blip_model, processor, inputs, out
-        torch.cuda.empty_cache()
-    
+        with profile.stage("caption"):
+            cfg.prompt = caption_image(cfg.image_path) + ', high quality'
+
     # Resolves all interpolations in the given config object in-place.
     cfg = resolve_config(cfg)
     cfg.data.workspace = cfg.trial_dir
     pl.seed_everything(cfg.seed)
 
-    dm = threestudio.find(cfg.data_type)(cfg.data)
-    system: BaseSystem = threestudio.find(cfg.system_type)(
-        cfg.system, resumed=cfg.resume is not None
-    )
+    with profile.stage("datamodule"):
+        dm = threestudio.find(cfg.data_type)(cfg.data)
+    with profile.stage("system"):
+        system: BaseSystem = threestudio.find(cfg.system_type)(
+            cfg.system, resumed=cfg.resume is not None
+        )
     system.set_save_dir(os.path.join(cfg.trial_dir, "save"))
     callbacks = []
     if args.train:
@@ -173,9 +241,11 @@ def main() -> None:
             )
         )()
 
-    trainer = Trainer(
-        callbacks=callbacks, logger=loggers, inference_mode=False, **cfg.trainer
-    )
+    with profile.stage("trainer"):
+        trainer = Trainer(
+            callbacks=callbacks, logger=loggers, inference_mode=False, **cfg.trainer
+        )
+    rank_zero_only(profile.report)(mode)
 
     def set_system_status(system: BaseSystem, ckpt_path: Optional[str]):
         if ckpt_path is None:
@@ -14,6 +14,8 @@
 #
 # Contact: ps-license@tuebingen.mpg.de
 
+import os
+
 import numpy as np
 import pytorch_lightning as pl
 import torch
@@ -34,6 +36,7 @@ class IFGeo(pl.LightningModule):
 
         self.use_sdf = cfg.sdf
         self.mcube_res = cfg.mcube_res
+        self.mcube_chunk = cfg.mcube_chunk
         self.clean_mesh_flag = cfg.clean_mesh
         self.overfit = cfg.overfit
 
@@ -67,11 +70,24 @@ class IFGeo(pl.LightningModule):
             debug=False,
             use_cuda_impl=False,
             faster=True,
+            chunk_size=self.mcube_chunk,
+            query_threads=cfg.get("query_threads", min(4, os.cpu_count() or 1)),
         )
 
         self.export_dir = None
         self.result_eval = {}
 
+    def set_precision(self, precision):
+        """
+        inference PrecisionMode of netG, applied by query_func_IF
+        (autocast, channels_last_3d conv weights, compiled encoder)
+        """
+        self.netG.precision = precision
+        if precision.channels_last:
+            self.netG.to(memory_format=torch.channels_last_3d)
+        if precision.compile:
+            self.netG.encode = torch.compile(self.netG.encode)
+
     # Training related
     def configure_optimizers(self):
 
@@ -98,8 +98,9 @@ if __name__ == "__main__":
     SMPLX_object = SMPLX()
 
     dataset = EvalDataset(cfg=cfg, device=device)
-    evaluator = Evaluator(device=device)
     export_dir = osp.join(cfg.results_path, cfg.name, "IF-Net+" if cfg.bni.use_ifnet else "SMPL-X")
+    # ground-truth samples / normal renders do not depend on the method, share them
+    evaluator = Evaluator(device=device, cache_dir=osp.join(cfg.results_path, cfg.name, "gt_cache"))
     print(colored(f"Dataset Size: {len(dataset)}", "green"))
 
     if cfg.bni.use_ifnet:
@@ -117,6 +118,45 @@ if __name__ == "__main__":
 
     pbar = tqdm(dataset)
     benchmark = {}
+    metric_path = osp.join(export_dir, "metric.npy")
+
+    if osp.exists(metric_path):
+        benchmark = np.load(metric_path, allow_pickle=True).item()
+
+    # subjects are evaluated in batches of eval_batch
+    eval_batch = 8
+    eval_queue = []
+
+    def evaluate_queue():
+
+        evaluator.set_meshes([item["result"] for item in eval_queue],
+                             scale=False,
+                             keys=[item["name"] for item in eval_queue])
+        chamfers, p2ss = evaluator.calculate_chamfer_p2s(num_samples=1000)
+        ncs = evaluator.calculate_normal_consist([item["nc_path"] for item in eval_queue])
+
+        for item, chamfer, p2s, nc in zip(eval_queue, chamfers, p2ss, ncs):
+            if item["dataset"] not in benchmark.keys():
+                benchmark[item["dataset"]] = {
+                    "chamfer": [chamfer.item()],
+                    "p2s": [p2s.item()],
+                    "nc": [nc.item()],
+                    "subject": [item["subject"]],
+                    "total": 1,
+                }
+            else:
+                benchmark[item["dataset"]]["chamfer"] += [chamfer.item()]
+                benchmark[item["dataset"]]["p2s"] += [p2s.item()]
+                benchmark[item["dataset"]]["nc"] += [nc.item()]
+                benchmark[item["dataset"]]["subject"] += [item["subject"]]
+                benchmark[item["dataset"]]["total"] += 1
+
+        np.save(metric_path, benchmark, allow_pickle=True)
+        eval_queue.clear()
+
+        pbar.set_description(
+            f"{item['name']} | {chamfer.item():.3f} | {p2s.item():.3f} | {nc.item():.4f}"
+        )
 
     for data in pbar:
 
@@ -200,6 +240,8 @@ if __name__ == "__main__":
                 with torch.no_grad():
                     sdf = ifnet.reconEngine(netG=ifnet.netG, batch=in_tensor)
                     verts_IF, faces_IF = ifnet.reconEngine.export_mesh(sdf)
+                # the encoder features cached by query_func_IF are done
+                in_tensor.pop("feat_geo_cache", None)
 
                 if ifnet.clean_mesh_flag:
                     verts_IF, faces_IF = clean_mesh(verts_IF, faces_IF)
@@ -254,42 +296,25 @@ if __name__ == "__main__":
             final_mesh = trimesh.load(final_path)
 
         # evaluation
-        metric_path = osp.join(export_dir, "metric.npy")
-
-        if osp.exists(metric_path):
-            benchmark = np.load(metric_path, allow_pickle=True).item()
-
         if benchmark == {} or data["dataset"] not in benchmark.keys(
         ) or f"{data['subject']}-{data['rotation']}" not in benchmark[data["dataset"]]["subject"]:
 
-            result_eval = {
-                "verts_gt": data["verts"][0],
-                "faces_gt": data["faces"][0],
-                "verts_pr": final_mesh.vertices,
-                "faces_pr": final_mesh.faces,
-                "calib": data["calib"][0],
-            }
-
-            evaluator.set_mesh(result_eval, scale=False)
-            chamfer, p2s = evaluator.calculate_chamfer_p2s(num_samples=1000)
-            nc = evaluator.calculate_normal_consist(osp.join(current_dir, f"{current_name}_nc.png"))
-
-            if data["dataset"] not in benchmark.keys():
-                benchmark[data["dataset"]] = {
-                    "chamfer": [chamfer.item()],
-                    "p2s": [p2s.item()],
-                    "nc": [nc.item()],
-                    "subject": [f"{data['subject']}-{data['rotation']}"],
-                    "total": 1,
-                }
-            else:
-                benchmark[data["dataset"]]["chamfer"] += [chamfer.item()]
-                benchmark[data["dataset"]]["p2s"] += [p2s.item()]
-                benchmark[data["dataset"]]["nc"] += [nc.item()]
-                benchmark[data["dataset"]]["subject"] += [f"{data['subject']}-{data['rotation']}"]
-                benchmark[data["dataset"]]["total"] += 1
-
-            np.save(metric_path, benchmark, allow_pickle=True)
+            eval_queue.append({
+                "name": current_name,
+                "dataset": data["dataset"],
+                "subject": f"{data['subject']}-{data['rotation']}",
+                "nc_path": osp.join(current_dir, f"{current_name}_nc.png"),
+                "result": {
+                    "verts_gt": data["verts"][0],
+                    "faces_gt": data["faces"][0],
+                    "verts_pr": final_mesh.vertices,
+                    "faces_pr": final_mesh.faces,
+                    "calib": data["calib"][0],
+                },
+            })
+
+            if len(eval_queue) >= eval_batch:
+                evaluate_queue()
 
         else:
 
@@ -299,9 +324,13 @@ if __name__ == "__main__":
             p2s = torch.tensor(benchmark[data["dataset"]]["p2s"][subject_idx])
             nc = torch.tensor(benchmark[data["dataset"]]["nc"][subject_idx])
 
-        pbar.set_description(
-            f"{current_name} | {chamfer.item():.3f} | {p2s.item():.3f} | {nc.item():.4f}"
-        )
+            pbar.set_description(
+                f"{current_name} | {chamfer.item():.3f} | {p2s.item():.3f} | {nc.item():.4f}"
+            )
+
+    if len(eval_queue) > 0:
+        evaluate_queue()
+    evaluator.flush()
 
     for dataset in benchmark.keys():
         for metric in ["chamfer", "p2s", "nc"]:
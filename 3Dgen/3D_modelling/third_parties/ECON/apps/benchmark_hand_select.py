@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# You can only use this computer program if you have closed
+# a license agreement with MPG or you get the right to use the computer
+# program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and
+# liable to prosecution.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# Contact: ps-license@tuebingen.mpg.de
+
+# Micro-benchmark of the visibility-gated hand / wrist selection of the PyMAF-X regressor:
+# per-sample list comprehension (previous implementation) vs. batched torch.where
+
+import argparse
+import time
+
+import torch
+
+from lib.pymafx.models.pymaf_net import select_visible
+
+
+def select_loop(visible, pred, fallback):
+    return torch.stack([
+        pred[_i] if visible[_i] else fallback[_i] for _i in range(pred.shape[0])
+    ])
+
+
+def timeit(fn, args, n_iter, device):
+    for _ in range(3):
+        fn(*args)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    tic = time.perf_counter()
+    for _ in range(n_iter):
+        fn(*args)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - tic) / n_iter * 1e3
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-gpu", "--gpu_device", type=int, default=0)
+    parser.add_argument("-n", "--n_iter", type=int, default=100)
+    args = parser.parse_args()
+
+    device = torch.device(
+        f"cuda:{args.gpu_device}" if torch.cuda.is_available() else "cpu"
+    )
+
+    print(f"{'batch':>6s}{'loop (ms)':>12s}{'where (ms)':>12s}")
+    for batch_size in [1, 4, 16, 64, 256]:
+        # 4 elbow / wrist rotation matrices and 15 * 6D hand poses per person
+        visible = torch.rand(batch_size, 4, device=device) > 0.5
+        joints = torch.randn(batch_size, 4, 3, 3, device=device)
+        body_joints = torch.randn(batch_size, 4, 3, 3, device=device)
+        hand = torch.randn(batch_size, 90, device=device)
+        mean_hand = torch.randn(1, 90, device=device)
+
+        def loop_all():
+            select_loop(visible.flatten(), joints.flatten(0, 1), body_joints.flatten(0, 1))
+            select_loop(visible[:, 0], hand, mean_hand.expand_as(hand))
+
+        def where_all():
+            select_visible(visible, joints, body_joints)
+            select_visible(visible[:, 0], hand, mean_hand)
+
+        print(
+            f"{batch_size:6d}{timeit(loop_all, (), args.n_iter, device):12.3f}"
+            f"{timeit(where_all, (), args.n_iter, device):12.3f}"
+        )
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# You can only use this computer program if you have closed
+# a license agreement with MPG or you get the right to use the computer
+# program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and
+# liable to prosecution.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# Contact: ps-license@tuebingen.mpg.de
+
+# Accuracy guard of the inference precision modes (cfg.infer): normal maps and IF-Net+
+# occupancies of a fixed validation set are compared against fp32. The validation set is
+# written by run_ECON.py with PRECISION_VAL_DIR=<dir>. Exits with 1 if a mode is out of tolerance.
+
+import argparse
+import glob
+import os
+import sys
+
+import torch
+
+sys.path.append(os.path.join(os.getcwd(), 'third_parties/ECON'))
+
+from apps.IFGeo import IFGeo
+from apps.Normal import Normal
+from lib.common.config import cfg
+from lib.common.seg3d_utils import create_grid3D
+from lib.common.train_util import query_func_IF
+from lib.net.NormalPredictor import NormalPredictor
+from lib.net.precision import PrecisionMode, normal_angle_error, occupancy_iou
+
+
+def load_normal(device):
+    normal_net = Normal.load_from_checkpoint(
+        cfg=cfg, checkpoint_path=cfg.normal_path, map_location=device, strict=False
+    )
+    return normal_net.to(device).netG.eval()
+
+
+def load_ifnet(device):
+    ifnet = IFGeo.load_from_checkpoint(
+        cfg=cfg, checkpoint_path=cfg.ifnet_path, map_location=device, strict=False
+    )
+    ifnet = ifnet.to(device)
+    ifnet.netG.eval()
+    return ifnet
+
+
+@torch.no_grad()
+def ifnet_occupancy(ifnet, sample, grid, device):
+    batch = {key: val.to(device) for key, val in sample.items()}
+    return torch.cat([
+        query_func_IF(batch, ifnet.netG, points.unsqueeze(0))
+        for points in torch.split(grid, cfg.mcube_chunk)
+    ],
+                     dim=-1)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-gpu", "--gpu_device", type=int, default=0)
+    parser.add_argument("-val_dir", "--val_dir", type=str, required=True)
+    parser.add_argument("-cfg", "--config", type=str, default="./third_parties/ECON/configs/econ.yaml")
+    parser.add_argument("-max_angle", "--max_angle", type=float, default=1.0)
+    parser.add_argument("-min_iou", "--min_iou", type=float, default=0.99)
+    parser.add_argument("-grid_res", "--grid_res", type=int, default=129)
+    args = parser.parse_args()
+
+    cfg.merge_from_file(args.config)
+    if os.getenv('WEIGHT_PATH') is not None:
+        cfg.normal_path = os.path.join(os.getenv('WEIGHT_PATH'), cfg.normal_path)
+    cfg.freeze()
+
+    device = torch.device(
+        f"cuda:{args.gpu_device}" if torch.cuda.is_available() else "cpu"
+    )
+
+    passed = True
+
+    normal_files = sorted(glob.glob(os.path.join(args.val_dir, "*_normal.pt")))
+    if len(normal_files) > 0:
+        ref = NormalPredictor(load_normal(device), PrecisionMode("fp32", device))
+        fast = NormalPredictor(
+            load_normal(device),
+            PrecisionMode.from_cfg(cfg.infer, cfg.infer.normal_precision, device)
+        )
+        errors = []
+        for normal_file in normal_files:
+            sample = torch.load(normal_file)
+            for nml, nml_ref in zip(fast(sample), ref(sample)):
+                errors.append(normal_angle_error(nml, nml_ref).item())
+        print(
+            f"normal {fast.precision}: {len(normal_files)} samples, "
+            f"angle error mean {sum(errors) / len(errors):.3f}, max {max(errors):.3f} deg"
+        )
+        passed &= max(errors) <= args.max_angle
+
+    ifnet_files = sorted(glob.glob(os.path.join(args.val_dir, "*_ifnet.pt")))
+    if len(ifnet_files) > 0:
+        ref = load_ifnet(device)
+        ref.set_precision(PrecisionMode("fp32", device))
+        fast = load_ifnet(device)
+        precision = PrecisionMode.from_cfg(cfg.infer, cfg.infer.ifnet_precision, device)
+        fast.set_precision(precision)
+
+        grid = create_grid3D(0, args.grid_res - 1, steps=args.grid_res).float().to(device)
+        grid = grid / (args.grid_res - 1) * 2.0 - 1.0
+        ious = []
+        for ifnet_file in ifnet_files:
+            sample = torch.load(ifnet_file)
+            ious.append(
+                occupancy_iou(
+                    ifnet_occupancy(fast, sample, grid, device),
+                    ifnet_occupancy(ref, sample, grid, device)
+                ).item()
+            )
+        print(
+            f"ifnet {precision}: {len(ifnet_files)} samples, "
+            f"occupancy IoU mean {sum(ious) / len(ious):.4f}, min {min(ious):.4f}"
+        )
+        passed &= min(ious) >= args.min_iou
+
+    if not passed:
+        print("precision check failed, keep cfg.infer at fp32 for these networks")
+        sys.exit(1)
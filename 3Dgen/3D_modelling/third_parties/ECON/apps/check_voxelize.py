@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# You can only use this computer program if you have closed
+# a license agreement with MPG or you get the right to use the computer
+# program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and
+# liable to prosecution.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# Contact: ps-license@tuebingen.mpg.de
+
+# Parity check of the cpu semantic voxelization against voxelize_cuda on random tetrahedra:
+# occupancy IoU, max / mean semantic difference on the shared voxels and timings
+
+import argparse
+import time
+
+import torch
+
+from lib.net.voxelize import voxelize_cuda, voxelize_semantic_cpu
+
+
+def random_tetrahedrons(batch_size, num_tets, num_verts, device):
+    vertices = torch.rand(batch_size, num_verts, 3, device=device) * 0.8 - 0.4
+    vertex_code = torch.rand(batch_size, num_verts, 3, device=device)
+    centers = torch.rand(batch_size, num_tets, 1, 3, device=device) * 0.8 - 0.4
+    tetrahedrons = centers + torch.randn(batch_size, num_tets, 4, 3, device=device) * 0.02
+    return vertices, vertex_code, tetrahedrons
+
+
+def voxelize_gpu(vertices, vertex_code, tetrahedrons, volume_res, sigma):
+    bs = vertices.shape[0]
+    occ_volume = torch.zeros(bs, volume_res, volume_res, volume_res, device=vertices.device)
+    semantic_volume = torch.zeros(bs, volume_res, volume_res, volume_res, 3, device=vertices.device)
+    weight_sum_volume = torch.full((bs, volume_res, volume_res, volume_res), 1e-3,
+                                   device=vertices.device)
+    return voxelize_cuda.forward_semantic_voxelization(
+        vertices, vertex_code, tetrahedrons, occ_volume, semantic_volume, weight_sum_volume, sigma
+    )[1]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-gpu", "--gpu_device", type=int, default=0)
+    parser.add_argument("-res", "--volume_res", type=int, default=128)
+    parser.add_argument("-sigma", "--sigma", type=float, default=0.05)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    vertices, vertex_code, tetrahedrons = random_tetrahedrons(2, 2000, 1000, "cpu")
+
+    tic = time.perf_counter()
+    vol_cpu = voxelize_semantic_cpu(
+        vertices, vertex_code, tetrahedrons, args.volume_res, args.sigma
+    )
+    print(f"cpu: {(time.perf_counter() - tic) * 1e3:.1f} ms")
+
+    if voxelize_cuda is None or not torch.cuda.is_available():
+        print("voxelize_cuda is not available, skipping the parity check")
+        exit()
+
+    device = torch.device(f"cuda:{args.gpu_device}")
+    torch.cuda.synchronize(device)
+    tic = time.perf_counter()
+    vol_gpu = voxelize_gpu(
+        vertices.to(device), vertex_code.to(device), tetrahedrons.to(device), args.volume_res,
+        args.sigma
+    ).cpu()
+    torch.cuda.synchronize(device)
+    print(f"cuda: {(time.perf_counter() - tic) * 1e3:.1f} ms")
+
+    occ_cpu = vol_cpu.abs().sum(-1) > 0
+    occ_gpu = vol_gpu.abs().sum(-1) > 0
+    iou = (occ_cpu & occ_gpu).sum() / (occ_cpu | occ_gpu).sum().clamp(min=1)
+    diff = (vol_cpu - vol_gpu)[occ_cpu & occ_gpu].abs()
+    print(f"occupancy IoU: {iou:.4f}")
+    if len(diff) > 0:
+        print(f"semantic diff: max {diff.max():.2e}, mean {diff.mean():.2e}")
@@ -96,6 +96,7 @@ if __name__ == "__main__":
 
     # SMPLX object
     SMPLX_object = SMPLX()
+    smplx_topology = get_topology("cpu")
     dataset_param = {
         "image_dir": args.in_dir,
         "seg_dir": args.seg_dir,
@@ -498,7 +499,7 @@ if __name__ == "__main__":
 
                 side_mesh_path = f"{args.out_dir}/{cfg.name}/obj/{data['name']}_{idx}_IF.obj"
 
-                side_mesh = apply_face_mask(side_mesh, ~SMPLX_object.smplx_eyeball_fid_mask)
+                side_mesh = apply_face_mask(side_mesh, ~smplx_topology.eyeball_face_mask)
 
                 # mesh completion via IF-net
                 in_tensor.update(
@@ -519,6 +520,8 @@ if __name__ == "__main__":
                 with torch.no_grad():
                     sdf = ifnet.reconEngine(netG=ifnet.netG, batch=in_tensor)
                     verts_IF, faces_IF = ifnet.reconEngine.export_mesh(sdf)
+                # the encoder features cached by query_func_IF are done
+                in_tensor.pop("feat_geo_cache", None)
 
                 if ifnet.clean_mesh_flag:
                     verts_IF, faces_IF = clean_mesh(verts_IF, faces_IF)
@@ -527,13 +530,7 @@ if __name__ == "__main__":
                 side_mesh = remesh_laplacian(side_mesh, side_mesh_path)
 
             else:
-                side_mesh = apply_vertex_mask(
-                    side_mesh,
-                    (
-                        SMPLX_object.front_flame_vertex_mask + SMPLX_object.smplx_mano_vertex_mask +
-                        SMPLX_object.eyeball_vertex_mask
-                    ).eq(0).float(),
-                )
+                side_mesh = apply_vertex_mask(side_mesh, smplx_topology.body_vertex_mask)
 
                 #register side_mesh to BNI surfaces
                 side_mesh = Meshes(
@@ -560,7 +557,7 @@ if __name__ == "__main__":
             if "face" in cfg.bni.use_smpl:
 
                 # only face
-                face_mesh = apply_vertex_mask(face_mesh, SMPLX_object.front_flame_vertex_mask)
+                face_mesh = apply_vertex_mask(face_mesh, smplx_topology.front_flame_vertex_mask)
                 face_mesh.vertices = face_mesh.vertices - np.array([0, 0, cfg.bni.thickness])
 
                 # remove face neighbor triangles
@@ -580,15 +577,7 @@ if __name__ == "__main__":
 
             if "hand" in cfg.bni.use_smpl and (True in data['hands_visibility'][idx]):
 
-                hand_mask = torch.zeros(SMPLX_object.smplx_verts.shape[0], )
-                if data['hands_visibility'][idx][0]:
-                    hand_mask.index_fill_(
-                        0, torch.tensor(SMPLX_object.smplx_mano_vid_dict["left_hand"]), 1.0
-                    )
-                if data['hands_visibility'][idx][1]:
-                    hand_mask.index_fill_(
-                        0, torch.tensor(SMPLX_object.smplx_mano_vid_dict["right_hand"]), 1.0
-                    )
+                hand_mask = smplx_topology.visible_hand_mask(data['hands_visibility'][idx])
 
                 # only hands
                 hand_mesh = apply_vertex_mask(hand_mesh, hand_mask)
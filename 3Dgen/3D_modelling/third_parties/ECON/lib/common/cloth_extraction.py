@@ -1,12 +1,10 @@
-import itertools
 import json
 import os
-from collections import Counter
 
+import cv2
 import numpy as np
 import trimesh
-from matplotlib.path import Path
-from sklearn.neighbors import KNeighborsClassifier
+from scipy.spatial import cKDTree
 
 
 def load_segmentation(path, shape):
@@ -46,6 +44,66 @@ def load_segmentation(path, shape):
         return segmentations
 
 
+# per-vertex integer part labels of SMPL, index into SMPL_PARTS, -1 for unlabeled vertices
+SMPL_PARTS = None
+SMPL_VERT_LABELS = None
+
+# nearest-neighbour index of the last SMPL mesh, (vertices, cKDTree)
+_smpl_tree_cache = [None, None]
+
+# max number of garment items in one label image (one bit per item)
+MAX_ITEMS = 32
+
+
+def load_smpl_vert_labels():
+    global SMPL_PARTS, SMPL_VERT_LABELS
+
+    if SMPL_VERT_LABELS is None:
+        with open(os.path.join(os.path.dirname(__file__), "smpl_vert_segmentation.json")) as f:
+            smpl_vert_segmentation = json.load(f)
+        SMPL_PARTS = list(smpl_vert_segmentation.keys())
+        n = max(max(val) for val in smpl_vert_segmentation.values()) + 1
+        SMPL_VERT_LABELS = np.full(n, -1, dtype=np.int64)
+        # vertices listed in several parts keep the last one
+        for label, val in enumerate(smpl_vert_segmentation.values()):
+            SMPL_VERT_LABELS[val] = label
+
+    return SMPL_PARTS, SMPL_VERT_LABELS
+
+
+def smpl_tree(smpl):
+    """cKDTree on the SMPL vertices, rebuilt only when the vertices change"""
+
+    vertices = np.asarray(smpl.vertices)
+    cached_vertices, tree = _smpl_tree_cache
+    if cached_vertices is None or cached_vertices.shape != vertices.shape or not np.array_equal(
+        cached_vertices, vertices
+    ):
+        tree = cKDTree(vertices)
+        _smpl_tree_cache[:] = [vertices.copy(), tree]
+    return tree
+
+
+def smpl_to_recon_vert_labels(recon, smpl):
+    """
+    Integer bodypart label (index into SMPL_PARTS) of every recon vertex, taken from the nearest smpl vertex
+    Arguments:
+        recon: trimesh object (fully clothed model)
+        smpl: trimesh object (smpl model)
+    Returns:
+        Returns the [N] label array and the part names
+    """
+    parts, smpl_labels = load_smpl_vert_labels()
+
+    # the labels cover the SMPL vertices, any further vertex (e.g. of SMPL-X) is unlabeled
+    num_verts = len(smpl.vertices)
+    vert_labels = np.full(num_verts, -1, dtype=np.int64)
+    vert_labels[:min(num_verts, len(smpl_labels))] = smpl_labels[:num_verts]
+
+    _, idx = smpl_tree(smpl).query(np.asarray(recon.vertices), k=1)
+    return vert_labels[idx], parts
+
+
 def smpl_to_recon_labels(recon, smpl, k=1):
     """
     Get the bodypart labels for the recon object by using the labels from the corresponding smpl object
@@ -56,40 +114,106 @@ def smpl_to_recon_labels(recon, smpl, k=1):
     Returns:
         Returns a dictionary containing the bodypart and the corresponding indices
     """
-    smpl_vert_segmentation = json.load(
-        open(os.path.join(os.path.dirname(__file__), "smpl_vert_segmentation.json"))
-    )
-    n = smpl.vertices.shape[0]
-    y = np.array([None] * n)
-    for key, val in smpl_vert_segmentation.items():
-        y[val] = key
-
-    classifier = KNeighborsClassifier(n_neighbors=1)
-    classifier.fit(smpl.vertices, y)
-
-    y_pred = classifier.predict(recon.vertices)
+    y_pred, parts = smpl_to_recon_vert_labels(recon, smpl)
 
     recon_labels = {}
-    for key in smpl_vert_segmentation.keys():
-        recon_labels[key] = list(np.argwhere(y_pred == key).flatten().astype(int))
+    for label, key in enumerate(parts):
+        recon_labels[key] = list(np.flatnonzero(y_pred == label))
 
     return recon_labels
 
 
-def extract_cloth(recon, segmentation, K, R, t, smpl=None):
+def body_parts_to_remove(type):
+    """bodyparts that are most likely not part of a DeepFashion2 item of this category"""
+
+    parts = [
+        "rightHand",
+        "leftToeBase",
+        "leftFoot",
+        "rightFoot",
+        "head",
+        "leftHandIndex1",
+        "rightHandIndex1",
+        "rightToeBase",
+        "leftHand",
+        "rightHand",
+    ]
+
+    # Remove additional bodyparts that are most likely not part of the segmentation but might intersect (e.g. hand in front of torso)
+    # https://github.com/switchablenorms/DeepFashion2
+    # Short sleeve clothes
+    if type == 1 or type == 3 or type == 10:
+        parts += ["leftForeArm", "rightForeArm"]
+    # No sleeves at all or lower body clothes
+    elif (type == 5 or type == 6 or type == 12 or type == 13 or type == 8 or type == 9):
+        parts += [
+            "leftForeArm",
+            "rightForeArm",
+            "leftArm",
+            "rightArm",
+        ]
+    # Shorts
+    elif type == 7:
+        parts += [
+            "leftLeg",
+            "rightLeg",
+            "leftForeArm",
+            "rightForeArm",
+            "leftArm",
+            "rightArm",
+        ]
+
+    return parts
+
+
+def rasterize_items(polygons_lst, vertices_xy, resolution=2048):
     """
-    Extract a portion of a mesh using 2d segmentation coordinates
+    Rasterize the polygons of all items into one bitmask label image (bit i set = inside item i)
+    and look up the label of every vertex
+    Arguments:
+        polygons_lst: list (items) of lists of [M, 2] polygons, in the same space as vertices_xy
+        vertices_xy: [N, 2] vertex coordinates
+        resolution: pixels along the longer side of the vertex bounding box
+    Returns:
+        Returns the [N] item bitmask of every vertex
+    """
+    assert len(polygons_lst) <= MAX_ITEMS, f"at most {MAX_ITEMS} items per label image"
+
+    xy_min = vertices_xy.min(axis=0)
+    pixel_size = max((vertices_xy.max(axis=0) - xy_min).max(), 1e-8) / (resolution - 1)
+    # rounded vertex pixels reach ceil(extent / pixel_size)
+    width, height = np.ceil((vertices_xy.max(axis=0) - xy_min) / pixel_size).astype(int) + 1
+
+    label_img = np.zeros((height, width), dtype=np.uint32)
+    item_img = np.zeros((height, width), dtype=np.uint8)
+    shift = 8    # sub-pixel precision of the polygon vertices
+    for item_idx, polygons in enumerate(polygons_lst):
+        item_img[:] = 0
+        for polygon in polygons:
+            pts = np.round((polygon - xy_min) / pixel_size * (1 << shift)).astype(np.int32)
+            cv2.fillPoly(item_img, [pts], 1, lineType=cv2.LINE_8, shift=shift)
+        label_img |= item_img.astype(np.uint32) << np.uint32(item_idx)
+
+    pix = np.round((vertices_xy - xy_min) / pixel_size).astype(int)
+    return label_img[pix[:, 1], pix[:, 0]]
+
+
+def extract_clothes(recon, segmentations, K, R, t, smpl=None, resolution=2048):
+    """
+    Extract the portions of a mesh covered by every 2d segmentation (all items in one pass)
     Arguments:
         recon: fully clothed mesh
-        seg_coord: segmentation coordinates in 2D (NDC)
+        segmentations: list of segmentations, each with
+            coord_normalized: segmentation polygons in 2D (NDC)
+            type_id: DeepFashion2 category id
         K: intrinsic matrix of the projection
         R: rotation matrix of the projection
         t: translation vector of the projection
+        smpl: smpl mesh, used to remove bodyparts that do not belong to the item
+        resolution: resolution of the polygon label image
     Returns:
-        Returns a submesh using the segmentation coordinates
+        Returns a list with one submesh (or None if empty) per segmentation
     """
-    seg_coord = segmentation["coord_normalized"]
-    mesh = trimesh.Trimesh(recon.vertices, recon.faces)
     extrinsic = np.zeros((3, 4))
     extrinsic[:3, :3] = R
     extrinsic[:, 3] = t
@@ -97,99 +221,60 @@ def extract_cloth(recon, segmentation, K, R, t, smpl=None):
 
     P_inv = np.linalg.pinv(P)
 
-    # Each segmentation can contain multiple polygons
-    # We need to check them separately
-    points_so_far = []
-    faces = recon.faces
-    for polygon in seg_coord:
-        n = len(polygon)
-        coords_h = np.hstack((polygon, np.ones((n, 1))))
-        # Apply the inverse projection on homogeneus 2D coordinates to get the corresponding 3d Coordinates
-        XYZ = P_inv @ coords_h[:, :, None]
-        XYZ = XYZ.reshape((XYZ.shape[0], XYZ.shape[1]))
-        XYZ = XYZ[:, :3] / XYZ[:, 3, None]
+    # Apply the inverse projection on homogeneus 2D coordinates of all polygons at once
+    # to get the corresponding 3d Coordinates
+    polygons = [np.asarray(polygon) for seg in segmentations for polygon in seg["coord_normalized"]]
+    coords = np.concatenate(polygons, axis=0)
+    coords_h = np.hstack((coords, np.ones((len(coords), 1))))
+    XYZ = coords_h @ P_inv.T
+    XYZ = XYZ[:, :3] / XYZ[:, 3, None]
 
-        p = Path(XYZ[:, :2])
+    splits = np.cumsum([len(polygon) for polygon in polygons])[:-1]
+    polygons_xy = iter(np.split(XYZ[:, :2], splits))
+    polygons_lst = [[next(polygons_xy) for _ in seg["coord_normalized"]] for seg in segmentations]
 
-        grid = p.contains_points(recon.vertices[:, :2])
-        indeces = np.argwhere(grid == True)
-        points_so_far += list(indeces.flatten())
+    vertices = np.asarray(recon.vertices)
+    faces = np.asarray(recon.faces)
+    item_bits = rasterize_items(polygons_lst, vertices[:, :2], resolution)
 
-    if smpl is not None:
-        num_verts = recon.vertices.shape[0]
-        recon_labels = smpl_to_recon_labels(recon, smpl)
-        body_parts_to_remove = [
-            "rightHand",
-            "leftToeBase",
-            "leftFoot",
-            "rightFoot",
-            "head",
-            "leftHandIndex1",
-            "rightHandIndex1",
-            "rightToeBase",
-            "leftHand",
-            "rightHand",
-        ]
-        type = segmentation["type_id"]
-
-        # Remove additional bodyparts that are most likely not part of the segmentation but might intersect (e.g. hand in front of torso)
-        # https://github.com/switchablenorms/DeepFashion2
-        # Short sleeve clothes
-        if type == 1 or type == 3 or type == 10:
-            body_parts_to_remove += ["leftForeArm", "rightForeArm"]
-        # No sleeves at all or lower body clothes
-        elif (type == 5 or type == 6 or type == 12 or type == 13 or type == 8 or type == 9):
-            body_parts_to_remove += [
-                "leftForeArm",
-                "rightForeArm",
-                "leftArm",
-                "rightArm",
-            ]
-        # Shorts
-        elif type == 7:
-            body_parts_to_remove += [
-                "leftLeg",
-                "rightLeg",
-                "leftForeArm",
-                "rightForeArm",
-                "leftArm",
-                "rightArm",
-            ]
-
-        verts_to_remove = list(
-            itertools.chain.from_iterable([recon_labels[part] for part in body_parts_to_remove])
-        )
-
-        label_mask = np.zeros(num_verts, dtype=bool)
-        label_mask[verts_to_remove] = True
-
-        seg_mask = np.zeros(num_verts, dtype=bool)
-        seg_mask[points_so_far] = True
+    # [n_items, N] vertices inside each item
+    vert_masks = (item_bits[None, :] >> np.arange(len(segmentations), dtype=np.uint32)[:, None]) & 1
+    vert_masks = vert_masks.astype(bool)
 
+    if smpl is not None:
         # Remove points that belong to other bodyparts
-        # If a vertice in pointsSoFar is included in the bodyparts to remove, then these points should be removed
-        extra_verts_to_remove = np.array(list(seg_mask) and list(label_mask))
-
-        combine_mask = np.zeros(num_verts, dtype=bool)
-        combine_mask[points_so_far] = True
-        combine_mask[extra_verts_to_remove] = False
-
-        all_indices = np.argwhere(combine_mask == True).flatten()
-
-    i_x = np.where(np.in1d(faces[:, 0], all_indices))[0]
-    i_y = np.where(np.in1d(faces[:, 1], all_indices))[0]
-    i_z = np.where(np.in1d(faces[:, 2], all_indices))[0]
-
-    faces_to_keep = np.array(list(set(i_x).union(i_y).union(i_z)))
-    mask = np.zeros(len(recon.faces), dtype=bool)
-    if len(faces_to_keep) > 0:
-        mask[faces_to_keep] = True
-
-        mesh.update_faces(mask)
+        vert_labels, parts = smpl_to_recon_vert_labels(recon, smpl)
+        part_ids = {part: label for label, part in enumerate(parts)}
+        for item_idx, seg in enumerate(segmentations):
+            remove_ids = [part_ids[part] for part in body_parts_to_remove(seg["type_id"])]
+            vert_masks[item_idx] &= ~np.isin(vert_labels, remove_ids)
+
+    # a face is kept if any of its vertices is kept
+    face_masks = vert_masks[:, faces].any(axis=2)
+
+    meshes = []
+    for face_mask in face_masks:
+        if not face_mask.any():
+            meshes.append(None)
+            continue
+        mesh = trimesh.Trimesh(recon.vertices, recon.faces)
+        mesh.update_faces(face_mask)
         mesh.remove_unreferenced_vertices()
+        meshes.append(mesh)
 
-        # mesh.rezero()
+    return meshes
 
-        return mesh
 
-    return None
+def extract_cloth(recon, segmentation, K, R, t, smpl=None):
+    """
+    Extract a portion of a mesh using 2d segmentation coordinates
+    Arguments:
+        recon: fully clothed mesh
+        seg_coord: segmentation coordinates in 2D (NDC)
+        K: intrinsic matrix of the projection
+        R: rotation matrix of the projection
+        t: translation vector of the projection
+    Returns:
+        Returns a submesh using the segmentation coordinates
+    """
+    return extract_clothes(recon, [segmentation], K, R, t, smpl=smpl)[0]
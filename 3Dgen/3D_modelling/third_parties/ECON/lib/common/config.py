@@ -58,6 +58,7 @@ _C.agora = False
 _C.optim_cloth = False
 _C.optim_body = False
 _C.mcube_res = 256
+_C.mcube_chunk = 262144
 _C.clean_mesh = True
 _C.remesh = False
 _C.body_overlap_thres = 1.0
@@ -88,6 +89,19 @@ _C.net.norm_color = "group"
 _C.net.hg_down = "ave_pool"
 _C.net.num_views = 1
 
+# inference precision of the normal / IF-Net+ networks, fp32 / fp16 / bf16 / auto
+# (fp16 on GPU, bf16 on CPU). fp32 by default, enable a faster mode only after
+# apps/check_precision.py passed for it (see configs/econ.yaml)
+_C.infer = CN()
+_C.infer.normal_precision = "fp32"
+_C.infer.ifnet_precision = "fp32"
+_C.infer.channels_last = True
+_C.infer.compile = False
+# the body fitting re-predicts the normals of a body once its SMPL-X parameters moved
+# more than this since its last prediction (0: every iteration), the last iteration
+# always predicts from the current fit
+_C.infer.normal_refresh_tol = 1e-2
+
 _C.bni = CN()
 _C.bni.k = 4
 _C.bni.lambda1 = 1e-4
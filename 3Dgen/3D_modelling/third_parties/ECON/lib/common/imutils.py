@@ -1,4 +1,6 @@
 import os, sys
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
 os.environ["OPENCV_IO_ENABLE_OPENEXR"] = "1"
 import cv2
@@ -92,38 +94,106 @@ def load_img(img_file, withmask=False):
     return torch.tensor(img).permute(2, 0, 1).unsqueeze(0).float(), img.shape[:2], mask
 
 
+class KeypointService:
+    """
+    MediaPipe Holistic landmark detector with warm graphs.
+        1. graphs are built once per process (forked workers rebuild their own)
+            and reused for every image, static_image_mode keeps no state between images
+        2. num_graphs > 1 keeps a pool of graphs, batch() then runs the crops in parallel threads
+        3. landmark protobufs are converted to one [N, 4] array per part
+    """
+
+    fake_kps = np.zeros((33, 4), dtype=np.float32)
+
+    def __init__(self, num_graphs=1, model_complexity=2):
+
+        self.num_graphs = num_graphs
+        self.model_complexity = model_complexity
+        self.pid = None
+        self.graphs = None
+
+    def _graph_pool(self):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.graphs = queue.Queue()
+            for _ in range(self.num_graphs):
+                self.graphs.put(
+                    mp.solutions.holistic.Holistic(
+                        static_image_mode=True,
+                        model_complexity=self.model_complexity,
+                    )
+                )
+        return self.graphs
+
+    @staticmethod
+    def collect_xyv(landmarks, body=True):
+        if landmarks is None:
+            return KeypointService.fake_kps.copy()
+        lmks = np.array([(lmk.x, lmk.y, lmk.z, lmk.visibility) for lmk in landmarks.landmark],
+                        dtype=np.float32)
+        if not body:
+            lmks[:, 3] = 1.0
+        return lmks
+
+    def process(self, image):
+        graphs = self._graph_pool()
+        holistic = graphs.get()
+        try:
+            results = holistic.process(image)
+        finally:
+            graphs.put(holistic)
+
+        return {
+            "body": self.collect_xyv(results.pose_landmarks),
+            "lhand": self.collect_xyv(results.left_hand_landmarks, False),
+            "rhand": self.collect_xyv(results.right_hand_landmarks, False),
+            "face": self.collect_xyv(results.face_landmarks, False),
+        }
+
+    def __call__(self, image):
+        """
+        - image: [H, W, 3] uint8 RGB
+        return: dict of [N, 4] (x, y, z, visibility) landmark tensors
+        """
+        return {key: torch.from_numpy(val) for key, val in self.process(image).items()}
+
+    def batch(self, images):
+        """
+        - images: list of [H, W, 3] uint8 RGB crops
+        return: list of landmark dicts aligned with images
+        """
+        if self.num_graphs > 1 and len(images) > 1:
+            self._graph_pool()
+            with ThreadPoolExecutor(max_workers=self.num_graphs) as executor:
+                return list(executor.map(self, images))
+        return [self(image) for image in images]
+
+    def close(self):
+        if self.graphs is not None and self.pid == os.getpid():
+            while not self.graphs.empty():
+                self.graphs.get().close()
+        self.pid = None
+        self.graphs = None
+
+
+_keypoint_service = None
+
+
+def get_keypoint_service():
+    """process-wide KeypointService, its pool size is read from MEDIAPIPE_GRAPHS (default 1)"""
+
+    global _keypoint_service
+    if _keypoint_service is None:
+        _keypoint_service = KeypointService(num_graphs=int(os.environ.get("MEDIAPIPE_GRAPHS", 1)))
+    return _keypoint_service
+
+
 def get_keypoints(image):
-    def collect_xyv(x, body=True):
-        lmk = x.landmark
-        all_lmks = []
-        for i in range(len(lmk)):
-            visibility = lmk[i].visibility if body else 1.0
-            all_lmks.append(torch.Tensor([lmk[i].x, lmk[i].y, lmk[i].z, visibility]))
-        return torch.stack(all_lmks).view(-1, 4)
-
-    mp_holistic = mp.solutions.holistic
-
-    with mp_holistic.Holistic(
-        static_image_mode=True,
-        model_complexity=2,
-    ) as holistic:
-        results = holistic.process(image)
-
-    fake_kps = torch.zeros(33, 4)
-
-    result = {}
-    result["body"] = collect_xyv(results.pose_landmarks) if results.pose_landmarks else fake_kps
-    result["lhand"] = collect_xyv(
-        results.left_hand_landmarks, False
-    ) if results.left_hand_landmarks else fake_kps
-    result["rhand"] = collect_xyv(
-        results.right_hand_landmarks, False
-    ) if results.right_hand_landmarks else fake_kps
-    result["face"] = collect_xyv(
-        results.face_landmarks, False
-    ) if results.face_landmarks else fake_kps
-
-    return result
+    return get_keypoint_service()(image)
+
+
+def get_keypoints_batch(images):
+    return get_keypoint_service().batch(images)
 
 
 def get_pymafx(image, landmarks):
@@ -248,6 +318,7 @@ def process_image(img_file, hps_type, single, input_res, detector, withmask=Fals
     img_crop_lst = []
     img_hps_lst = []
     img_mask_lst = []
+    img_np_lst = []
     landmark_lst = []
     hands_visibility_lst = []
     img_pymafx_lst = []
@@ -296,7 +367,14 @@ def process_image(img_file, hps_type, single, input_res, detector, withmask=Fals
         img_hps = transform_to_tensor(224, constants.IMG_NORM_MEAN,
                                       constants.IMG_NORM_STD)(Image.fromarray(img_np))
 
-        landmarks = get_keypoints(img_np)
+        img_np_lst.append(img_np)
+        img_crop_lst.append(torch.tensor(img_crop).permute(2, 0, 1) / 255.0)
+        img_icon_lst.append(img_icon)
+        img_hps_lst.append(img_hps)
+        img_mask_lst.append(torch.tensor(img_mask[..., 0]))
+
+    # landmarks of all crops from the warm MediaPipe graph(s)
+    for img_np, landmarks in zip(img_np_lst, get_keypoints_batch(img_np_lst)):
 
         # get hands visibility
         hands_visibility = [True, True]
@@ -314,10 +392,6 @@ def process_image(img_file, hps_type, single, input_res, detector, withmask=Fals
                 )
             )
 
-        img_crop_lst.append(torch.tensor(img_crop).permute(2, 0, 1) / 255.0)
-        img_icon_lst.append(img_icon)
-        img_hps_lst.append(img_hps)
-        img_mask_lst.append(torch.tensor(img_mask[..., 0]))
         landmark_lst.append(landmarks['body'])
 
     # required image tensors / arrays
@@ -15,6 +15,7 @@
 # Contact: ps-license@tuebingen.mpg.de
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import torch
@@ -42,10 +43,14 @@ class Seg3dLossless(nn.Module):
         use_cuda_impl=False,
         faster=False,
         use_shadow=False,
+        chunk_size=None,
+        query_threads=1,
         **kwargs,
     ):
         """
         align_corners: same with how you process gt. (grid_sample / interpolate)
+        chunk_size: max number of points per subject sent to query_func at once
+        query_threads: number of chunks queried concurrently on cpu tensors
         """
         super().__init__()
         self.query_func = query_func
@@ -62,6 +67,8 @@ class Seg3dLossless(nn.Module):
         self.register_buffer("resolutions", resolutions)
         self.batchsize = self.b_min.size(0)
         assert self.batchsize == 1
+        self.chunk_size = chunk_size
+        self.query_threads = query_threads
         self.balance_value = balance_value
         self.channels = channels
         assert self.channels == 1
@@ -139,6 +146,31 @@ class Seg3dLossless(nn.Module):
         else:
             return self._forward(**kwargs)
 
+    @torch.no_grad()
+    def batch_eval_chunked(self, coords, **kwargs):
+        """
+        same as batch_eval, but streams the points through query_func in chunks
+        of self.chunk_size points per subject to bound the peak memory
+        """
+        if self.chunk_size is None or coords.size(1) <= self.chunk_size:
+            return self.batch_eval(coords, **kwargs)
+        coords_chunks = torch.split(coords, self.chunk_size, dim=1)
+
+        # the per-chunk cpu ops are too small to keep all cores busy, so several chunks are
+        # queried at once (torch releases the GIL inside its kernels). The first chunk runs
+        # alone, so that query_func fills its feature cache only once
+        if coords.device.type == "cpu" and self.query_threads > 1:
+            occupancys = [self.batch_eval(coords_chunks[0], **kwargs)]
+            with ThreadPoolExecutor(max_workers=self.query_threads) as executor:
+                occupancys += list(
+                    executor.map(lambda coords_chunk: self.batch_eval(coords_chunk, **kwargs),
+                                 coords_chunks[1:])
+                )
+            return torch.cat(occupancys, dim=2)
+
+        return torch.cat([self.batch_eval(coords_chunk, **kwargs) for coords_chunk in coords_chunks],
+                         dim=2)
+
     @torch.no_grad()
     def _forward_faster(self, **kwargs):
         """
@@ -146,19 +178,27 @@ class Seg3dLossless(nn.Module):
         1. no conflict checking: 4.88 fps -> 6.56 fps
         2. smooth_conv9x9 ~ smooth_conv3x3 for different resolution
         3. last step no examine
+
+        The evaluated points are tracked as a bitmask on the finest grid (instead of
+        re-uniquing the evaluated coords), and the boundary points of each level are
+        queried in chunks.
         """
-        final_W = self.resolutions[-1][0]
-        final_H = self.resolutions[-1][1]
-        final_D = self.resolutions[-1][2]
+        final_W, final_H, final_D = self.resolutions[-1].tolist()
+
+        # evaluated points on the finest grid, a level with stride s sees it as [::s]
+        calculated = torch.zeros((self.batchsize, final_D, final_H, final_W),
+                                 dtype=torch.bool,
+                                 device=self.calculated.device)
 
         for resolution in self.resolutions:
-            W, H, D = resolution
+            W, H, D = resolution.tolist()
             stride = (self.resolutions[-1] - 1) / (resolution - 1)
+            sx, sy, sz = stride.long().tolist()
 
             # first step
             if torch.equal(resolution, self.resolutions[0]):
-                coords = self.init_coords.clone()    # torch.long
-                occupancys = self.batch_eval(coords, **kwargs)
+                coords = self.init_coords    # torch.long
+                occupancys = self.batch_eval_chunked(coords, **kwargs)
                 occupancys = occupancys.view(self.batchsize, self.channels, D, H, W)
                 if (occupancys > 0.5).sum() == 0:
                     # return F.interpolate(
@@ -169,21 +209,11 @@ class Seg3dLossless(nn.Module):
                 if self.visualize:
                     self.plot(occupancys, coords, final_D, final_H, final_W)
 
-                with torch.no_grad():
-                    coords_accum = coords / stride
+                calculated[:, ::sz, ::sy, ::sx] = True
 
             # last step
             elif torch.equal(resolution, self.resolutions[-1]):
 
-                with torch.no_grad():
-                    # here true is correct!
-                    valid = F.interpolate(
-                        (occupancys > self.balance_value).float(),
-                        size=(D, H, W),
-                        mode="trilinear",
-                        align_corners=True,
-                    )
-
                 # here true is correct!
                 occupancys = F.interpolate(
                     occupancys.float(),
@@ -192,13 +222,8 @@ class Seg3dLossless(nn.Module):
                     align_corners=True,
                 )
 
-                # is_boundary = (valid > 0.0) & (valid < 1.0)
-                is_boundary = valid == 0.5
-
             # next steps
             else:
-                coords_accum *= 2
-
                 with torch.no_grad():
                     # here true is correct!
                     valid = F.interpolate(
@@ -220,44 +245,30 @@ class Seg3dLossless(nn.Module):
 
                 with torch.no_grad():
                     if torch.equal(resolution, self.resolutions[1]):
-                        is_boundary = (self.smooth_conv9x9(is_boundary.float()) > 0)[0, 0]
+                        is_boundary = (self.smooth_conv9x9(is_boundary.float()) > 0)[:, 0]
                     elif torch.equal(resolution, self.resolutions[2]):
-                        is_boundary = (self.smooth_conv7x7(is_boundary.float()) > 0)[0, 0]
+                        is_boundary = (self.smooth_conv7x7(is_boundary.float()) > 0)[:, 0]
                     else:
-                        is_boundary = (self.smooth_conv3x3(is_boundary.float()) > 0)[0, 0]
+                        is_boundary = (self.smooth_conv3x3(is_boundary.float()) > 0)[:, 0]
 
-                    coords_accum = coords_accum.long()
-                    is_boundary[coords_accum[0, :, 2], coords_accum[0, :, 1],
-                                coords_accum[0, :, 0], ] = False
-                    point_coords = (
-                        is_boundary.permute(2, 1, 0).nonzero(as_tuple=False).unsqueeze(0)
-                    )
-                    point_indices = (
-                        point_coords[:, :, 2] * H * W + point_coords[:, :, 1] * W +
-                        point_coords[:, :, 0]
-                    )
+                    is_boundary &= ~calculated[:, ::sz, ::sy, ::sx]
 
-                    R, C, D, H, W = occupancys.shape
+                    point_z, point_y, point_x = is_boundary[0].nonzero(as_tuple=True)
+                    if point_x.size(0) == 0:
+                        continue
 
                     # inferred value
-                    coords = point_coords * stride
+                    coords = torch.stack([point_x, point_y, point_z], dim=1).unsqueeze(0)
+                    coords = coords * stride.long()
 
-                if coords.size(1) == 0:
-                    continue
-                occupancys_topk = self.batch_eval(coords, **kwargs)
+                occupancys_topk = self.batch_eval_chunked(coords, **kwargs)    # [1, 1, N]
 
                 # put mask point predictions to the right places on the upsampled grid.
-                R, C, D, H, W = occupancys.shape
-                point_indices = point_indices.unsqueeze(1).expand(-1, C, -1)
-                occupancys = (
-                    occupancys.reshape(R, C,
-                                       D * H * W).scatter_(2, point_indices,
-                                                           occupancys_topk).view(R, C, D, H, W)
-                )
+                occupancys[0, 0, point_z, point_y,
+                           point_x] = occupancys_topk[0, 0].to(occupancys.dtype)
 
                 with torch.no_grad():
-                    voxels = coords / stride
-                    coords_accum = torch.cat([voxels, coords_accum], dim=1).unique(dim=1)
+                    calculated[0, point_z * sz, point_y * sy, point_x * sx] = True
 
         return occupancys[0, 0]
 
@@ -14,6 +14,8 @@
 #
 # Contact: ps-license@tuebingen.mpg.de
 
+from contextlib import nullcontext
+
 import pytorch_lightning as pl
 import torch
 from termcolor import colored
@@ -108,12 +110,25 @@ def query_func_IF(batch, netG, points):
     return: size of (bz, 1, N)
     """
 
-    batch["samples_geo"] = points
-    batch["calib"] = torch.stack([torch.eye(4).float()], dim=0).type_as(points)
+    # points / calib stay local: Seg3dLossless may run several chunks of the same batch
+    # concurrently, only the feature cache below is shared (and filled by the first chunk)
+    calib = torch.eye(4).type_as(points).unsqueeze(0).expand(points.size(0), -1, -1)
+
+    # the voxel encoder only depends on the input volumes, so it is run once and
+    # its feature volumes are reused by every level / chunk of the octree queries
+    voxel_key = (batch["depth_voxels"], batch.get("body_voxels"))
+    cache = batch.get("feat_geo_cache")
+
+    # autocast is thread-local, so it is entered here and not around the reconEngine call
+    precision = getattr(netG, "precision", None)
+    with nullcontext() if precision is None else precision.autocast():
+        if cache is None or any(a is not b for a, b in zip(cache[0], voxel_key)):
+            cache = (voxel_key, netG.encode(batch))
+            batch["feat_geo_cache"] = cache
 
-    preds = netG(batch)
+        preds = netG.query(cache[1], points, calib)
 
-    return preds.unsqueeze(1)
+    return preds.float().unsqueeze(1)
 
 
 def batch_mean(res, key):
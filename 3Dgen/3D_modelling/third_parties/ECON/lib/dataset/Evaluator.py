@@ -14,6 +14,9 @@
 #
 # Contact: ps-license@tuebingen.mpg.de
 
+import os
+import os.path as osp
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 
 import numpy as np
@@ -22,7 +25,8 @@ from PIL import Image
 from pytorch3d import _C
 from pytorch3d.ops.mesh_face_areas_normals import mesh_face_areas_normals
 from pytorch3d.ops.packed_to_padded import packed_to_padded
-from pytorch3d.structures import Pointclouds
+from pytorch3d.renderer import TexturesVertex
+from pytorch3d.structures import Meshes, Pointclouds
 from torch.autograd import Function
 from torch.autograd.function import once_differentiable
 from torchvision.utils import make_grid
@@ -232,77 +236,194 @@ def point_mesh_distance(meshes, pcls, weighted=True):
 
 
 class Evaluator:
-    def __init__(self, device):
+    """
+    Chamfer / P2S / normal consistency of many subjects at once
+        1. predicted and ground-truth meshes of all subjects are packed into one Meshes
+        2. four-view normal renders of all meshes share one rasterization (render_batch meshes each)
+        3. ground-truth surface samples and normal renders are cached on disk per subject key
+        4. normal comparison images are written by a background thread
+    """
+    def __init__(self, device, cache_dir=None, render_batch=4):
 
         self.render = Render(size=512, device=device)
         self.device = device
+        self.cache_dir = cache_dir
+        self.render_batch = render_batch
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.pending_writes = []
 
-    def set_mesh(self, result_dict, scale=True):
-
-        for k, v in result_dict.items():
-            setattr(self, k, v)
-        if scale:
-            self.verts_pr -= self.recon_size / 2.0
-            self.verts_pr /= self.recon_size / 2.0
-        self.verts_gt = projection(self.verts_gt, self.calib)
-        self.verts_gt[:, 1] *= -1
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
 
-        self.render.load_meshes(self.verts_pr, self.faces_pr)
-        self.src_mesh = self.render.meshes
-        self.render.load_meshes(self.verts_gt, self.faces_gt)
-        self.tgt_mesh = self.render.meshes
+    def set_mesh(self, result_dict, scale=True, key=None):
 
-    def calculate_normal_consist(self, normal_path):
+        self.set_meshes([result_dict], scale=scale, keys=[key])
 
-        self.render.meshes = self.src_mesh
-        src_normal_imgs = self.render.get_image(cam_type="four", bg="black")
-        self.render.meshes = self.tgt_mesh
-        tgt_normal_imgs = self.render.get_image(cam_type="four", bg="black")
+    def set_meshes(self, result_dicts, scale=True, keys=None):
+        """
+        - result_dicts: list of dict(verts_pr, faces_pr, verts_gt, faces_gt, calib[, recon_size])
+        - keys: list of subject keys for the ground-truth cache, or None
+        """
 
-        src_normal_arr = make_grid(torch.cat(src_normal_imgs, dim=0), nrow=4, padding=0)    # [-1,1]
-        tgt_normal_arr = make_grid(torch.cat(tgt_normal_imgs, dim=0), nrow=4, padding=0)    # [-1,1]
-        src_norm = torch.norm(src_normal_arr, dim=0, keepdim=True)
-        tgt_norm = torch.norm(tgt_normal_arr, dim=0, keepdim=True)
+        verts_pr_lst, faces_pr_lst, verts_gt_lst, faces_gt_lst = [], [], [], []
+
+        for result_dict in result_dicts:
+            verts_pr = torch.as_tensor(result_dict["verts_pr"]).float().to(self.device)
+            if scale:
+                verts_pr = (verts_pr - result_dict["recon_size"] / 2.0) / (result_dict["recon_size"] / 2.0)
+            verts_gt = projection(
+                torch.as_tensor(result_dict["verts_gt"]).float().to(self.device),
+                torch.as_tensor(result_dict["calib"]).float().to(self.device),
+            )
+            verts_gt[:, 1] *= -1
+
+            verts_pr_lst.append(verts_pr)
+            faces_pr_lst.append(torch.as_tensor(result_dict["faces_pr"]).long().to(self.device))
+            verts_gt_lst.append(verts_gt)
+            faces_gt_lst.append(torch.as_tensor(result_dict["faces_gt"]).long().to(self.device))
+
+        num_subjects = len(result_dicts)
+        self.keys = [None] * num_subjects if keys is None else list(keys)
+        self.meshes = Meshes(verts_pr_lst + verts_gt_lst, faces_pr_lst + faces_gt_lst)
+        self.src_mesh = self.meshes[list(range(num_subjects))]
+        self.tgt_mesh = self.meshes[list(range(num_subjects, 2 * num_subjects))]
+
+    def _cache_path(self, key, name):
+        if self.cache_dir is None or key is None:
+            return None
+        return osp.join(self.cache_dir, f"{key}_{name}.pt")
+
+    def _cached(self, name, compute):
+        """
+        per-subject ground-truth tensors, loaded from the cache where possible,
+        compute(indices) returns the tensors of the missing subjects, they are stored
+        in their own dtype so cached and fresh runs give the same metrics
+        """
 
-        src_norm[src_norm == 0.0] = 1.0
-        tgt_norm[tgt_norm == 0.0] = 1.0
+        results = [None] * len(self.keys)
+        for idx, key in enumerate(self.keys):
+            path = self._cache_path(key, name)
+            if path is not None and osp.exists(path):
+                results[idx] = torch.load(path, map_location=self.device)
+
+        missing = [idx for idx, result in enumerate(results) if result is None]
+        if len(missing) > 0:
+            for idx, result in zip(missing, compute(missing)):
+                results[idx] = result
+                path = self._cache_path(self.keys[idx], name)
+                if path is not None:
+                    torch.save(result.cpu(), path)
+
+        return [result.to(self.device) for result in results]
+
+    def _render_normals(self, meshes):
+        """four-view normal renders, [N, 4, 3, H, W], normalized to [0, 1]"""
+
+        num_views = len(self.render.cam_pos["four"])
+        normal_imgs = []
+
+        for start in range(0, len(meshes), self.render_batch):
+            chunk = meshes[list(range(start, min(start + self.render_batch, len(meshes))))]
+            chunk.textures = TexturesVertex(
+                verts_features=[(normals + 1.0) * 0.5 for normals in chunk.verts_normals_list()]
+            )
+            cameras = self.render.get_camera_batch(
+                "four", idx=np.tile(np.arange(num_views), len(chunk))
+            )
+            self.render.init_renderer(cameras, "rgb", "black")
+            images = self.render.renderer(chunk.extend(num_views))    # [N * 4, H, W, 4]
+            images = (images[..., :3].permute(0, 3, 1, 2) - 0.5) * 2.0    # [-1,1]
+
+            norm = torch.norm(images, dim=1, keepdim=True)
+            norm[norm == 0.0] = 1.0
+            images = (images / norm + 1.0) * 0.5
+
+            normal_imgs.append(images.view(len(chunk), num_views, *images.shape[1:]))
+
+        return torch.cat(normal_imgs, dim=0)
+
+    def _write_normal_img(self, src_normal_arr, tgt_normal_arr, normal_path):
+        normal_arr = torch.cat([
+            make_grid(src_normal_arr, nrow=4, padding=0),
+            make_grid(tgt_normal_arr, nrow=4, padding=0)
+        ],
+                               dim=1)
+        Image.fromarray((normal_arr.permute(1, 2, 0).numpy() * 255.0).astype(np.uint8)
+                       ).save(normal_path)
+
+    def calculate_normal_consist(self, normal_paths=None):
+        """
+        - normal_paths: str or list of str (one per subject), None to skip the images
+        return: [N] normal consistency errors
+        """
 
-        src_normal_arr /= src_norm
-        tgt_normal_arr /= tgt_norm
+        if isinstance(normal_paths, str):
+            normal_paths = [normal_paths]
+
+        src_normal_arr = self._render_normals(self.src_mesh)
+        # ground-truth renders are cached in the render dtype ("normal_render", the
+        # float16 "normal" files of earlier versions are not reused)
+        tgt_normal_arr = torch.stack(
+            self._cached(
+                "normal_render",
+                lambda idx: list(self._render_normals(self.tgt_mesh[idx])),
+            )
+        )
 
         # sim_mask = self.get_laplacian_2d(tgt_normal_arr).to(self.device)
 
-        src_normal_arr = (src_normal_arr + 1.0) * 0.5
-        tgt_normal_arr = (tgt_normal_arr + 1.0) * 0.5
-
-        error = (((src_normal_arr - tgt_normal_arr)**2).sum(dim=0).mean()) * 4.0
+        error = (((src_normal_arr - tgt_normal_arr)**2).sum(dim=2).mean(dim=(1, 2, 3))) * 4.0
 
         # error_hf = ((((src_normal_arr - tgt_normal_arr) * sim_mask)**2).sum(dim=0).mean()) * 4.0
 
-        normal_img = Image.fromarray((
-            torch.cat([src_normal_arr, tgt_normal_arr],
-                      dim=1).permute(1, 2, 0).detach().cpu().numpy() * 255.0
-        ).astype(np.uint8))
-        normal_img.save(normal_path)
+        if normal_paths is not None:
+            for src_arr, tgt_arr, normal_path in zip(
+                src_normal_arr.cpu(), tgt_normal_arr.cpu(), normal_paths
+            ):
+                self.pending_writes.append(
+                    self.writer.submit(self._write_normal_img, src_arr, tgt_arr, normal_path)
+                )
 
         return error
 
     def calculate_chamfer_p2s(self, num_samples=1000):
+        """
+        return: [N] chamfer distances, [N] P2S distances
+        """
 
-        samples_tgt, _, _ = sample_points_from_meshes(self.tgt_mesh, num_samples)
+        # ground-truth samples are drawn once per subject (and cached)
+        samples_tgt = torch.stack(
+            self._cached(
+                f"samples_{num_samples}",
+                lambda idx: list(sample_points_from_meshes(self.tgt_mesh[idx], num_samples)[0]),
+            )
+        )
         samples_src, _, _ = sample_points_from_meshes(self.src_mesh, num_samples)
 
         tgt_points = Pointclouds(samples_tgt)
         src_points = Pointclouds(samples_src)
 
-        p2s_dist = point_mesh_distance(self.src_mesh, tgt_points)[0].sum() * 100.0
+        num_subjects = len(self.src_mesh)
+
+        def per_subject(dists, points):
+            return torch.zeros(num_subjects, device=dists.device
+                              ).index_add_(0, points.packed_to_cloud_idx(), dists)
+
+        p2s_dist = per_subject(point_mesh_distance(self.src_mesh, tgt_points)[0], tgt_points) * 100.0
 
         chamfer_dist = (
-            point_mesh_distance(self.tgt_mesh, src_points)[0].sum() * 100.0 + p2s_dist
+            per_subject(point_mesh_distance(self.tgt_mesh, src_points)[0], src_points) * 100.0 +
+            p2s_dist
         ) * 0.5
 
         return chamfer_dist, p2s_dist
 
+    def flush(self):
+        """wait until all normal images are written"""
+        for future in self.pending_writes:
+            future.result()
+        self.pending_writes = []
+
     def calc_acc(self, output, target, thres=0.5, use_sdf=False):
 
         # # remove the surface points with thres
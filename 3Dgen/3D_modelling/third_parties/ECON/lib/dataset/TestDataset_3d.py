@@ -26,17 +26,15 @@ import os.path as osp
 
 import numpy as np
 import torch
-import torch.nn.functional as F
 from PIL import ImageFile
 from termcolor import colored
-from torchvision import transforms
 from torchvision.models import detection
 
 from lib.common.config import cfg
 from lib.common.imutils import process_image, process_image_nowarp
 from lib.common.render import Render
 from lib.common.train_util import Format
-from lib.dataset.mesh_util import SMPLX, get_visibility
+from lib.dataset.mesh_util import SMPLX, depth_to_voxel, get_visibility
 from lib.pixielib.models.SMPLX import SMPLX as PIXIE_SMPLX
 from lib.pixielib.pixie import PIXIE
 from lib.pixielib.utils.config import cfg as pixie_cfg
@@ -112,33 +110,10 @@ class TestDataset:
 
     def depth_to_voxel(self, data_dict):
 
-        data_dict["depth_F"] = transforms.Resize(self.vol_res)(data_dict["depth_F"])
-        data_dict["depth_B"] = transforms.Resize(self.vol_res)(data_dict["depth_B"])
-
-        depth_mask = (~torch.isnan(data_dict['depth_F']))
-        depth_FB = torch.cat([data_dict['depth_F'], data_dict['depth_B']], dim=0)
-        depth_FB[:, ~depth_mask[0]] = 0.
-
-        # Important: index_long = depth_value - 1
-        index_z = (((depth_FB + 1.) * 0.5 * self.vol_res) - 1).clip(0, self.vol_res -
-                                                                    1).permute(1, 2, 0)
-        index_z_ceil = torch.ceil(index_z).long()
-        index_z_floor = torch.floor(index_z).long()
-        index_z_frac = torch.frac(index_z)
-
-        index_mask = index_z[..., 0] == torch.tensor(self.vol_res * 0.5 - 1).long()
-        voxels = F.one_hot(index_z_ceil[..., 0], self.vol_res) * index_z_frac[..., 0] + \
-            F.one_hot(index_z_floor[..., 0], self.vol_res) * (1.0-index_z_frac[..., 0]) + \
-            F.one_hot(index_z_ceil[..., 1], self.vol_res) * index_z_frac[..., 1]+ \
-            F.one_hot(index_z_floor[..., 1], self.vol_res) * (1.0 - index_z_frac[..., 1])
-
-        voxels[index_mask] *= 0
-        voxels = torch.flip(voxels, [2]).permute(2, 0, 1).float()    #[x-2, y-0, z-1]
-
         return {
-            "depth_voxels": voxels.flip([
-                0,
-            ]).unsqueeze(0).to(self.device),
+            "depth_voxels":
+                depth_to_voxel(data_dict["depth_F"], data_dict["depth_B"],
+                               self.vol_res).to(self.device),
         }
 
     def __getitem__(self, index):
@@ -32,6 +32,8 @@ from pytorch3d.structures import Meshes
 from scipy.spatial import cKDTree
 
 import lib.smplx as smplx
+from lib.smplx.asset_registry import load_array, load_object
+from lib.dataset.smplx_topology import get_topology
 from lib.common.render_utils import Pytorch3dRasterizer, face_vertices
 
 
@@ -66,26 +68,29 @@ class SMPLX:
             self.current_dir, "smpl_data/smplx_vertex_lmkid.npy"
         )
 
-        self.smplx_faces = np.load(self.smplx_faces_path)
-        self.smplx_verts = np.load(self.smplx_verts_path)
-        self.smpl_verts = np.load(self.smpl_verts_path)
-        self.smpl_faces = np.load(self.smpl_faces_path)
-        self.smplx_vertex_lmkid = np.load(self.smplx_vertex_lmkid_path)
+        # shared, read-only assets: every SMPLX() of the process maps the same arrays
+        self.smplx_faces = load_array(self.smplx_faces_path)
+        self.smplx_verts = load_array(self.smplx_verts_path)
+        self.smpl_verts = load_array(self.smpl_verts_path)
+        self.smpl_faces = load_array(self.smpl_faces_path)
+        self.smplx_vertex_lmkid = load_array(self.smplx_vertex_lmkid_path)
 
-        self.smpl_vert_seg = json.load(open(self.smpl_vert_seg_path))
+        self.smpl_vert_seg = load_object(self.smpl_vert_seg_path, lambda path: json.load(open(path)))
         self.smpl_mano_vid = np.concatenate([
             self.smpl_vert_seg["rightHand"], self.smpl_vert_seg["rightHandIndex1"],
             self.smpl_vert_seg["leftHand"], self.smpl_vert_seg["leftHandIndex1"]
         ])
 
-        self.smplx_eyeball_fid_mask = np.load(self.smplx_eyeball_fid_path)
-        self.smplx_mouth_fid = np.load(self.smplx_fill_mouth_fid_path)
-        self.smplx_mano_vid_dict = np.load(self.smplx_mano_vid_path, allow_pickle=True)
+        self.smplx_eyeball_fid_mask = load_array(self.smplx_eyeball_fid_path)
+        self.smplx_mouth_fid = load_array(self.smplx_fill_mouth_fid_path)
+        self.smplx_mano_vid_dict = load_object(
+            self.smplx_mano_vid_path, lambda path: np.load(path, allow_pickle=True)
+        )
         self.smplx_mano_vid = np.concatenate([
             self.smplx_mano_vid_dict["left_hand"], self.smplx_mano_vid_dict["right_hand"]
         ])
-        self.smplx_flame_vid = np.load(self.smplx_flame_vid_path, allow_pickle=True)
-        self.smplx_front_flame_vid = self.smplx_flame_vid[np.load(self.front_flame_path)]
+        self.smplx_flame_vid = load_array(self.smplx_flame_vid_path)
+        self.smplx_front_flame_vid = self.smplx_flame_vid[load_array(self.front_flame_path)]
 
         # hands
         self.smplx_mano_vertex_mask = torch.zeros(self.smplx_verts.shape[0], ).index_fill_(
@@ -103,7 +108,9 @@ class SMPLX:
             0, torch.tensor(self.smplx_faces[self.smplx_eyeball_fid_mask].flatten()), 1.0
         )
 
-        self.smplx_to_smpl = cPickle.load(open(self.smplx_to_smplx_path, "rb"))
+        self.smplx_to_smpl = load_object(
+            self.smplx_to_smplx_path, lambda path: cPickle.load(open(path, "rb"))
+        )
 
         self.model_dir = osp.join(self.current_dir, "models")
 
@@ -229,7 +236,7 @@ def apply_vertex_face_mask(mesh, vertex_mask, face_mask):
 def part_removal(full_mesh, part_mesh, thres, device, smpl_obj, region, clean=True):
 
     smpl_tree = cKDTree(smpl_obj.vertices)
-    SMPL_container = SMPLX()
+    topology = get_topology(device)
 
     from lib.dataset.PointFeat import PointFeat
 
@@ -244,30 +251,17 @@ def part_removal(full_mesh, part_mesh, thres, device, smpl_obj, region, clean=Tr
 
     if region == "hand":
         _, idx = smpl_tree.query(full_mesh.vertices, k=1)
+        idx = torch.as_tensor(idx, device=topology.device)
         if smpl_obj.vertices.shape[0] > 6890:
-            full_lmkid = SMPL_container.smplx_vertex_lmkid[idx]
-            remove_mask = torch.logical_and(
-                remove_mask,
-                torch.tensor(full_lmkid >= 20).type_as(remove_mask).unsqueeze(0)
-            )
+            hand_mask = topology.hand_lmk_vertex_mask[idx]
         else:
-            remove_mask = torch.logical_and(
-                remove_mask,
-                torch.isin(
-                    torch.tensor(idx).long(),
-                    torch.tensor(SMPL_container.smpl_mano_vid).long()
-                ).type_as(remove_mask).unsqueeze(0)
-            )
+            hand_mask = topology.smpl_mano_vertex_mask[idx]
+        remove_mask = torch.logical_and(remove_mask, hand_mask.unsqueeze(0))
 
     elif region == "face":
         _, idx = smpl_tree.query(full_mesh.vertices, k=5)
-        face_space_mask = torch.isin(
-            torch.tensor(idx), torch.tensor(SMPL_container.smplx_front_flame_vid)
-        )
-        remove_mask = torch.logical_and(
-            remove_mask,
-            face_space_mask.any(dim=1).type_as(remove_mask).unsqueeze(0)
-        )
+        face_space_mask = topology.front_flame_vertex_mask[torch.as_tensor(idx, device=topology.device)]
+        remove_mask = torch.logical_and(remove_mask, face_space_mask.any(dim=1).unsqueeze(0))
 
     BNI_part_mask = ~(remove_mask).flatten()[full_mesh.faces].any(dim=1)
     full_mesh.update_faces(BNI_part_mask.detach().cpu())
@@ -484,6 +478,45 @@ def get_visibility(xy, z, faces, img_res=2**12, blur_radius=0.0, faces_per_pixel
     return vis_mask
 
 
+def depth_to_voxel(depth_F, depth_B, vol_res):
+    """IF-Net input volume from front / back depth maps
+        - depth_F, depth_B: [B, H, W], range [-1, 1], NaN as background
+    return: [B, vol_res (z), vol_res (y), vol_res (x)], the fractional depth of every pixel
+            is splatted to its floor / ceil voxels with scatter_add_ into one preallocated volume
+
+    NOTE: the one-hot implementation IF-Net+ was trained with weighted the voxel (z, y, x) by
+    the fraction of pixel (y=x, x=z) (a [H, W] fraction broadcast over the (W, vol_res) axes
+    of the one-hot tensor), not by the fraction of pixel (y, x). The weights are gathered
+    the same way here so the network keeps receiving the volumes it was trained on.
+    """
+
+    resize = torchvision.transforms.Resize(vol_res)
+    depth_FB = torch.stack([resize(depth_F), resize(depth_B)], dim=1)    # [B, 2, H, W]
+    depth_FB = depth_FB.masked_fill(torch.isnan(depth_FB[:, :1]), 0.)
+
+    # Important: index_long = depth_value - 1
+    index_z = (((depth_FB + 1.) * 0.5 * vol_res) - 1).clip(0, vol_res - 1)
+    index_z_frac = torch.frac(index_z)
+
+    # pixels without front depth stay empty
+    index_mask = index_z[:, :1] != int(vol_res * 0.5 - 1)
+
+    assert index_z.shape[-2] == index_z.shape[-1] == vol_res, "depth maps must be square"
+
+    index = torch.cat([torch.ceil(index_z), torch.floor(index_z)], dim=1).long()
+    frac = torch.cat([index_z_frac, 1.0 - index_z_frac], dim=1)
+    # weight[b, c, y, x] = frac[b, c, x, index[b, c, y, x]], see the note above
+    weight = frac.gather(-1, index.transpose(-1, -2)).transpose(-1, -2)
+    weight = (weight * index_mask).float()
+
+    voxels = torch.zeros((depth_FB.shape[0], vol_res, *depth_FB.shape[-2:]),
+                         dtype=weight.dtype,
+                         device=weight.device)
+    voxels.scatter_add_(1, index, weight)
+
+    return voxels
+
+
 def barycentric_coordinates_of_projection(points, vertices):
     """https://github.com/MPI-IS/mesh/blob/master/mesh/geometry/barycentric_coordinates_of_projection.py"""
     """Given a point, gives projected coords of that point to a triangle
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# You can only use this computer program if you have closed
+# a license agreement with MPG or you get the right to use the computer
+# program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and
+# liable to prosecution.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# Contact: ps-license@tuebingen.mpg.de
+
+import hashlib
+import os
+import os.path as osp
+import threading
+
+import numpy as np
+import torch
+
+from lib.smplx.asset_registry import ASSET_CACHE_DIR
+
+# Fixed SMPL / SMPL-X index sets used by the mesh cleanup and part replacement of ECON
+# (hand / face / eyeball masks, landmark-based hand vertices).
+# They are derived once from the SMPLX() assets, stored as a versioned .npz bundle and
+# kept as boolean / integer tensors per device, so every per-subject use is a gather.
+
+TOPOLOGY_VERSION = 2
+
+_tables = None
+_topologies = {}
+_lock = threading.Lock()
+
+
+def _bundle_path(smplx_container):
+    key = [f"{TOPOLOGY_VERSION}"]
+    for path in [
+        smplx_container.smplx_faces_path, smplx_container.smplx_verts_path,
+        smplx_container.smpl_verts_path, smplx_container.smplx_vertex_lmkid_path,
+        smplx_container.smpl_vert_seg_path, smplx_container.smplx_eyeball_fid_path,
+        smplx_container.smplx_mano_vid_path, smplx_container.smplx_flame_vid_path,
+        smplx_container.front_flame_path
+    ]:
+        stat = os.stat(path)
+        key.append(f"{osp.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    digest = hashlib.sha1("|".join(key).encode("utf-8")).hexdigest()[:16]
+    return osp.join(ASSET_CACHE_DIR, f"smplx_topology_v{TOPOLOGY_VERSION}_{digest}.npz")
+
+
+def build_tables(smplx_container):
+    """numpy index tables derived from a SMPLX() container"""
+
+    n_smplx = smplx_container.smplx_verts.shape[0]
+    n_smpl = smplx_container.smpl_verts.shape[0]
+
+    def vertex_mask(num, ids):
+        mask = np.zeros(num, dtype=bool)
+        mask[np.asarray(ids, dtype=np.int64).flatten()] = True
+        return mask
+
+    tables = {
+        "smplx_mano_vertex_mask": vertex_mask(n_smplx, smplx_container.smplx_mano_vid),
+        "smpl_mano_vertex_mask": vertex_mask(n_smpl, smplx_container.smpl_mano_vid),
+        "front_flame_vertex_mask": vertex_mask(n_smplx, smplx_container.smplx_front_flame_vid),
+        "eyeball_vertex_mask": vertex_mask(
+            n_smplx, smplx_container.smplx_faces[smplx_container.smplx_eyeball_fid_mask]
+        ),
+        # [2, V] left / right hand, indexed by the hands visibility
+        "hand_vertex_masks": np.stack([
+            vertex_mask(n_smplx, smplx_container.smplx_mano_vid_dict["left_hand"]),
+            vertex_mask(n_smplx, smplx_container.smplx_mano_vid_dict["right_hand"]),
+        ]),
+        "hand_lmk_vertex_mask": np.asarray(smplx_container.smplx_vertex_lmkid).flatten() >= 20,
+        "eyeball_face_mask": np.asarray(smplx_container.smplx_eyeball_fid_mask, dtype=bool),
+    }
+
+    # SMPL-X body without face, hands and eyeballs
+    tables["body_vertex_mask"] = ~(
+        tables["front_flame_vertex_mask"] | tables["smplx_mano_vertex_mask"] |
+        tables["eyeball_vertex_mask"]
+    )
+
+    return tables
+
+
+def load_tables(smplx_container):
+    """tables from the versioned bundle, built and written on the first use"""
+
+    path = _bundle_path(smplx_container)
+    if osp.exists(path):
+        with np.load(path) as bundle:
+            return {key: bundle[key] for key in bundle.files}
+
+    tables = build_tables(smplx_container)
+    try:
+        os.makedirs(osp.dirname(path), exist_ok=True)
+        tmp_path = f"{path[:-4]}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **tables)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return tables
+
+
+class SMPLXTopology:
+    """
+    Device-resident SMPL / SMPL-X index tables.
+        - *_vertex_mask: bool [V], eyeball_face_mask: bool [F]
+        - hand_vertex_masks: bool [2, V] (left, right)
+        - hand_lmk_vertex_mask: SMPL-X vertices with a hand landmark id
+    """
+    def __init__(self, tables, device):
+
+        self.device = torch.device(device)
+        for key, value in tables.items():
+            setattr(self, key, torch.as_tensor(value).to(self.device))
+
+    def visible_hand_mask(self, hands_visibility):
+        """bool [V] mask of the visible (left, right) MANO vertices"""
+        visibility = torch.as_tensor(hands_visibility, dtype=torch.bool, device=self.device)
+        return self.hand_vertex_masks[visibility].any(dim=0)
+
+
+def get_topology(device="cpu"):
+    """process-wide SMPLXTopology on device, the tables are loaded once for all devices"""
+
+    global _tables
+
+    device = torch.device(device)
+    with _lock:
+        if device not in _topologies:
+            if _tables is None:
+                from lib.dataset.mesh_util import SMPLX
+                _tables = load_tables(SMPLX())
+            _topologies[device] = SMPLXTopology(_tables, device)
+    return _topologies[device]
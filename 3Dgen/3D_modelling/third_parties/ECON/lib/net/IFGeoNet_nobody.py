@@ -86,16 +86,19 @@ class IFGeoNet(nn.Module):
 
     def forward(self, batch):
 
-        p = orthogonal(batch["samples_geo"].permute(0, 2, 1),
-                       batch["calib"]).permute(0, 2, 1)    #[2, 60000, 3]
+        return self.query(self.encode(batch), batch["samples_geo"], batch["calib"])
+
+    def encode(self, batch):
+        """
+        Run the 3D conv encoder once, the returned feature volumes
+        can be queried by many point chunks via self.query
+        """
+
         x = batch["depth_voxels"]    #[B, 128, 128, 128]
 
         x = x.unsqueeze(1)
-        p_features = p.transpose(1, -1)
-        p = p.unsqueeze(1).unsqueeze(1)
 
         # partial inputs feature extraction
-        feature_0_partial = F.grid_sample(x, p, padding_mode='border', align_corners=True)
         net_partial = self.actvn(self.conv_in_partial(x))
         net_partial = self.partial_conv_in_bn(net_partial)
         net_partial = self.maxpool(net_partial)    # out 64
@@ -104,44 +107,58 @@ class IFGeoNet(nn.Module):
         net = self.actvn(self.conv_0_fusion(net_partial))
         net = self.actvn(self.conv_0_1_fusion(net))
         net = self.conv0_1_bn_fusion(net)
-        feature_1_fused = F.grid_sample(net, p, padding_mode='border', align_corners=True)
+        net_fused = net
         # net = self.maxpool(net)  # out 64
 
         net = self.actvn(self.conv_0(net))
         net = self.actvn(self.conv_0_1(net))
         net = self.conv0_1_bn(net)
-        feature_2 = F.grid_sample(net, p, padding_mode='border', align_corners=True)
+        net_2 = net
         net = self.maxpool(net)    # out 32
 
         net = self.actvn(self.conv_1(net))
         net = self.actvn(self.conv_1_1(net))
         net = self.conv1_1_bn(net)
-        feature_3 = F.grid_sample(net, p, padding_mode='border', align_corners=True)
+        net_3 = net
         net = self.maxpool(net)    # out 16
 
         net = self.actvn(self.conv_2(net))
         net = self.actvn(self.conv_2_1(net))
         net = self.conv2_1_bn(net)
-        feature_4 = F.grid_sample(net, p, padding_mode='border', align_corners=True)
+        net_4 = net
         net = self.maxpool(net)    # out 8
 
         net = self.actvn(self.conv_3(net))
         net = self.actvn(self.conv_3_1(net))
         net = self.conv3_1_bn(net)
-        feature_5 = F.grid_sample(net, p, padding_mode='border', align_corners=True)
+        net_5 = net
         net = self.maxpool(net)    # out 4
 
         net = self.actvn(self.conv_4(net))
         net = self.actvn(self.conv_4_1(net))
         net = self.conv4_1_bn(net)
-        feature_6 = F.grid_sample(net, p, padding_mode='border', align_corners=True)    # out 2
+        net_6 = net    # out 2
+
+        return [x, net_fused, net_2, net_3, net_4, net_5, net_6]
+
+    def query(self, feat_volumes, samples, calib):
+        """
+        - feat_volumes: output of self.encode
+        - samples: size of (B, N, 3)
+        - calib: size of (B, 4, 4)
+        return: size of (B, N)
+        """
+
+        p = orthogonal(samples.permute(0, 2, 1), calib).permute(0, 2, 1)    #[2, 60000, 3]
+        p_features = p.transpose(1, -1)
+        p = p.unsqueeze(1).unsqueeze(1)
 
         # here every channel corresponse to one feature.
 
-        features = torch.cat((
-            feature_0_partial, feature_1_fused, feature_2, feature_3, feature_4, feature_5,
-            feature_6
-        ),
+        features = torch.cat([
+            F.grid_sample(volume, p, padding_mode='border', align_corners=True)
+            for volume in feat_volumes
+        ],
                              dim=1)    # (B, features, 1,7,sample_num)
         shape = features.shape
         features = torch.reshape(
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# You can only use this computer program if you have closed
+# a license agreement with MPG or you get the right to use the computer
+# program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and
+# liable to prosecution.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# Contact: ps-license@tuebingen.mpg.de
+
+import torch
+
+from .precision import PrecisionMode
+
+
+class SMPLVersions:
+    """
+    Per-body version counters of a SMPL-X fit, a body gets a new version once any of its
+    parameters moved more than tol since its last version (tol=0: on every change).
+    """
+    def __init__(self):
+
+        self.ref = None
+        self.versions = None
+
+    @torch.no_grad()
+    def update(self, params, tol=0.0):
+        """
+        - params: list of [N_body, ...] parameter tensors
+        return: list of N_body versions
+        """
+
+        flat = torch.cat([param.detach().flatten(1) for param in params], dim=1)
+        if self.ref is None:
+            self.ref = flat.clone()
+            self.versions = [0] * flat.shape[0]
+            return list(self.versions)
+
+        moved = (flat - self.ref).abs().amax(dim=1) > tol
+        self.ref[moved] = flat[moved]
+        for idx, flag in enumerate(moved.tolist()):
+            self.versions[idx] += int(flag)
+        return list(self.versions)
+
+
+class NormalPredictor:
+    """
+    Batched, cached inference wrapper around a trained NormalNet.
+        1. the bodies to predict (image + SMPL normal renders) go through netF / netB
+            as one batched forward each
+        2. netF / netB run with the given PrecisionMode (autocast, channels_last,
+            torch.compile), fp32 by default
+        3. with keys, predictions are cached per body together with its SMPL-X version
+            (see SMPLVersions), only the bodies with a new version are predicted again
+    """
+    def __init__(self, netG, precision=None):
+
+        self.netG = netG.eval()
+        self.device = next(netG.parameters()).device
+        if precision is None:
+            precision = PrecisionMode("fp32", self.device)
+        self.precision = precision
+        self.cache = {}
+
+        self.netG.netF = self.precision.prepare(self.netG.netF)
+        self.netG.netB = self.precision.prepare(self.netG.netB)
+
+    def _format(self, tensor):
+        return self.precision.format(tensor.to(self.device))
+
+    @torch.no_grad()
+    def _forward(self, in_tensor, index=None):
+
+        in_tensor = {
+            name: self._format(
+                in_tensor[name] if index is None else in_tensor[name].to(self.device)[index]
+            )
+            for name in set(self.netG.in_nmlF + self.netG.in_nmlB)
+        }
+
+        with self.precision.autocast():
+            nmlF, nmlB = self.netG(in_tensor)
+
+        return nmlF.float().contiguous(), nmlB.float().contiguous()
+
+    @torch.no_grad()
+    def __call__(self, in_tensor, keys=None, versions=None):
+        """
+        - in_tensor: dict of [B, C, H, W] inputs, see NormalNet.in_nml
+        - keys: B hashable body keys, e.g. (subject, body index), or None to skip the cache
+        - versions: B SMPL-X versions of the bodies, a cached prediction is reused while
+            its version matches
+        return: normal_F, normal_B of size [B, 3, H, W]
+        """
+
+        if keys is None:
+            return self._forward(in_tensor)
+
+        stale = [
+            idx for idx, (key, version) in enumerate(zip(keys, versions))
+            if key not in self.cache or self.cache[key][0] != version
+        ]
+        if len(stale) > 0:
+            nmlF, nmlB = self._forward(in_tensor, torch.tensor(stale, device=self.device))
+            for pos, idx in enumerate(stale):
+                self.cache[keys[idx]] = (versions[idx], nmlF[pos:pos + 1], nmlB[pos:pos + 1])
+            if len(stale) == len(keys):
+                return nmlF, nmlB
+
+        return (
+            torch.cat([self.cache[key][1] for key in keys], dim=0),
+            torch.cat([self.cache[key][2] for key in keys], dim=0),
+        )
+
+    def clear(self):
+        self.cache.clear()
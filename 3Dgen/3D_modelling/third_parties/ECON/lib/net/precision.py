@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# You can only use this computer program if you have closed
+# a license agreement with MPG or you get the right to use the computer
+# program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and
+# liable to prosecution.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# Contact: ps-license@tuebingen.mpg.de
+
+import os
+from contextlib import nullcontext
+
+import torch
+
+
+def resolve_dtype(precision, device_type):
+    """
+    autocast dtype for a precision name ("fp32" / "fp16" / "bf16" / "auto") on a device type,
+    None means plain fp32. cpu autocast only runs bf16, so "fp16" stays fp32 there.
+    """
+    if precision == "auto":
+        precision = "fp16" if device_type == "cuda" else "bf16"
+    if precision == "fp32" or (precision == "fp16" and device_type != "cuda"):
+        return None
+    if precision == "fp16":
+        return torch.float16
+    if precision == "bf16":
+        return torch.bfloat16
+    raise ValueError(f"unknown inference precision {precision}")
+
+
+class PrecisionMode:
+    """
+    Inference precision / layout of a network
+        1. autocast to fp16 / bf16 (see resolve_dtype)
+        2. channels_last (4D) or channels_last_3d (5D) weights and inputs
+        3. optional torch.compile of the submodules
+    """
+    def __init__(self, precision="fp32", device="cuda", channels_last=False, compile=False):
+
+        self.precision = precision
+        self.device_type = torch.device(device).type
+        self.dtype = resolve_dtype(precision, self.device_type)
+        self.channels_last = channels_last
+        self.compile = compile and hasattr(torch, "compile")
+
+    @classmethod
+    def from_cfg(cls, cfg_infer, precision, device):
+        return cls(
+            precision=precision,
+            device=device,
+            channels_last=cfg_infer.channels_last,
+            compile=cfg_infer.compile,
+        )
+
+    def autocast(self):
+        if self.dtype is None:
+            return nullcontext()
+        return torch.autocast(device_type=self.device_type, dtype=self.dtype)
+
+    def format(self, tensor):
+        if self.channels_last and tensor.dim() == 4:
+            return tensor.contiguous(memory_format=torch.channels_last)
+        if self.channels_last and tensor.dim() == 5:
+            return tensor.contiguous(memory_format=torch.channels_last_3d)
+        return tensor
+
+    def prepare(self, module, memory_format=torch.channels_last):
+        """layout (and compile) a network, returns the module to call"""
+        if self.channels_last:
+            module.to(memory_format=memory_format)
+        if self.compile:
+            module = torch.compile(module)
+        return module
+
+    def __repr__(self):
+        dtype = "fp32" if self.dtype is None else str(self.dtype).split(".")[-1]
+        return (
+            f"PrecisionMode({dtype}, {self.device_type}, channels_last={self.channels_last}, "
+            f"compile={self.compile})"
+        )
+
+
+# accuracy guards against the fp32 outputs
+
+
+def normal_angle_error(normal, normal_ref, eps=1e-6):
+    """mean angle (degree) between [B, 3, H, W] normal maps, over the foreground of normal_ref"""
+
+    normal, normal_ref = normal.float(), normal_ref.float()
+    mask = normal_ref.abs().sum(dim=1) > eps
+    cos = torch.nn.functional.cosine_similarity(normal, normal_ref, dim=1, eps=eps)
+    angle = torch.rad2deg(torch.acos(cos.clamp(-1.0, 1.0)))
+    return angle[mask].mean() if mask.any() else angle.new_zeros(())
+
+
+def occupancy_iou(occ, occ_ref, thres=0.5):
+    """IoU of two occupancy / sdf volumes after thresholding"""
+
+    occ, occ_ref = occ.float() > thres, occ_ref.float() > thres
+    union = (occ | occ_ref).sum()
+    return (occ & occ_ref).sum() / union.clamp(min=1)
+
+
+def dump_validation_sample(val_dir, name, tensors):
+    """store network inputs under val_dir for apps/check_precision.py, no-op if val_dir is None"""
+
+    if val_dir is None:
+        return
+    os.makedirs(val_dir, exist_ok=True)
+    torch.save({key: val.detach().cpu() for key, val in tensors.items()},
+               os.path.join(val_dir, f"{name}.pt"))
@@ -4,14 +4,99 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import voxelize_cuda
 from torch.autograd import Function
 
+try:
+    import voxelize_cuda
+except ImportError:
+    # GPU-less nodes use voxelize_semantic_cpu below
+    voxelize_cuda = None
+
+
+def tetrahedron_occupancy(smpl_tetrahedrons, volume_res, max_elements=2**24):
+    """
+    Vectorized rasterization of tetrahedrons into an occupancy volume
+    - smpl_tetrahedrons: [B, T, 4, 3] tetrahedron corners in [-0.5, 0.5]^3
+    return: [B, z, y, x] bool volume, voxel i is centered at (i + 0.5) / volume_res - 0.5
+    """
+    bs, nt = smpl_tetrahedrons.shape[:2]
+    device = smpl_tetrahedrons.device
+    occ_volume = torch.zeros((bs, volume_res, volume_res, volume_res), dtype=torch.bool, device=device)
+
+    # corners in voxel units, voxel centers at integer positions
+    tets = (smpl_tetrahedrons.float() + 0.5) * volume_res - 0.5
+    tets = tets.reshape(bs * nt, 4, 3)
+    batch_ids = torch.arange(bs, device=device).repeat_interleave(nt)
+
+    edges = (tets[:, 1:] - tets[:, :1]).transpose(1, 2)    # [BT, 3 (xyz), 3 (edges)]
+    valid = edges.det().abs() > 1e-8
+    tets, edges, batch_ids = tets[valid], edges[valid], batch_ids[valid]
+    edges_inv = torch.linalg.inv(edges)
+
+    bbox_min = tets.min(dim=1)[0].ceil().clamp(0, volume_res - 1).long()
+    bbox_max = tets.max(dim=1)[0].floor().clamp(0, volume_res - 1).long()
+    extent = (bbox_max - bbox_min + 1).clamp(min=0)
+
+    # similar sized tetrahedrons are rasterized together over a shared offset box
+    order = extent.prod(dim=1).argsort()
+    start = 0
+    while start < len(order):
+        idx = order[start:start + max(1, max_elements // int(extent[order[start]].clamp(min=1).prod()))]
+        box = extent[idx].amax(dim=0).clamp(min=1)
+        while len(idx) > 1 and int(box.prod()) * len(idx) > max_elements:
+            idx = idx[:len(idx) // 2]
+            box = extent[idx].amax(dim=0).clamp(min=1)
+        start += len(idx)
+
+        offsets = torch.stack(
+            torch.meshgrid(*[torch.arange(int(n), device=device) for n in box], indexing="ij"),
+            dim=-1
+        ).view(-1, 3)    # [K, 3]
+        points = bbox_min[idx, None, :] + offsets[None]    # [N, K, 3]
+        inside = (points <= bbox_max[idx, None, :]).all(dim=-1)
+
+        bary = torch.einsum("nij,nkj->nki", edges_inv[idx], points.float() - tets[idx, None, 0])
+        inside &= (bary >= -1e-6).all(dim=-1) & (bary.sum(dim=-1) <= 1.0 + 1e-6)
+
+        n_ids, k_ids = inside.nonzero(as_tuple=True)
+        xyz = points[n_ids, k_ids]
+        occ_volume[batch_ids[idx][n_ids], xyz[:, 2], xyz[:, 1], xyz[:, 0]] = True
+
+    return occ_volume
+
+
+def voxelize_semantic_cpu(
+    smpl_vertices, smpl_vertex_code, smpl_tetrahedrons, volume_res, sigma, chunk_size=4096
+):
+    """
+    Torch counterpart of voxelize_cuda.forward_semantic_voxelization
+        1. voxels inside any tetrahedron are occupied
+        2. occupied voxels get the gaussian (sigma) weighted mean of the surface vertex codes
+    return: semantic volume [B, z, y, x, 3]
+    """
+    bs = smpl_vertices.shape[0]
+    occ_volume = tetrahedron_occupancy(smpl_tetrahedrons, volume_res)
+    semantic_volume = torch.zeros(
+        (bs, volume_res, volume_res, volume_res, 3), device=smpl_vertices.device
+    )
+
+    for b in range(bs):
+        zyx = occ_volume[b].nonzero()
+        centers = (zyx.flip(-1).float() + 0.5) / volume_res - 0.5
+        for centers_chunk, zyx_chunk in zip(centers.split(chunk_size), zyx.split(chunk_size)):
+            dist2 = torch.cdist(centers_chunk, smpl_vertices[b].float()).square()
+            weight = torch.exp(-dist2 / (2.0 * sigma * sigma))
+            semantic = weight @ smpl_vertex_code[b].float()
+            semantic = semantic / (weight.sum(dim=1, keepdim=True) + 1e-3)
+            semantic_volume[b, zyx_chunk[:, 0], zyx_chunk[:, 1], zyx_chunk[:, 2]] = semantic
+
+    return semantic_volume
+
 
 class VoxelizationFunction(Function):
     """
     Definition of differentiable voxelization function
-    Currently implemented only for cuda Tensors
+    cuda Tensors use voxelize_cuda, cpu Tensors the torch implementation above
     """
     @staticmethod
     def forward(
@@ -47,6 +132,11 @@ class VoxelizationFunction(Function):
         smpl_face_code = smpl_face_code.contiguous()
         smpl_tetrahedrons = smpl_tetrahedrons.contiguous()
 
+        if not smpl_vertices.is_cuda:
+            return voxelize_semantic_cpu(
+                smpl_vertices, smpl_vertex_code, smpl_tetrahedrons, volume_res, sigma
+            )
+
         occ_volume = torch.cuda.FloatTensor(
             ctx.batch_size, ctx.volume_res, ctx.volume_res, ctx.volume_res
         ).fill_(0.0)
@@ -198,7 +288,7 @@ class Voxelization(nn.Module):
         return normals
 
     def check_input(self, x):
-        if x.device == "cpu":
-            raise TypeError("Voxelization module supports only cuda tensors")
-        if x.type() != "torch.cuda.FloatTensor":
+        if x.is_cuda and voxelize_cuda is None:
+            raise TypeError("voxelize_cuda is not built, move the inputs to cpu")
+        if x.dtype != torch.float32:
             raise TypeError("Voxelization module supports only float32 tensors")
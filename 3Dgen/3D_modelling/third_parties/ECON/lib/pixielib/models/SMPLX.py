@@ -9,9 +9,10 @@ import numpy as np
 import torch
 import torch.nn as nn
 
+from lib.smplx.asset_registry import load_model_data, asset_tensor
+
 from .lbs import (
     JointsFromVerticesSelector,
-    Struct,
     find_dynamic_lmk_idx_and_bcoords,
     lbs,
     to_np,
@@ -137,8 +138,8 @@ class SMPLX(nn.Module):
     def __init__(self, config):
         super(SMPLX, self).__init__()
         # print("creating the SMPLX Decoder")
-        ss = np.load(config.smplx_model_path, allow_pickle=True)
-        smplx_model = Struct(**ss)
+        # memory-mapped model arrays, shared with the other SMPL-X instances
+        smplx_model = load_model_data(config.smplx_model_path)
 
         self.dtype = torch.float32
         self.register_buffer(
@@ -146,16 +147,14 @@ class SMPLX(nn.Module):
             to_tensor(to_np(smplx_model.f, dtype=np.int64), dtype=torch.long),
         )
         # The vertices of the template model
-        self.register_buffer(
-            "v_template", to_tensor(to_np(smplx_model.v_template), dtype=self.dtype)
-        )
+        self.register_buffer("v_template", asset_tensor(smplx_model.v_template, dtype=self.dtype))
         # The shape components and expression
         # expression space is the same as FLAME
-        shapedirs = to_tensor(to_np(smplx_model.shapedirs), dtype=self.dtype)
+        shapedirs = smplx_model.shapedirs
         shapedirs = torch.cat(
             [
-                shapedirs[:, :, :config.n_shape],
-                shapedirs[:, :, 300:300 + config.n_exp],
+                asset_tensor(shapedirs[:, :, :config.n_shape], dtype=self.dtype),
+                asset_tensor(shapedirs[:, :, 300:300 + config.n_exp], dtype=self.dtype),
             ],
             2,
         )
@@ -163,14 +162,14 @@ class SMPLX(nn.Module):
         # The pose components
         num_pose_basis = smplx_model.posedirs.shape[-1]
         posedirs = np.reshape(smplx_model.posedirs, [-1, num_pose_basis]).T
-        self.register_buffer("posedirs", to_tensor(to_np(posedirs), dtype=self.dtype))
+        self.register_buffer("posedirs", asset_tensor(posedirs, dtype=self.dtype))
         self.register_buffer(
-            "J_regressor", to_tensor(to_np(smplx_model.J_regressor), dtype=self.dtype)
+            "J_regressor", asset_tensor(smplx_model.J_regressor, dtype=self.dtype)
         )
         parents = to_tensor(to_np(smplx_model.kintree_table[0])).long()
         parents[0] = -1
         self.register_buffer("parents", parents)
-        self.register_buffer("lbs_weights", to_tensor(to_np(smplx_model.weights), dtype=self.dtype))
+        self.register_buffer("lbs_weights", asset_tensor(smplx_model.weights, dtype=self.dtype))
         # for face keypoints
         self.register_buffer(
             "lmk_faces_idx", torch.tensor(smplx_model.lmk_faces_idx, dtype=torch.long)
@@ -14,6 +14,8 @@
 # For commercial licensing contact, please contact ps-license@tuebingen.mpg.de
 
 import os
+import time
+from contextlib import contextmanager
 
 import cv2
 import numpy as np
@@ -49,6 +51,8 @@ class PIXIE(object):
         self._create_model()
         # Set up the cropping modules used to generate face/hand crops from the body predictions
         self._setup_cropper()
+        # wall-clock time of the part crop / feature fusion stages of the last encode
+        self.timings = {}
 
     def forward(self, data):
 
@@ -180,6 +184,50 @@ class PIXIE(object):
             cropped_points_dict[points_key] = cropped_points
         return cropped_image, cropped_points_dict
 
+    def parts_from_body(self, image, points_dict, part_keys=("head", "left_hand", "right_hand")):
+        """crop all parts out from body data with a single batched warp, see part_from_body"""
+        batch_size = image.shape[0]
+        points_scale = image.shape[-2:]
+        croppers = [self.Cropper["hand" if "hand" in part_key else part_key] for part_key in part_keys]
+
+        centers, bbox_sizes = [], []
+        for part_key, cropper in zip(part_keys, croppers):
+            indices_key = "face" if part_key == "head" else part_key
+            points_for_crop = points_dict["smplx_kpt"][:, self.part_indices[indices_key]]
+            center, bbox_size = tensor_cropper.points2bbox(points_for_crop.clone(), points_scale)
+            center, bbox_size = tensor_cropper.augment_bbox(
+                center, bbox_size, scale=cropper.scale, trans_scale=cropper.trans_scale
+            )
+            centers.append(center)
+            bbox_sizes.append(bbox_size)
+
+        crop_sizes = set(cropper.crop_size for cropper in croppers)
+        if len(crop_sizes) > 1:
+            # parts of different crop size cannot share one warp
+            return {
+                part_key: tensor_cropper.crop_tensor(image, center, bbox_size, cropper.crop_size)[0]
+                for part_key, cropper, center, bbox_size in zip(part_keys, croppers, centers, bbox_sizes)
+            }
+
+        images = image.unsqueeze(0).expand(len(part_keys), *image.shape).flatten(0, 1)
+        cropped_images, _ = tensor_cropper.crop_tensor(
+            images, torch.cat(centers), torch.cat(bbox_sizes), crop_sizes.pop()
+        )
+        return {
+            part_key: cropped_images[idx * batch_size:(idx + 1) * batch_size]
+            for idx, part_key in enumerate(part_keys)
+        }
+
+    @contextmanager
+    def _timed(self, stage):
+        if str(self.device).startswith("cuda"):
+            torch.cuda.synchronize(self.device)
+        tic = time.perf_counter()
+        yield
+        if str(self.device).startswith("cuda"):
+            torch.cuda.synchronize(self.device)
+        self.timings[stage] = time.perf_counter() - tic
+
     @torch.no_grad()
     def encode(
         self,
@@ -209,6 +257,7 @@ class PIXIE(object):
 
         feature = {}
         param_dict = {}
+        self.timings = {}
 
         # Encode features
         for key in data.keys():
@@ -288,56 +337,68 @@ class PIXIE(object):
                         param_dict["moderator_weight"] = None
                         return param_dict
                     prediction_body_only = self.decode(param_dict[key], param_type="body")
-                    # crop
-                    for part_name in ["head", "left_hand", "right_hand"]:
-                        part = part_name.split("_")[-1]
+                    # crop: upsample the body image once, then crop all parts in one batched warp
+                    with self._timed("crop"):
                         points_dict = {
                             "smplx_kpt": prediction_body_only["smplx_kpt"],
                             "trans_verts": prediction_body_only["transformed_vertices"],
                         }
                         image_hd = torchvision.transforms.Resize(1024)(data["body"]["image"])
-                        cropped_image, cropped_joints_dict = self.part_from_body(
-                            image_hd, part_name, points_dict
-                        )
-                        data[key][part_name + "_image"] = cropped_image
+                        for part_name, cropped_image in self.parts_from_body(image_hd, points_dict).items():
+                            data[key][part_name + "_image"] = cropped_image
 
                 # -- encode features from part crops, then fuse feature using the weight from moderator
-                for part_name in ["head", "left_hand", "right_hand"]:
-                    part = part_name.split("_")[-1]
-                    cropped_image = data[key][part_name + "_image"]
-                    # if left hand, flip it as if it is right hand
-                    if part_name == "left_hand":
-                        cropped_image = torch.flip(cropped_image, dims=(-1, ))
-                    # run part regressor
-                    f_part = self.Encoder[part](cropped_image)
-                    part_dict = self.decompose_code(
-                        self.Regressor[part](f_part),
-                        self.param_list_dict[f"{part}_list"],
-                    )
-                    part_share_dict = self.decompose_code(
-                        self.Regressor[f"{part}_share"](f_part),
-                        self.param_list_dict[f"{part}_share_list"],
-                    )
-                    param_dict["body_" + part_name] = {**part_dict, **part_share_dict}
+                # both hands share the hand encoder / regressors / moderator, so they run as one batch
+                # (left hand flipped as if it is right hand)
+                with self._timed("fuse"):
+                    bz = data[key]["head_image"].shape[0]
+                    part_batches = [
+                        ("head", ["head"], data[key]["head_image"]),
+                        (
+                            "hand",
+                            ["left_hand", "right_hand"],
+                            torch.cat([
+                                torch.flip(data[key]["left_hand_image"], dims=(-1, )),
+                                data[key]["right_hand_image"],
+                            ]),
+                        ),
+                    ]
+                    for part, part_names, cropped_image in part_batches:
+                        # run part regressor
+                        f_part = self.Encoder[part](cropped_image)
+                        part_dict = self.decompose_code(
+                            self.Regressor[part](f_part),
+                            self.param_list_dict[f"{part}_list"],
+                        )
+                        part_share_dict = self.decompose_code(
+                            self.Regressor[f"{part}_share"](f_part),
+                            self.param_list_dict[f"{part}_share_list"],
+                        )
 
-                    # moderator to assign weight, then integrate features
-                    f_body_out, f_part_out, f_weight = self.Moderator[f"{part}_share"](
-                        feature["body"][f"{part_name}_share"], f_part, work=True
-                    )
-                    if copy_and_paste:
-                        # copy and paste strategy always trusts the results from part
-                        feature["body"][f"{part_name}_share"] = f_part
-                    elif threthold and part == "hand":
-                        # for hand, if part weight > 0.7 (very confident, then fully trust part)
-                        part_w = f_weight[:, [1]]
-                        part_w[part_w > 0.7] = 1.0
-                        f_body_out = (
-                            feature["body"][f"{part_name}_share"] * (1.0 - part_w) + f_part * part_w
+                        # moderator to assign weight, then integrate features
+                        f_body = torch.cat([
+                            feature["body"][f"{part_name}_share"] for part_name in part_names
+                        ])
+                        f_body_out, f_part_out, f_weight = self.Moderator[f"{part}_share"](
+                            f_body, f_part, work=True
                         )
-                        feature["body"][f"{part_name}_share"] = f_body_out
-                    else:
-                        feature["body"][f"{part_name}_share"] = f_body_out
-                    fusion_weight[part_name] = f_weight
+                        if copy_and_paste:
+                            # copy and paste strategy always trusts the results from part
+                            f_body_out = f_part
+                        elif threthold and part == "hand":
+                            # for hand, if part weight > 0.7 (very confident, then fully trust part)
+                            part_w = f_weight[:, [1]]
+                            part_w[part_w > 0.7] = 1.0
+                            f_body_out = f_body * (1.0 - part_w) + f_part * part_w
+
+                        for idx, part_name in enumerate(part_names):
+                            rows = slice(idx * bz, (idx + 1) * bz)
+                            param_dict["body_" + part_name] = {
+                                name: code[rows]
+                                for name, code in {**part_dict, **part_share_dict}.items()
+                            }
+                            feature["body"][f"{part_name}_share"] = f_body_out[rows]
+                            fusion_weight[part_name] = f_weight[rows]
                 # save weights from moderator, that can be further used for optimization/running specific tasks on parts
                 param_dict["moderator_weight"] = fusion_weight
 
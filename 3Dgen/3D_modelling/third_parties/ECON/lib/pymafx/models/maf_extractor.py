@@ -1,9 +1,11 @@
 # This script is borrowed and extended from https://github.com/shunsukesaito/PIFu/blob/master/lib/model/SurfaceClassifier.py
 
 import logging
+import os
+import os.path as osp
 
 import numpy as np
-import scipy
+import scipy.sparse
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -67,71 +69,112 @@ class TransformerDecoderUnit(nn.Module):
         return out
 
 
+OPERATOR_CACHE_DIR = os.environ.get(
+    "PYMAFX_OPERATOR_CACHE", osp.join(osp.expanduser("~"), ".cache", "pymafx_operators")
+)
+
+
+def load_sampling_operators(graph_path, level):
+    """ Composed down/up-sampling operators (scipy CSR) of a GraphCMR-style mesh graph,
+    cached to disk so later runs skip loading the pickled graph and composing the levels.
+    """
+    stat = os.stat(graph_path)
+    name = osp.splitext(osp.basename(graph_path))[0]
+    tag = f"{name}_{stat.st_size}_{stat.st_mtime_ns}_level{level}"
+    cache_paths = [osp.join(OPERATOR_CACHE_DIR, f"{tag}_{op}.npz") for op in ["D", "U"]]
+    if all(osp.exists(path) for path in cache_paths):
+        return [scipy.sparse.load_npz(path).tocsr() for path in cache_paths]
+
+    mesh_graph = np.load(graph_path, allow_pickle=True, encoding='latin1')
+    D = [scipy.sparse.csr_matrix(d, dtype=np.float64) for d in mesh_graph['D']]    # shape: (2,)
+    U = [scipy.sparse.csr_matrix(u, dtype=np.float64) for u in mesh_graph['U']]
+
+    # D[0] - Size: [1723, 6890] , [195, 778]
+    # D[1] - Size: [431, 1723] , [49, 195]
+    # U[0] - Size: [6890, 1723]
+    # U[1] - Size: [1723, 431]
+    if level == 2:
+        Dmap = D[1] @ D[0]    # 6890 -> 431
+        Umap = U[0] @ U[1]    # 431 -> 6890
+    elif level == 1:
+        Dmap = D[0]
+        Umap = U[0]
+    operators = [Dmap.astype(np.float32).tocsr(), Umap.astype(np.float32).tocsr()]
+
+    try:
+        os.makedirs(OPERATOR_CACHE_DIR, exist_ok=True)
+        for operator, path in zip(operators, cache_paths):
+            tmp_path = f"{path[:-4]}.{os.getpid()}.tmp.npz"
+            scipy.sparse.save_npz(tmp_path, operator)
+            os.replace(tmp_path, path)
+    except OSError:
+        logger.warning(f"cannot cache mesh sampling operators in {OPERATOR_CACHE_DIR}")
+
+    return operators
+
+
+def to_sparse_csr(matrix):
+    matrix = matrix.tocsr()
+    matrix.sort_indices()
+    return torch.sparse_csr_tensor(
+        torch.from_numpy(matrix.indptr.astype(np.int64)),
+        torch.from_numpy(matrix.indices.astype(np.int64)),
+        torch.from_numpy(matrix.data.astype(np.float32)),
+        size=matrix.shape,
+    )
+
+
 class Mesh_Sampler(nn.Module):
     ''' Mesh Up/Down-sampling
+    With sparse=True, Dmap / Umap are CSR operators and every resampling is a
+    sparse-dense product, whose cost scales with the number of non-zeros.
     '''
-    def __init__(self, type='smpl', level=2, device=torch.device('cuda'), option=None):
+    def __init__(self, type='smpl', level=2, device=torch.device('cuda'), option=None, sparse=True):
         super().__init__()
 
+        self.sparse = sparse
+
         # downsample SMPL mesh and assign part labels
         if type == 'smpl':
             # from https://github.com/nkolot/GraphCMR/blob/master/data/mesh_downsampling.npz
-            smpl_mesh_graph = np.load(
-                path_config.SMPL_DOWNSAMPLING, allow_pickle=True, encoding='latin1'
-            )
-
-            A = smpl_mesh_graph['A']
-            U = smpl_mesh_graph['U']
-            D = smpl_mesh_graph['D']    # shape: (2,)
+            graph_path = path_config.SMPL_DOWNSAMPLING
         elif type == 'mano':
             # from https://github.com/microsoft/MeshGraphormer/blob/main/src/modeling/data/mano_downsampling.npz
-            mano_mesh_graph = np.load(
-                path_config.MANO_DOWNSAMPLING, allow_pickle=True, encoding='latin1'
-            )
+            graph_path = path_config.MANO_DOWNSAMPLING
 
-            A = mano_mesh_graph['A']
-            U = mano_mesh_graph['U']
-            D = mano_mesh_graph['D']    # shape: (2,)
+        # downsampling mapping from 6890 points to 431 points
+        # upsampling mapping from 431 points to 6890 points
+        Dmap, Umap = load_sampling_operators(graph_path, level)
 
-        # downsampling
-        ptD = []
-        for lv in range(len(D)):
-            d = scipy.sparse.coo_matrix(D[lv])
-            i = torch.LongTensor(np.array([d.row, d.col]))
-            v = torch.FloatTensor(d.data)
-            ptD.append(torch.sparse.FloatTensor(i, v, d.shape))
+        if self.sparse:
+            # derived from the mesh graph, not saved (older checkpoints hold dense copies)
+            self.register_buffer('Dmap', to_sparse_csr(Dmap), persistent=False)
+            self.register_buffer('Umap', to_sparse_csr(Umap), persistent=False)
+        else:
+            self.register_buffer('Dmap', torch.from_numpy(Dmap.toarray()))
+            self.register_buffer('Umap', torch.from_numpy(Umap.toarray()))
 
-        # downsampling mapping from 6890 points to 431 points
-        # ptD[0].to_dense() - Size: [1723, 6890] , [195, 778]
-        # ptD[1].to_dense() - Size: [431, 1723] , [49, 195]
-        if level == 2:
-            Dmap = torch.matmul(ptD[1].to_dense(), ptD[0].to_dense())    # 6890 -> 431
-        elif level == 1:
-            Dmap = ptD[0].to_dense()    #
-        self.register_buffer('Dmap', Dmap)
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        if self.sparse:
+            for key in ['Dmap', 'Umap']:
+                state_dict.pop(prefix + key, None)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
-        # upsampling
-        ptU = []
-        for lv in range(len(U)):
-            d = scipy.sparse.coo_matrix(U[lv])
-            i = torch.LongTensor(np.array([d.row, d.col]))
-            v = torch.FloatTensor(d.data)
-            ptU.append(torch.sparse.FloatTensor(i, v, d.shape))
+    def _resample(self, op, x):
+        if not self.sparse:
+            return torch.matmul(op.unsqueeze(0), x)
 
-        # upsampling mapping from 431 points to 6890 points
-        # ptU[0].to_dense() - Size: [6890, 1723]
-        # ptU[1].to_dense() - Size: [1723, 431]
-        if level == 2:
-            Umap = torch.matmul(ptU[0].to_dense(), ptU[1].to_dense())    # 431 -> 6890
-        elif level == 1:
-            Umap = ptU[0].to_dense()    #
-        self.register_buffer('Umap', Umap)
+        # batched sparse-dense product: [M, N] x [N, B * C]
+        B, N, C = x.shape
+        x_flat = x.transpose(0, 1).reshape(N, B * C).to(op.dtype)
+        out = torch.sparse.mm(op, x_flat)
+        return out.reshape(-1, B, C).transpose(0, 1).to(x.dtype)
 
     def downsample(self, x):
-        return torch.matmul(self.Dmap.unsqueeze(0), x)    # [B, 431, 3]
+        return self._resample(self.Dmap, x)    # [B, 431, 3]
 
     def upsample(self, x):
-        return torch.matmul(self.Umap.unsqueeze(0), x)    # [B, 6890, 3]
+        return self._resample(self.Umap, x)    # [B, 6890, 3]
 
     def forward(self, x, mode='downsample'):
         if mode == 'downsample':
@@ -35,6 +35,16 @@ logger = logging.getLogger(__name__)
 BN_MOMENTUM = 0.1
 
 
+def select_visible(visible, pred, fallback):
+    """
+    visible: [B, ...] bool, pred: [B, ...], fallback: broadcastable to pred
+    return: pred where visible, fallback elsewhere, as one batched torch.where
+            (no per-sample python branching, so it is CUDA-graph / torch.compile friendly)
+    """
+    visible = visible.reshape(*visible.shape, *([1] * (pred.dim() - visible.dim())))
+    return torch.where(visible, pred, fallback.to(pred.dtype))
+
+
 class Regressor(nn.Module):
     def __init__(
         self,
@@ -486,65 +496,29 @@ class Regressor(nn.Module):
                                 # right elbow: 19
                                 opt_relbow = torch.bmm(pred_rotmat_body[:, 19], relbow_twist)
 
-                                if cfg.MODEL.PyMAF.PRED_VIS_H and global_iter == (
-                                    cfg.MODEL.PyMAF.N_ITER - 1
-                                ):
-                                    opt_lwrist_filtered = [
-                                        opt_lwrist[_i]
-                                        if pred_vis_lhand[_i] else pred_rotmat_body[_i, 20]
-                                        for _i in range(batch_size)
-                                    ]
-                                    opt_rwrist_filtered = [
-                                        opt_rwrist[_i]
-                                        if pred_vis_rhand[_i] else pred_rotmat_body[_i, 21]
-                                        for _i in range(batch_size)
-                                    ]
-                                    opt_lelbow_filtered = [
-                                        opt_lelbow[_i]
-                                        if pred_vis_lhand[_i] else pred_rotmat_body[_i, 18]
-                                        for _i in range(batch_size)
-                                    ]
-                                    opt_relbow_filtered = [
-                                        opt_relbow[_i]
-                                        if pred_vis_rhand[_i] else pred_rotmat_body[_i, 19]
-                                        for _i in range(batch_size)
-                                    ]
-
-                                    opt_lwrist = torch.stack(opt_lwrist_filtered)
-                                    opt_rwrist = torch.stack(opt_rwrist_filtered)
-                                    opt_lelbow = torch.stack(opt_lelbow_filtered)
-                                    opt_relbow = torch.stack(opt_relbow_filtered)
-
-                                pred_rotmat_body = torch.cat([
-                                    pred_rotmat_body[:, :18],
-                                    opt_lelbow.unsqueeze(1),
-                                    opt_relbow.unsqueeze(1),
-                                    opt_lwrist.unsqueeze(1),
-                                    opt_rwrist.unsqueeze(1), pred_rotmat_body[:, 22:]
-                                ], 1)
+                                # joints 18 ~ 21: left / right elbow, left / right wrist
+                                opt_start = 18
+                                opt_joints = [opt_lelbow, opt_relbow, opt_lwrist, opt_rwrist]
                             else:
-                                if cfg.MODEL.PyMAF.PRED_VIS_H and global_iter == (
-                                    cfg.MODEL.PyMAF.N_ITER - 1
-                                ):
-                                    opt_lwrist_filtered = [
-                                        opt_lwrist[_i]
-                                        if pred_vis_lhand[_i] else pred_rotmat_body[_i, 20]
-                                        for _i in range(batch_size)
-                                    ]
-                                    opt_rwrist_filtered = [
-                                        opt_rwrist[_i]
-                                        if pred_vis_rhand[_i] else pred_rotmat_body[_i, 21]
-                                        for _i in range(batch_size)
-                                    ]
-
-                                    opt_lwrist = torch.stack(opt_lwrist_filtered)
-                                    opt_rwrist = torch.stack(opt_rwrist_filtered)
-
-                                pred_rotmat_body = torch.cat([
-                                    pred_rotmat_body[:, :20],
-                                    opt_lwrist.unsqueeze(1),
-                                    opt_rwrist.unsqueeze(1), pred_rotmat_body[:, 22:]
-                                ], 1)
+                                # joints 20 ~ 21: left / right wrist
+                                opt_start = 20
+                                opt_joints = [opt_lwrist, opt_rwrist]
+                            opt_joints = torch.stack(opt_joints, dim=1)
+
+                            if cfg.MODEL.PyMAF.PRED_VIS_H and global_iter == (
+                                cfg.MODEL.PyMAF.N_ITER - 1
+                            ):
+                                # keep the regressed body joints of invisible hands
+                                opt_vis = torch.stack([pred_vis_lhand, pred_vis_rhand], dim=1)
+                                opt_vis = opt_vis.repeat(1, opt_joints.shape[1] // 2)
+                                opt_joints = select_visible(
+                                    opt_vis, opt_joints, pred_rotmat_body[:, opt_start:22]
+                                )
+
+                            pred_rotmat_body = torch.cat([
+                                pred_rotmat_body[:, :opt_start], opt_joints,
+                                pred_rotmat_body[:, 22:]
+                            ], 1)
 
         if self.hand_only_mode:
             pred_rotmat_rh = rot6d_to_rotmat(
@@ -573,16 +547,9 @@ class Regressor(nn.Module):
         # if self.full_body_mode:
         if self.smplx_mode:
             if cfg.MODEL.PyMAF.PRED_VIS_H and global_iter == (cfg.MODEL.PyMAF.N_ITER - 1):
-                pred_lhand_filtered = [
-                    pred_lhand[_i] if pred_vis_lhand[_i] else self.init_rhand[0]
-                    for _i in range(batch_size)
-                ]
-                pred_rhand_filtered = [
-                    pred_rhand[_i] if pred_vis_rhand[_i] else self.init_rhand[0]
-                    for _i in range(batch_size)
-                ]
-                pred_lhand_filtered = torch.stack(pred_lhand_filtered)
-                pred_rhand_filtered = torch.stack(pred_rhand_filtered)
+                # invisible hands fall back to the mean hand pose
+                pred_lhand_filtered = select_visible(pred_vis_lhand, pred_lhand, self.init_rhand)
+                pred_rhand_filtered = select_visible(pred_vis_rhand, pred_rhand, self.init_rhand)
                 pred_hf6d = torch.cat([pred_lhand_filtered, pred_rhand_filtered, pred_face],
                                       dim=1).reshape(batch_size, -1, 6)
             else:
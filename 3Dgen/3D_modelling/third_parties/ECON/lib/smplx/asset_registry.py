@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+# Max-Planck-Gesellschaft zur Förderung der Wissenschaften e.V. (MPG) is
+# holder of all proprietary rights on this computer program.
+# You can only use this computer program if you have closed
+# a license agreement with MPG or you get the right to use the computer
+# program from someone who is authorized to grant you that right.
+# Any use of the computer program without a valid license is prohibited and
+# liable to prosecution.
+#
+# Copyright©2019 Max-Planck-Gesellschaft zur Förderung
+# der Wissenschaften e.V. (MPG). acting on behalf of its Max Planck Institute
+# for Intelligent Systems. All rights reserved.
+#
+# Contact: ps-license@tuebingen.mpg.de
+
+import hashlib
+import mmap
+import os
+import os.path as osp
+import pickle
+import shutil
+import tempfile
+import threading
+from typing import Dict
+
+import numpy as np
+import torch
+
+from .utils import Struct
+
+# SMPL-X / MANO / FLAME model files (pkl / npz) are converted once into a folder of
+# plain .npy files, which every later load maps read-only (copy-on-write) into memory
+# instead of unpickling them again. The mapped arrays are shared by all callers of the
+# process and marked read-only, model buffers are private copy-on-write mappings of the
+# same files (see asset_tensor): clean pages are shared, writes stay in one instance.
+
+ASSET_CACHE_DIR = os.environ.get(
+    "SMPLX_ASSET_CACHE", osp.join(osp.expanduser("~"), ".cache", "smplx_assets")
+)
+ASSET_FORMAT_VERSION = 1
+
+_registry: Dict[str, object] = {}
+_lock = threading.Lock()
+
+
+def _asset_dir(path):
+    stat = os.stat(path)
+    key = f"{osp.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}:{ASSET_FORMAT_VERSION}"
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return osp.join(ASSET_CACHE_DIR, f"{osp.splitext(osp.basename(path))[0]}_{digest}")
+
+
+def _read_model_file(path):
+    if path.endswith(".npz"):
+        with np.load(path, allow_pickle=True) as model_file:
+            return {key: model_file[key] for key in model_file.files}
+    with open(path, "rb") as model_file:
+        return pickle.load(model_file, encoding="latin1")
+
+
+def _as_flat_array(value):
+    """dense numeric array for value, or None if it has to stay a pickled object"""
+    if "scipy.sparse" in str(type(value)):
+        value = value.todense()
+    try:
+        array = np.asarray(value)
+    except Exception:
+        return None
+    if array.dtype.kind == "f":
+        return np.ascontiguousarray(array, dtype=np.float32)
+    if array.dtype.kind in "iub":
+        return np.ascontiguousarray(array)
+    return None
+
+
+def _convert(path, asset_dir):
+    """write every numeric entry of the model file as <key>.npy, the rest in objects.pkl"""
+
+    os.makedirs(osp.dirname(asset_dir), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=osp.dirname(asset_dir))
+    objects = {}
+    for key, value in _read_model_file(path).items():
+        array = _as_flat_array(value)
+        if array is None:
+            objects[key] = value
+        else:
+            np.save(osp.join(tmp_dir, f"{key}.npy"), array)
+    with open(osp.join(tmp_dir, "objects.pkl"), "wb") as f:
+        pickle.dump(objects, f)
+
+    try:
+        os.rename(tmp_dir, asset_dir)
+    except OSError:
+        # another process finished the same conversion first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _map_flat(asset_dir):
+    data = {}
+    with open(osp.join(asset_dir, "objects.pkl"), "rb") as f:
+        data.update(pickle.load(f))
+    for fname in os.listdir(asset_dir):
+        if fname.endswith(".npy"):
+            data[fname[:-4]] = _read_only(np.load(osp.join(asset_dir, fname), mmap_mode="c"))
+    return data
+
+
+def _read_only(array):
+    array = np.asarray(array)
+    array.setflags(write=False)
+    return array
+
+
+def load_model_data(path):
+    """
+    Struct with the content of a SMPL / SMPL-H / SMPL-X / MANO / FLAME model file,
+    numeric entries are memory-mapped float32 / integer arrays shared by all callers.
+    Falls back to a regular load when the cache folder cannot be written.
+    """
+
+    path = osp.abspath(path)
+    with _lock:
+        if path not in _registry:
+            try:
+                asset_dir = _asset_dir(path)
+                if not osp.isdir(asset_dir):
+                    _convert(path, asset_dir)
+                data = _map_flat(asset_dir)
+            except OSError:
+                data = _read_model_file(path)
+            _registry[path] = data
+
+    return Struct(**_registry[path])
+
+
+def load_array(path):
+    """memory-mapped (copy-on-write) .npy array, loaded once per process and read-only"""
+
+    path = osp.abspath(path)
+    with _lock:
+        if path not in _registry:
+            try:
+                _registry[path] = _read_only(np.load(path, mmap_mode="c", allow_pickle=False))
+            except ValueError:
+                # object arrays cannot be memory-mapped
+                _registry[path] = _read_only(np.load(path, allow_pickle=True))
+    return _registry[path]
+
+
+def load_object(path, loader):
+    """loader(path) result (json / pickle / ...), loaded once per process, do not modify it"""
+
+    path = osp.abspath(path)
+    with _lock:
+        if path not in _registry:
+            _registry[path] = loader(path)
+    return _registry[path]
+
+
+def _private_mapping(array):
+    """
+    the same view of array on a new copy-on-write mapping of its .npy file,
+    None if array is not a (strided) view of a memory-mapped file
+    """
+
+    root = array
+    while isinstance(root.base, np.ndarray):
+        root = root.base
+    if not (isinstance(root, np.memmap) and isinstance(root.base, mmap.mmap)):
+        return None
+    if any(stride < 0 for stride in array.strides):
+        return None
+
+    offset = array.__array_interface__["data"][0] - root.__array_interface__["data"][0]
+    mapping = np.load(root.filename, mmap_mode="c")
+    return np.ndarray(array.shape, array.dtype, buffer=mapping, offset=offset, strides=array.strides)
+
+
+def asset_tensor(array, dtype=torch.float32):
+    """
+    tensor of a (shared, read-only) model array for the buffers of one model instance.
+    Memory-mapped arrays get their own copy-on-write mapping, so the pages are shared until
+    an instance writes to its buffers (load_state_dict, copy_, ...), everything else is copied.
+    """
+
+    if "scipy.sparse" in str(type(array)):
+        array = array.todense()
+    array = np.asarray(array)
+    if array.dtype == torch.empty(0, dtype=dtype).numpy().dtype:
+        mapping = _private_mapping(array)
+        if mapping is not None:
+            return torch.from_numpy(mapping)
+    return torch.tensor(array, dtype=dtype)
+
+
+def clear_registry():
+    with _lock:
+        _registry.clear()
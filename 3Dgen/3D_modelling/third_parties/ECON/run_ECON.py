@@ -47,6 +47,8 @@ from lib.common.voxelize import VoxelGrid
 from lib.dataset.mesh_util import *
 from lib.dataset.TestDataset import TestDataset
 from lib.net.geometry import rot6d_to_rotmat, rotation_matrix_to_angle_axis
+from lib.net.NormalPredictor import NormalPredictor, SMPLVersions
+from lib.net.precision import PrecisionMode, dump_validation_sample
 
 torch.backends.cudnn.benchmark = True
 
@@ -91,6 +93,11 @@ if __name__ == "__main__":
     )
     normal_net = normal_net.to(device)
     normal_net.netG.eval()
+    # inputs of the normal / IF-Net+ networks are stored here for apps/check_precision.py
+    precision_val_dir = os.environ.get("PRECISION_VAL_DIR")
+    normal_predictor = NormalPredictor(
+        normal_net.netG, PrecisionMode.from_cfg(cfg.infer, cfg.infer.normal_precision, device)
+    )
     print(
         colored(
             f"Resume Normal Estimator from {Format.start} {cfg.normal_path} {Format.end}", "green"
@@ -99,6 +106,7 @@ if __name__ == "__main__":
 
     # SMPLX object
     SMPLX_object = SMPLX()
+    smplx_topology = get_topology("cpu")
     dataset_param = {
         "image_dir": args.in_dir,
         "seg_dir": args.seg_dir,
@@ -116,6 +124,7 @@ if __name__ == "__main__":
         )
         ifnet = ifnet.to(device)
         ifnet.netG.eval()
+        ifnet.set_precision(PrecisionMode.from_cfg(cfg.infer, cfg.infer.ifnet_precision, device))
 
         print(colored(f"Resume IF-Net+ from {Format.start} {cfg.ifnet_path} {Format.end}", "green"))
         print(colored(f"Complete with {Format.start} IF-Nets+ (Implicit) {Format.end}", "green"))
@@ -222,8 +231,11 @@ if __name__ == "__main__":
             # import imageio
             # imageio.imwrite('test_normal.png', (in_tensor["T_normal_F"][0].permute(1,2,0).cpu().numpy()*255.).astype('uint8'))
 
-            with torch.no_grad():
-                in_tensor["normal_F"], in_tensor["normal_B"] = normal_net.netG(in_tensor)
+            in_tensor["normal_F"], in_tensor["normal_B"] = normal_predictor(in_tensor)
+            dump_validation_sample(
+                precision_val_dir, f"{data['name']}_normal",
+                {key: in_tensor[key] for key in set(normal_net.netG.in_nmlF + normal_net.netG.in_nmlB)}
+            )
 
             in_tensor["smpl_verts"] = batch_smpl_verts * torch.tensor([1., -1., 1.]).to(device)
             in_tensor["smpl_faces"] = batch_smpl_faces[:, :, [0, 2, 1]]
@@ -231,6 +243,8 @@ if __name__ == "__main__":
         else:
             # smpl optimization
             loop_smpl = tqdm(range(args.loop_smpl))
+            smpl_versions = SMPLVersions()
+            body_keys = [(data['name'], idx) for idx in range(N_body)]
 
             for i in loop_smpl:
 
@@ -280,8 +294,14 @@ if __name__ == "__main__":
 
                 T_mask_F, T_mask_B = dataset.render.get_image(type="mask")
 
-                with torch.no_grad():
-                    in_tensor["normal_F"], in_tensor["normal_B"] = normal_net.netG(in_tensor)
+                # bodies whose fit barely moved since their last prediction reuse it
+                refresh_tol = 0.0 if i == args.loop_smpl - 1 else cfg.infer.normal_refresh_tol
+                versions = smpl_versions.update(
+                    [optimed_pose, optimed_betas, optimed_orient, optimed_trans], refresh_tol
+                )
+                in_tensor["normal_F"], in_tensor["normal_B"] = normal_predictor(
+                    in_tensor, keys=body_keys, versions=versions
+                )
                 # imageio.imwrite(f'test_normal_F_{i}.png', ((in_tensor["normal_F"][0].permute(1,2,0).cpu().numpy()+1.)*0.5*255.).astype('uint8'))
 
                 diff_F_smpl = torch.abs(in_tensor["T_normal_F"] - in_tensor["normal_F"])
@@ -364,6 +384,8 @@ if __name__ == "__main__":
                 optimizer_smpl.step()
                 scheduler_smpl.step(smpl_loss)
 
+            normal_predictor.clear()
+
             in_tensor["smpl_verts"] = smpl_verts * torch.tensor([1.0, 1.0, -1.0]).to(device)
             in_tensor["smpl_faces"] = in_tensor["smpl_faces"][:, :, [0, 2, 1]]
 
@@ -501,7 +523,7 @@ if __name__ == "__main__":
 
                 side_mesh_path = f"{args.out_dir}/{data['name']}/{cfg.name}/obj/{data['name']}_{idx}_IF.obj"
 
-                side_mesh = apply_face_mask(side_mesh, ~SMPLX_object.smplx_eyeball_fid_mask)
+                side_mesh = apply_face_mask(side_mesh, ~smplx_topology.eyeball_face_mask)
 
                 # mesh completion via IF-net
                 in_tensor.update(
@@ -518,10 +540,18 @@ if __name__ == "__main__":
 
                 in_tensor["body_voxels"] = torch.tensor(occupancies.copy()
                                                        ).float().unsqueeze(0).to(device)
+                dump_validation_sample(
+                    precision_val_dir, f"{data['name']}_{idx}_ifnet", {
+                        "depth_voxels": in_tensor["depth_voxels"], "body_voxels":
+                        in_tensor["body_voxels"]
+                    }
+                )
 
                 with torch.no_grad():
                     sdf = ifnet.reconEngine(netG=ifnet.netG, batch=in_tensor)
                     verts_IF, faces_IF = ifnet.reconEngine.export_mesh(sdf)
+                # the encoder features cached by query_func_IF are done
+                in_tensor.pop("feat_geo_cache", None)
 
                 if ifnet.clean_mesh_flag:
                     verts_IF, faces_IF = clean_mesh(verts_IF, faces_IF)
@@ -530,13 +560,7 @@ if __name__ == "__main__":
                 side_mesh = remesh_laplacian(side_mesh, side_mesh_path)
 
             else:
-                side_mesh = apply_vertex_mask(
-                    side_mesh,
-                    (
-                        SMPLX_object.front_flame_vertex_mask + SMPLX_object.smplx_mano_vertex_mask +
-                        SMPLX_object.eyeball_vertex_mask
-                    ).eq(0).float(),
-                )
+                side_mesh = apply_vertex_mask(side_mesh, smplx_topology.body_vertex_mask)
 
                 #register side_mesh to BNI surfaces
                 side_mesh = Meshes(
@@ -563,7 +587,7 @@ if __name__ == "__main__":
             if "face" in cfg.bni.use_smpl:
 
                 # only face
-                face_mesh = apply_vertex_mask(face_mesh, SMPLX_object.front_flame_vertex_mask)
+                face_mesh = apply_vertex_mask(face_mesh, smplx_topology.front_flame_vertex_mask)
                 face_mesh.vertices = face_mesh.vertices - np.array([0, 0, cfg.bni.thickness])
 
                 # remove face neighbor triangles
@@ -583,15 +607,7 @@ if __name__ == "__main__":
 
             if "hand" in cfg.bni.use_smpl and (True in data['hands_visibility'][idx]):
 
-                hand_mask = torch.zeros(SMPLX_object.smplx_verts.shape[0], )
-                if data['hands_visibility'][idx][0]:
-                    hand_mask.index_fill_(
-                        0, torch.tensor(SMPLX_object.smplx_mano_vid_dict["left_hand"]), 1.0
-                    )
-                if data['hands_visibility'][idx][1]:
-                    hand_mask.index_fill_(
-                        0, torch.tensor(SMPLX_object.smplx_mano_vid_dict["right_hand"]), 1.0
-                    )
+                hand_mask = smplx_topology.visible_hand_mask(data['hands_visibility'][idx])
 
                 # only hands
                 hand_mesh = apply_vertex_mask(hand_mesh, hand_mask)
@@ -353,6 +353,8 @@ if __name__ == "__main__":
                 with torch.no_grad():
                     sdf = ifnet.reconEngine(netG=ifnet.netG, batch=in_tensor)
                     verts_IF, faces_IF = ifnet.reconEngine.export_mesh(sdf)
+                # the encoder features cached by query_func_IF are done
+                in_tensor.pop("feat_geo_cache", None)
 
                 if ifnet.clean_mesh_flag:
                     verts_IF, faces_IF = clean_mesh(verts_IF, faces_IF)
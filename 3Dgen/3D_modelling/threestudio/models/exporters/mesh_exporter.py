@@ -1,7 +1,5 @@
 from dataclasses import dataclass, field
 
-import cv2
-import numpy as np
 import torch
 
 import threestudio
@@ -11,6 +9,7 @@ from threestudio.models.geometry.base import BaseImplicitGeometry
 from threestudio.models.materials.base import BaseMaterial
 from threestudio.models.mesh import Mesh
 from threestudio.utils.rasterize import NVDiffRasterizerContext
+from threestudio.utils.texture_baking import bake_textures
 from threestudio.utils.typing import *
 
 
@@ -28,6 +27,8 @@ class MeshExporter(Exporter):
         xatlas_chart_options: dict = field(default_factory=dict)
         xatlas_pack_options: dict = field(default_factory=dict)
         context_type: str = "gl"
+        # number of texels per geometry / material query when baking textures, 0 for all at once
+        texture_bake_chunk_size: int = 262144
 
     cfg: Config
 
@@ -69,60 +70,44 @@ class MeshExporter(Exporter):
         if self.cfg.save_texture:
             threestudio.info("Exporting textures ...")
             assert self.cfg.save_uv, "save_uv must be True when save_texture is True"
-            # clip space transform
-            uv_clip = mesh.v_tex * 2.0 - 1.0
-            # pad to four component coordinate
-            uv_clip4 = torch.cat(
-                (
-                    uv_clip,
-                    torch.zeros_like(uv_clip[..., 0:1]),
-                    torch.ones_like(uv_clip[..., 0:1]),
-                ),
-                dim=-1,
-            )
-            # rasterize
-            rast, _ = self.ctx.rasterize_one(
-                uv_clip4, mesh.t_tex_idx, (self.cfg.texture_size, self.cfg.texture_size)
-            )
 
-            hole_mask = ~(rast[:, :, 3] > 0)
-
-            def uv_padding(image):
-                uv_padding_size = self.cfg.xatlas_pack_options.get("padding", 2)
-                inpaint_image = (
-                    cv2.inpaint(
-                        (image.detach().cpu().numpy() * 255).astype(np.uint8),
-                        (hole_mask.detach().cpu().numpy() * 255).astype(np.uint8),
-                        uv_padding_size,
-                        cv2.INPAINT_TELEA,
-                    )
-                    / 255.0
-                )
-                return torch.from_numpy(inpaint_image).to(image)
-
-            # Interpolate world space position
-            gb_pos, _ = self.ctx.interpolate_one(
-                mesh.v_pos, rast[None, ...], mesh.t_pos_idx
+            def query_fn(points):
+                geo_out = self.geometry.export(points=points)
+                mat_out = self.material.export(points=points, **geo_out)
+                return {**geo_out, **mat_out}
+
+            # covered texels only, all maps in one pass, seams padded on-device
+            maps = bake_textures(
+                self.ctx,
+                mesh.v_pos,
+                mesh.t_pos_idx,
+                mesh.v_tex,
+                mesh.t_tex_idx,
+                self.cfg.texture_size,
+                query_fn,
+                chunk_size=self.cfg.texture_bake_chunk_size,
             )
-            gb_pos = gb_pos[0]
-
-            # Sample out textures from MLP
-            geo_out = self.geometry.export(points=gb_pos)
-            mat_out = self.material.export(points=gb_pos, **geo_out)
 
-            threestudio.info(
-                "Perform UV padding on texture maps to avoid seams, may take a while ..."
-            )
-            if "normal" in geo_out:
-                params["map_Bump"] = uv_padding(geo_out["normal"])
+            if "normal" in maps:
+                params["map_Bump"] = maps["normal"]
 
-            if "albedo" in mat_out:
-                params["map_Kd"] = uv_padding(mat_out["albedo"])
+            if "albedo" in maps:
+                params["map_Kd"] = maps["albedo"]
             else:
                 threestudio.warn(
                     "save_texture is True but no albedo texture found, using default white texture"
                 )
-            # TODO: map_Ks
+
+            if "metallic" in maps and "roughness" in maps:
+                params["map_Ks"] = torch.cat(
+                    [
+                        torch.zeros_like(maps["metallic"]),
+                        maps["roughness"],
+                        maps["metallic"],
+                    ],
+                    dim=-1,
+                )
+
         return [
             ExporterOutput(
                 save_name=f"{self.cfg.save_name}.obj", save_type="obj", params=params
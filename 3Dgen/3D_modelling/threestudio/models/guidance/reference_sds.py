@@ -2,12 +2,11 @@
 # https://github.com/Mikubill/sd-webui-controlnet/discussions/1236
 
 from dataclasses import dataclass, field
-import clip, os
+import os
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import torchvision.transforms as T
 from diffusers import DDIMScheduler, DDPMScheduler, UniPCMultistepScheduler, StableDiffusionPipeline
 from diffusers.utils.import_utils import is_xformers_available
 from diffusers.utils.torch_utils import randn_tensor
@@ -429,12 +428,6 @@ class StableDiffusionReferenceGuidance(BaseObject):
         self.scheduler.sigma_t = self.scheduler.sigma_t.to(self.device)
         self.scheduler.lambda_t = self.scheduler.lambda_t.to(self.device)
 
-        self.aug = T.Compose([
-            T.Resize((224, 224)),
-            T.Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711)),
-        ])
-        self.text_latents = {}
-
         self.alphas: Float[Tensor, "..."] = self.scheduler.alphas_cumprod.to(
             self.device
         )
@@ -491,29 +484,6 @@ class StableDiffusionReferenceGuidance(BaseObject):
         image = (image * 0.5 + 0.5).clamp(0, 1)
         return image.to(input_dtype)
 
-    def img_clip_loss(self, clip_model, rgb1, rgb2):
-        image_z_1 = clip_model.encode_image(self.aug(rgb1))
-        image_z_2 = clip_model.encode_image(self.aug(rgb2))
-        image_z_1 = image_z_1 / image_z_1.norm(dim=-1, keepdim=True) # normalize features
-        image_z_2 = image_z_2 / image_z_2.norm(dim=-1, keepdim=True) # normalize features
-
-        loss = - (image_z_1 * image_z_2).sum(-1).mean()
-        return loss
-    
-    def img_text_clip_loss(self, clip_model, rgb, prompt, view_dir=None):
-        image_z_1 = clip_model.encode_image(self.aug(rgb))
-        image_z_1 = image_z_1 / image_z_1.norm(dim=-1, keepdim=True) # normalize features
-
-        if view_dir in self.text_latents:
-            text_z = self.text_latents[view_dir]
-        else:
-            text = clip.tokenize(prompt).to(self.device)
-            text_z = clip_model.encode_text(text)
-            text_z = text_z / text_z.norm(dim=-1, keepdim=True)
-            self.text_latents[view_dir] = text_z.detach()
-        loss = - (image_z_1 * text_z).sum(-1).mean()
-        return loss
-    
     def multiple_step_denoise(
         self, 
         rgb: Float[Tensor, "B H W C"],
@@ -732,8 +702,9 @@ class StableDiffusionReferenceGuidance(BaseObject):
         azimuth: Float[Tensor, "B"],
         camera_distances: Float[Tensor, "B"],
         ref_rgb=None, 
+        ref_rgb_key=None,
         ref_text=None, 
-        clip_model=None,
+        clip_features=None,
         rendered_region='full',
         with_clip_text_loss=True,
         mask_image_ref=None,
@@ -786,9 +757,13 @@ class StableDiffusionReferenceGuidance(BaseObject):
             self.scheduler.set_timesteps(self.num_train_timesteps, device=self.device)
             de_latents = self.scheduler.step(noise_pred, t, latents_noisy)['prev_sample']
             imgs = self.decode_latents(de_latents)
-            grad = 10.*self.img_clip_loss(clip_model, imgs, ref_rgb) 
+            # one CLIP forward for the denoised image, reference / text embeddings are
+            # cached in the ClipFeatures shared with the system
+            image_z = clip_features.encode_images(imgs)[0]
+            ref_z = clip_features.encode_reference(ref_rgb, ref_rgb_key)
+            grad = 10.*clip_features.similarity_loss(image_z, ref_z) 
             if with_clip_text_loss:
-                grad += 10.*self.img_text_clip_loss(clip_model, imgs, ref_text[0], ref_text[1])
+                grad += 10.*clip_features.similarity_loss(image_z, clip_features.encode_text(ref_text[0]))
             out_grad = False
         else:
             if self.cfg.weighting_strategy == "sds":
@@ -848,8 +823,9 @@ class StableDiffusionReferenceGuidance(BaseObject):
         camera_distances: Float[Tensor, "B"],
         guidance_eval=False,
         ref_rgb=None, 
+        ref_rgb_key=None,
         ref_text=None, 
-        clip_model=None,
+        clip_features=None,
         with_clip_loss=False,
         with_clip_text_loss=True,
         rendered_region='full',
@@ -884,8 +860,8 @@ class StableDiffusionReferenceGuidance(BaseObject):
 
         if with_clip_loss:
             grad, guidance_eval_utils = self.compute_grad_sds_clip(
-                latents, ref_image_latents, t, prompt_utils, elevation, azimuth, camera_distances, ref_rgb=ref_rgb, ref_text=ref_text, 
-                clip_model=clip_model, rendered_region=rendered_region, with_clip_text_loss=with_clip_text_loss,
+                latents, ref_image_latents, t, prompt_utils, elevation, azimuth, camera_distances, ref_rgb=ref_rgb, ref_rgb_key=ref_rgb_key, ref_text=ref_text, 
+                clip_features=clip_features, rendered_region=rendered_region, with_clip_text_loss=with_clip_text_loss,
                 mask_image_ref=mask_image_ref, mask_image_ini=mask_image_ini,
             )
         else:
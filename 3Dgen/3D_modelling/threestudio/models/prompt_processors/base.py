@@ -121,96 +121,107 @@ class PromptProcessorOutput:
         # IMPORTANT: we return (cond, uncond), which is in different order than other implementations!
         return torch.cat([text_embeddings, uncond_text_embeddings], dim=0)
 
-    def get_text_embeddings_perp_neg(
+    def get_direction_idx(
         self,
         elevation: Float[Tensor, "B"],
         azimuth: Float[Tensor, "B"],
         camera_distances: Float[Tensor, "B"],
-        view_dependent_prompting: bool = True,
-    ) -> Tuple[Float[Tensor, "BBBB N Nf"], Float[Tensor, "B 2"]]:
-        assert (
-            view_dependent_prompting
-        ), "Perp-Neg only works with view-dependent prompting"
+    ) -> Int[Tensor, "B"]:
+        # torch.where instead of masked assignment, no host sync
+        direction_idx = torch.zeros_like(elevation, dtype=torch.long)
+        for d in self.directions:
+            direction_idx = torch.where(
+                d.condition(elevation, azimuth, camera_distances),
+                self.direction2idx[d.name],
+                direction_idx,
+            )
+        return direction_idx
 
+    def perp_neg_embeddings(
+        self,
+        text_embeddings_vd: Float[Tensor, "Nv N Nf"],
+        elevation: Float[Tensor, "B"],
+        azimuth: Float[Tensor, "B"],
+        camera_distances: Float[Tensor, "B"],
+    ) -> Tuple[Float[Tensor, "BBBB N Nf"], Float[Tensor, "B 2"]]:
+        # whole-batch Perp-Neg assembly with tensor ops only (no host syncs),
+        # returns (pos, uncond, neg_0, neg_1 interleaved per camera) and the negative weights
         batch_size = elevation.shape[0]
 
-        direction_idx = torch.zeros_like(elevation, dtype=torch.long)
-        for d in self.directions:
-            direction_idx[
-                d.condition(elevation, azimuth, camera_distances)
-            ] = self.direction2idx[d.name]
+        direction_idx = self.get_direction_idx(elevation, azimuth, camera_distances)
         # 0 - side view
         # 1 - front view
         # 2 - back view
         # 3 - overhead view
 
-        pos_text_embeddings = []
-        neg_text_embeddings = []
-        neg_guidance_weights = []
-        uncond_text_embeddings = []
-
-        side_emb = self.text_embeddings_vd[0]
-        front_emb = self.text_embeddings_vd[1]
-        back_emb = self.text_embeddings_vd[2]
-        overhead_emb = self.text_embeddings_vd[3]
-
-        for idx, ele, azi, dis in zip(
-            direction_idx, elevation, azimuth, camera_distances
-        ):
-            azi = shift_azimuth_deg(azi)  # to (-180, 180)
-            uncond_text_embeddings.append(
-                self.uncond_text_embeddings_vd[idx]
-            )  # should be ""
-            if idx.item() == 3:  # overhead view
-                pos_text_embeddings.append(overhead_emb)  # side view
-                # dummy
-                neg_text_embeddings += [
-                    self.uncond_text_embeddings_vd[idx],
-                    self.uncond_text_embeddings_vd[idx],
-                ]
-                neg_guidance_weights += [0.0, 0.0]
-            else:  # interpolating views
-                if torch.abs(azi) < 90:
-                    # front-side interpolation
-                    # 0 - complete side, 1 - complete front
-                    r_inter = 1 - torch.abs(azi) / 90
-                    pos_text_embeddings.append(
-                        r_inter * front_emb + (1 - r_inter) * side_emb
-                    )
-                    neg_text_embeddings += [front_emb, side_emb]
-                    neg_guidance_weights += [
-                        -shifted_expotional_decay(*self.perp_neg_f_fs, r_inter),
-                        -shifted_expotional_decay(*self.perp_neg_f_sf, 1 - r_inter),
-                    ]
-                else:
-                    # side-back interpolation
-                    # 0 - complete back, 1 - complete side
-                    r_inter = 2.0 - torch.abs(azi) / 90
-                    pos_text_embeddings.append(
-                        r_inter * side_emb + (1 - r_inter) * back_emb
-                    )
-                    neg_text_embeddings += [side_emb, front_emb]
-                    neg_guidance_weights += [
-                        -shifted_expotional_decay(*self.perp_neg_f_sb, r_inter),
-                        -shifted_expotional_decay(*self.perp_neg_f_fsb, r_inter),
-                    ]
+        side_emb = text_embeddings_vd[0]
+        front_emb = text_embeddings_vd[1]
+        back_emb = text_embeddings_vd[2]
+        overhead_emb = text_embeddings_vd[3]
+
+        azi = shift_azimuth_deg(azimuth)  # to (-180, 180)
+        overhead = (direction_idx == 3)[:, None, None]
+        front_side = torch.abs(azi) < 90
+
+        # front-side interpolation: 0 - complete side, 1 - complete front
+        # side-back interpolation: 0 - complete back, 1 - complete side
+        r_inter = torch.where(front_side, 1 - torch.abs(azi) / 90, 2.0 - torch.abs(azi) / 90)
+        r = r_inter[:, None, None]
+        front_side_ = front_side[:, None, None]
+
+        uncond_text_embeddings = self.uncond_text_embeddings_vd[direction_idx]  # should be ""
+        pos_text_embeddings = torch.where(
+            front_side_,
+            r * front_emb + (1 - r) * side_emb,
+            r * side_emb + (1 - r) * back_emb,
+        )
+        pos_text_embeddings = torch.where(overhead, overhead_emb, pos_text_embeddings)
 
-        text_embeddings = torch.cat(
+        # overhead views get dummy uncond negatives with zero weight
+        neg_text_embeddings = torch.stack(
+            [
+                torch.where(
+                    overhead,
+                    uncond_text_embeddings,
+                    torch.where(front_side_, front_emb, side_emb),
+                ),
+                torch.where(
+                    overhead,
+                    uncond_text_embeddings,
+                    torch.where(front_side_, side_emb, front_emb),
+                ),
+            ],
+            dim=1,
+        ).flatten(0, 1)
+
+        neg_guidance_weights = torch.stack(
             [
-                torch.stack(pos_text_embeddings, dim=0),
-                torch.stack(uncond_text_embeddings, dim=0),
-                torch.stack(neg_text_embeddings, dim=0),
+                torch.where(
+                    front_side,
+                    -shifted_expotional_decay(*self.perp_neg_f_fs, r_inter),
+                    -shifted_expotional_decay(*self.perp_neg_f_sb, r_inter),
+                ),
+                torch.where(
+                    front_side,
+                    -shifted_expotional_decay(*self.perp_neg_f_sf, 1 - r_inter),
+                    -shifted_expotional_decay(*self.perp_neg_f_fsb, r_inter),
+                ),
             ],
+            dim=-1,
+        )
+        neg_guidance_weights = torch.where(
+            overhead[:, :, 0], torch.zeros_like(neg_guidance_weights), neg_guidance_weights
+        )
+
+        text_embeddings = torch.cat(
+            [pos_text_embeddings, uncond_text_embeddings, neg_text_embeddings],
             dim=0,
         )
 
-        return text_embeddings, torch.as_tensor(
-            neg_guidance_weights, device=elevation.device
-        ).reshape(batch_size, 2)
-    
-    def get_local_text_embeddings_perp_neg(
+        return text_embeddings, neg_guidance_weights.reshape(batch_size, 2)
+
+    def get_text_embeddings_perp_neg(
         self,
-        part_name, # support 'full' / 'head' / 'foot'
         elevation: Float[Tensor, "B"],
         azimuth: Float[Tensor, "B"],
         camera_distances: Float[Tensor, "B"],
@@ -220,93 +231,33 @@ class PromptProcessorOutput:
             view_dependent_prompting
         ), "Perp-Neg only works with view-dependent prompting"
 
-        batch_size = elevation.shape[0]
-
-        direction_idx = torch.zeros_like(elevation, dtype=torch.long)
-        for d in self.directions:
-            direction_idx[
-                d.condition(elevation, azimuth, camera_distances)
-            ] = self.direction2idx[d.name]
-        # 0 - side view
-        # 1 - front view
-        # 2 - back view
-        # 3 - overhead view
+        return self.perp_neg_embeddings(
+            self.text_embeddings_vd, elevation, azimuth, camera_distances
+        )
 
-        pos_text_embeddings = []
-        neg_text_embeddings = []
-        neg_guidance_weights = []
-        uncond_text_embeddings = []
+    def get_local_text_embeddings_perp_neg(
+        self,
+        part_name, # support 'full' / 'head' / 'foot'
+        elevation: Float[Tensor, "B"],
+        azimuth: Float[Tensor, "B"],
+        camera_distances: Float[Tensor, "B"],
+        view_dependent_prompting: bool = True,
+    ) -> Tuple[Float[Tensor, "BBBB N Nf"], Float[Tensor, "B 2"]]:
+        assert (
+            view_dependent_prompting
+        ), "Perp-Neg only works with view-dependent prompting"
 
         if part_name == 'full':
-            side_emb = self.text_embeddings_vd[0]
-            front_emb = self.text_embeddings_vd[1]
-            back_emb = self.text_embeddings_vd[2]
-            overhead_emb = self.text_embeddings_vd[3]
+            text_embeddings_vd = self.text_embeddings_vd
         elif part_name == 'head':
-            side_emb = self.head_text_embeddings_vd[0]
-            front_emb = self.head_text_embeddings_vd[1]
-            back_emb = self.head_text_embeddings_vd[2]
-            overhead_emb = self.head_text_embeddings_vd[3]
+            text_embeddings_vd = self.head_text_embeddings_vd
         elif part_name == 'foot':
-            side_emb = self.foot_text_embeddings_vd[0]
-            front_emb = self.foot_text_embeddings_vd[1]
-            back_emb = self.foot_text_embeddings_vd[2]
-            overhead_emb = self.foot_text_embeddings_vd[3]
-
-        for idx, ele, azi, dis in zip(
-            direction_idx, elevation, azimuth, camera_distances
-        ):
-            azi = shift_azimuth_deg(azi)  # to (-180, 180)
-            uncond_text_embeddings.append(
-                self.uncond_text_embeddings_vd[idx]
-            )  # should be ""
-            if idx.item() == 3:  # overhead view
-                pos_text_embeddings.append(overhead_emb)  # side view
-                # dummy
-                neg_text_embeddings += [
-                    self.uncond_text_embeddings_vd[idx],
-                    self.uncond_text_embeddings_vd[idx],
-                ]
-                neg_guidance_weights += [0.0, 0.0]
-            else:  # interpolating views
-                if torch.abs(azi) < 90:
-                    # front-side interpolation
-                    # 0 - complete side, 1 - complete front
-                    r_inter = 1 - torch.abs(azi) / 90
-                    pos_text_embeddings.append(
-                        r_inter * front_emb + (1 - r_inter) * side_emb
-                    )
-                    neg_text_embeddings += [front_emb, side_emb]
-                    neg_guidance_weights += [
-                        -shifted_expotional_decay(*self.perp_neg_f_fs, r_inter),
-                        -shifted_expotional_decay(*self.perp_neg_f_sf, 1 - r_inter),
-                    ]
-                else:
-                    # side-back interpolation
-                    # 0 - complete back, 1 - complete side
-                    r_inter = 2.0 - torch.abs(azi) / 90
-                    pos_text_embeddings.append(
-                        r_inter * side_emb + (1 - r_inter) * back_emb
-                    )
-                    neg_text_embeddings += [side_emb, front_emb]
-                    neg_guidance_weights += [
-                        -shifted_expotional_decay(*self.perp_neg_f_sb, r_inter),
-                        -shifted_expotional_decay(*self.perp_neg_f_fsb, r_inter),
-                    ]
+            text_embeddings_vd = self.foot_text_embeddings_vd
 
-        text_embeddings = torch.cat(
-            [
-                torch.stack(pos_text_embeddings, dim=0),
-                torch.stack(uncond_text_embeddings, dim=0),
-                torch.stack(neg_text_embeddings, dim=0),
-            ],
-            dim=0,
+        return self.perp_neg_embeddings(
+            text_embeddings_vd, elevation, azimuth, camera_distances
         )
 
-        return text_embeddings, torch.as_tensor(
-            neg_guidance_weights, device=elevation.device
-        ).reshape(batch_size, 2)
-
 
 def shift_azimuth_deg(azimuth: Float[Tensor, "..."]) -> Float[Tensor, "..."]:
     # shift azimuth angle (in degrees), to [-180, 180]
@@ -657,6 +608,29 @@ class PromptProcessor(BaseObject):
         raise NotImplementedError
 
     def get_debiased_prompt(self, prompt: str) -> List[str]:
+        views = [d.name for d in self.directions]
+        n_words = len(prompt.split(" "))
+        prompt_debiasing_mask_ids = (
+            self.cfg.prompt_debiasing_mask_ids
+            if self.cfg.prompt_debiasing_mask_ids is not None
+            else list(range(n_words))
+        )
+
+        # debiased prompts are cached like the text embeddings, repeat runs skip BERT
+        cache_key = f"debias-{prompt}-{prompt_debiasing_mask_ids}-{views}"
+        cache_path = os.path.join(
+            self._cache_dir,
+            f"{hash_prompt(self.cfg.pretrained_model_name_or_path_prompt_debiasing, cache_key)}.json",
+        )
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                debiased_prompts = json.load(f)
+            for d, debiased_prompt in zip(views, debiased_prompts):
+                threestudio.info(
+                    f"Debiased prompt of the {d} view is [{debiased_prompt}] (cached)"
+                )
+            return debiased_prompts
+
         os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
         tokenizer = AutoTokenizer.from_pretrained(
@@ -666,45 +640,47 @@ class PromptProcessor(BaseObject):
             self.cfg.pretrained_model_name_or_path_prompt_debiasing
         )
 
-        views = [d.name for d in self.directions]
         view_ids = tokenizer(" ".join(views), return_tensors="pt").input_ids[0]
         view_ids = view_ids[1:5]
 
-        def modulate(prompt):
-            prompt_vd = f"This image is depicting a [MASK] view of {prompt}"
+        @torch.no_grad()
+        def modulate(prompts):
+            # all prompts in one forward, padded to the longest one
             tokens = tokenizer(
-                prompt_vd,
-                padding="max_length",
+                [f"This image is depicting a [MASK] view of {p}" for p in prompts],
+                padding=True,
                 truncation=True,
                 add_special_tokens=True,
                 return_tensors="pt",
             )
-            mask_idx = torch.where(tokens.input_ids == tokenizer.mask_token_id)[1]
+            rows, mask_idx = torch.where(tokens.input_ids == tokenizer.mask_token_id)
 
             logits = model(**tokens).logits
-            logits = F.softmax(logits[0, mask_idx], dim=-1)
-            logits = logits[0, view_ids]
-            probes = logits / logits.sum()
+            logits = F.softmax(logits[rows, mask_idx], dim=-1)
+            logits = logits[:, view_ids]
+            probes = logits / logits.sum(dim=-1, keepdim=True)
             return probes
 
-        prompts = [prompt.split(" ") for _ in range(4)]
-        full_probe = modulate(prompt)
-        n_words = len(prompt.split(" "))
-        prompt_debiasing_mask_ids = (
-            self.cfg.prompt_debiasing_mask_ids
-            if self.cfg.prompt_debiasing_mask_ids is not None
-            else list(range(n_words))
-        )
         words_to_debias = [prompt.split(" ")[idx] for idx in prompt_debiasing_mask_ids]
         threestudio.info(f"Words that can potentially be removed: {words_to_debias}")
-        for idx in prompt_debiasing_mask_ids:
-            words = prompt.split(" ")
-            prompt_ = " ".join(words[:idx] + words[(idx + 1) :])
-            part_probe = modulate(prompt_)
-
-            pmi = full_probe / torch.lerp(part_probe, full_probe, 0.5)
-            for i in range(pmi.shape[0]):
-                if pmi[i].item() < 0.95:
+
+        words = prompt.split(" ")
+        probes = modulate(
+            [prompt]
+            + [
+                " ".join(words[:idx] + words[(idx + 1) :])
+                for idx in prompt_debiasing_mask_ids
+            ]
+        )
+        full_probe, part_probes = probes[:1], probes[1:]
+
+        pmi = full_probe / torch.lerp(part_probes, full_probe, 0.5)
+        remove = (pmi < 0.95).tolist()
+
+        prompts = [prompt.split(" ") for _ in range(4)]
+        for k, idx in enumerate(prompt_debiasing_mask_ids):
+            for i in range(len(prompts)):
+                if remove[k][i]:
                     prompts[i][idx] = ""
 
         debiased_prompts = [" ".join([word for word in p if word]) for p in prompts]
@@ -714,6 +690,11 @@ class PromptProcessor(BaseObject):
         del tokenizer, model
         cleanup()
 
+        if get_rank() == 0:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            with open(cache_path, "w") as f:
+                json.dump(debiased_prompts, f)
+
         return debiased_prompts
 
     def __call__(self) -> PromptProcessorOutput:
@@ -9,7 +9,13 @@ from threestudio.models.exporters.base import Exporter, ExporterOutput
 from threestudio.systems.utils import parse_optimizer, parse_scheduler
 from threestudio.utils.base import Updateable, update_if_possible
 from threestudio.utils.config import parse_structured
-from threestudio.utils.misc import C, cleanup, get_device, load_module_weights
+from threestudio.utils.misc import (
+    C,
+    CleanupPolicy,
+    cleanup,
+    get_device,
+    load_module_weights,
+)
 from threestudio.utils.saving import SaverMixin
 from threestudio.utils.typing import *
 
@@ -25,6 +31,10 @@ class BaseSystem(pl.LightningModule, Updateable, SaverMixin):
         weights_ignore_modules: Optional[List[str]] = None
         cleanup_after_validation_step: bool = False
         cleanup_after_test_step: bool = False
+        # the step cleanups above only run past these allocator thresholds (see CleanupPolicy),
+        # and always once at the end of the validation / test / predict loop
+        cleanup_reserved_threshold: float = 0.9
+        cleanup_fragmentation_threshold: float = 0.5
 
     cfg: Config
 
@@ -35,6 +45,10 @@ class BaseSystem(pl.LightningModule, Updateable, SaverMixin):
         self._resumed: bool = resumed
         self._resumed_eval: bool = False
         self._resumed_eval_status: dict = {"global_step": 0, "current_epoch": 0}
+        self.cleanup_policy = CleanupPolicy(
+            self.cfg.cleanup_reserved_threshold,
+            self.cfg.cleanup_fragmentation_threshold,
+        )
         if "loggers" in cfg:
             self.create_loggers(cfg.loggers)
 
@@ -109,8 +123,13 @@ class BaseSystem(pl.LightningModule, Updateable, SaverMixin):
 
     def on_validation_batch_end(self, outputs, batch, batch_idx):
         if self.cfg.cleanup_after_validation_step:
-            # cleanup to save vram
-            cleanup()
+            # cleanup to save vram, only under memory pressure
+            self.cleanup_policy.step()
+
+    def on_validation_end(self):
+        if self.cfg.cleanup_after_validation_step:
+            self.cleanup_policy.force()
+            threestudio.info(self.cleanup_policy.report())
 
     def on_validation_epoch_end(self):
         raise NotImplementedError
@@ -120,8 +139,13 @@ class BaseSystem(pl.LightningModule, Updateable, SaverMixin):
 
     def on_test_batch_end(self, outputs, batch, batch_idx):
         if self.cfg.cleanup_after_test_step:
-            # cleanup to save vram
-            cleanup()
+            # cleanup to save vram, only under memory pressure
+            self.cleanup_policy.step()
+
+    def on_test_end(self):
+        if self.cfg.cleanup_after_test_step:
+            self.cleanup_policy.force()
+            threestudio.info(self.cleanup_policy.report())
 
     def on_test_epoch_end(self):
         pass
@@ -131,8 +155,13 @@ class BaseSystem(pl.LightningModule, Updateable, SaverMixin):
 
     def on_predict_batch_end(self, outputs, batch, batch_idx):
         if self.cfg.cleanup_after_test_step:
-            # cleanup to save vram
-            cleanup()
+            # cleanup to save vram, only under memory pressure
+            self.cleanup_policy.step()
+
+    def on_predict_end(self):
+        if self.cfg.cleanup_after_test_step:
+            self.cleanup_policy.force()
+            threestudio.info(self.cleanup_policy.report())
 
     def on_predict_epoch_end(self):
         pass
@@ -277,6 +306,7 @@ class BaseLift3DSystem(BaseSystem):
             )
 
     def on_test_end(self) -> None:
+        super().on_test_end()
         if self._save_dir is not None:
             threestudio.info(f"Test results saved to {self._save_dir}")
 
@@ -304,6 +334,7 @@ class BaseLift3DSystem(BaseSystem):
             save_func(f"it{self.true_global_step}-export/{out.save_name}", **out.params)
 
     def on_predict_end(self) -> None:
+        super().on_predict_end()
         if self._save_dir is not None:
             threestudio.info(f"Export assets saved to {self._save_dir}")
 
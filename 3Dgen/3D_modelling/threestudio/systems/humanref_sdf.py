@@ -4,13 +4,12 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import torchvision.transforms as T
-from mesh_renderer.meshrender import MeshRender
-import clip
 import random
 import imageio, cv2
 import threestudio
 from threestudio.systems.base import BaseLift3DSystem
+from threestudio.utils.base import lazy_module
+from threestudio.utils.clip_features import ClipFeatures
 from threestudio.utils.misc import cleanup, get_device
 from threestudio.utils.ops import binary_cross_entropy, dot
 from threestudio.utils.typing import *
@@ -39,6 +38,9 @@ class HumanRef(BaseLift3DSystem):
         run_initial: bool = True
         run_local_rendering: bool = False
         attention_strategy: int = 1
+        # >0: random background colors of CLIP-loss steps are drawn from a palette with
+        # this many levels per channel, so reference CLIP embeddings can be cached
+        clip_bg_levels: int = 0
 
     cfg: Config
 
@@ -46,27 +48,8 @@ class HumanRef(BaseLift3DSystem):
         # set up geometry, material, background, renderer
         super().configure()
 
-        self.guidance = threestudio.find(self.cfg.guidance_type)(self.cfg.guidance)
-        
-        self.prompt_processor = threestudio.find(self.cfg.prompt_processor_type)(self.cfg.prompt_processor)
-        self.prompt_utils = self.prompt_processor()
-
-        # CLIP model for calculating clip loss
-        self.clip_model, self.clip_preprocess = clip.load("ViT-B/16", device=self.device, jit=False, download_root=os.path.join(os.getenv('WEIGHT_PATH'), 'clip'))
-        self.aug = T.Compose([
-            T.Resize((224, 224)),
-            T.Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711)),
-        ])
-        for p in self.clip_model.parameters():
-            p.requires_grad = False
-        
-        # perceptual loss
-        from third_parties.lpips.lpips import LPIPS
-        self.loss_fn_vgg = LPIPS(
-            net='vgg', pretrained=True, 
-            model_path='./third_parties/lpips/weights/v0.1/vgg.pth',
-            net_path=os.path.join(os.getenv('WEIGHT_PATH'), 'LPIPS/vgg16-397923af.pth'),
-            ).to(self.device)
+        # guidance, prompt processor, CLIP and LPIPS are only needed for training / validation,
+        # they are built on first use (see the lazy_module attributes below)
         self.mseloss = nn.MSELoss()
         self.pearson = None
         self.std2mesh = None
@@ -76,9 +59,53 @@ class HumanRef(BaseLift3DSystem):
             "in the side view",]
         self.direction_embs = None
         self.image_emb = None
-        self.text_latents = {}
         self.bg_white = torch.tensor([[1.,1.,1.]], device=self.device).expand(1, 512, 512, 3).contiguous()
 
+    @lazy_module
+    def guidance(self):
+        return threestudio.find(self.cfg.guidance_type)(self.cfg.guidance)
+
+    @lazy_module
+    def prompt_processor(self):
+        return threestudio.find(self.cfg.prompt_processor_type)(self.cfg.prompt_processor)
+
+    @lazy_module
+    def prompt_utils(self):
+        return self.prompt_processor()
+
+    @lazy_module
+    def clip_model(self):
+        # CLIP model for calculating clip loss
+        import clip
+        clip_model, _ = clip.load("ViT-B/16", device=self.device, jit=False, download_root=os.path.join(os.getenv('WEIGHT_PATH'), 'clip'))
+        for p in clip_model.parameters():
+            p.requires_grad = False
+        return clip_model
+
+    @lazy_module
+    def clip_features(self):
+        # CLIP embeddings (cached reference / text latents) shared with the guidance, the
+        # reference cache holds every ("ref" / "noface", region, background color) key
+        cache_size = max(256, 2 * 3 * self.cfg.clip_bg_levels ** 3)
+        return ClipFeatures(self.clip_model, self.device, cache_size=cache_size)
+
+    @lazy_module
+    def loss_fn_vgg(self):
+        # perceptual loss
+        from third_parties.lpips.lpips import LPIPS
+        return LPIPS(
+            net='vgg', pretrained=True, 
+            model_path='./third_parties/lpips/weights/v0.1/vgg.pth',
+            net_path=os.path.join(os.getenv('WEIGHT_PATH'), 'LPIPS/vgg16-397923af.pth'),
+            ).to(self.device)
+
+    def on_load_checkpoint(self, checkpoint):
+        # checkpoints from before the lazy loading still contain the frozen CLIP / LPIPS weights
+        for key in list(checkpoint["state_dict"].keys()):
+            if key.startswith(("clip_model.", "loss_fn_vgg.")):
+                del checkpoint["state_dict"][key]
+        return super().on_load_checkpoint(checkpoint)
+
     def forward(self, batch: Dict[str, Any]) -> Dict[str, Any]:
         # if self.cfg.stage == "geometry":
         #     render_out = self.renderer(**batch, render_normal=True, render_rgb=False)
@@ -119,29 +146,6 @@ class HumanRef(BaseLift3DSystem):
         union = (predict + target - predict * target).sum(dims) + 1e-6
         return 1. - (intersect / union).sum() / intersect.nelement()
     
-    def img_clip_loss(self, rgb1, rgb2):
-        image_z_1 = self.clip_model.encode_image(self.aug(rgb1))
-        image_z_2 = self.clip_model.encode_image(self.aug(rgb2))
-        image_z_1 = image_z_1 / image_z_1.norm(dim=-1, keepdim=True) # normalize features
-        image_z_2 = image_z_2 / image_z_2.norm(dim=-1, keepdim=True) # normalize features
-
-        loss = - (image_z_1 * image_z_2).sum(-1).mean()
-        return loss
-    
-    def img_text_clip_loss(self, rgb, prompt, view_dir=None):
-        image_z_1 = self.clip_model.encode_image(self.aug(rgb))
-        image_z_1 = image_z_1 / image_z_1.norm(dim=-1, keepdim=True) # normalize features
-
-        if view_dir in self.text_latents:
-            text_z = self.text_latents[view_dir]
-        else:
-            text = clip.tokenize(prompt).to(self.device)
-            text_z = self.clip_model.encode_text(text)
-            text_z = text_z / text_z.norm(dim=-1, keepdim=True)
-            self.text_latents[view_dir] = text_z.detach()
-        loss = - (image_z_1 * text_z).sum(-1).mean()
-        return loss
-
     def view_matching(self, azimuth, elevation):
         if azimuth >= -15 and azimuth < 15:
             indx = 0
@@ -171,6 +175,10 @@ class HumanRef(BaseLift3DSystem):
 
     def on_fit_start(self) -> None:
         super().on_fit_start()
+        # training always needs the guidance, build it before the first step so its
+        # step-dependent state is updated like the other modules
+        self.guidance
+        self.prompt_utils
         if 'implicit-sdf' in self.cfg.geometry_type:
             # initialize SDF
             self.geometry.initialize_shape(run_init=self.cfg.run_initial)
@@ -211,7 +219,6 @@ class HumanRef(BaseLift3DSystem):
             rate_denomi = 10
             # use_cloth_loss = True
         if self.global_step >= 3000:
-            self.text_latents = {}
             w_normal = 10.
         if self.global_step >= int(0.6*self.cfg.max_iters):
             w_normal = 100.
@@ -264,7 +271,13 @@ class HumanRef(BaseLift3DSystem):
 
         # randomly change background color
         bs = batch["rays_o"].shape[0]
-        bg_color = torch.rand(bs, 3, device=self.device)
+        if use_clip_loss and not is_front_view and self.cfg.clip_bg_levels > 0:
+            bg_level = torch.randint(0, self.cfg.clip_bg_levels, (bs, 3))
+            bg_key = (rendered_region, tuple(bg_level.flatten().tolist()))
+            bg_color = (bg_level.float() / max(self.cfg.clip_bg_levels - 1, 1)).to(self.device)
+        else:
+            bg_key = None
+            bg_color = torch.rand(bs, 3, device=self.device)
         bg_img = bg_color.expand(1, 512, 512, 3).contiguous()
         batch["bg_color"] = bg_color
         rgb_ref = rgb_ref * mask_ref + bg_img * (1 - mask_ref)
@@ -299,7 +312,14 @@ class HumanRef(BaseLift3DSystem):
             rgb_ref_noface = rgb_ref * (1. - bbox_face) + bg_img * bbox_face
             band_face = pred_mask * band_face
             pred_rgb_nohead = pred_rgb * (1. - band_face) + bg_img * band_face
-            loss_ref = self.cfg.loss.lambda_clip * self.img_clip_loss(pred_rgb_nohead.permute(0,3,1,2), rgb_ref_noface.permute(0,3,1,2)) 
+            # with the text loss, both rendered images go through one CLIP forward,
+            # the reference embedding is cached per background
+            if with_clip_text_loss:
+                pred_z_nohead, pred_z = self.clip_features.encode_images(pred_rgb_nohead.permute(0,3,1,2), pred_rgb.permute(0,3,1,2))
+            else:
+                pred_z_nohead, = self.clip_features.encode_images(pred_rgb_nohead.permute(0,3,1,2))
+            ref_z = self.clip_features.encode_reference(rgb_ref_noface.permute(0,3,1,2), None if bg_key is None else ("noface",) + bg_key)
+            loss_ref = self.cfg.loss.lambda_clip * self.clip_features.similarity_loss(pred_z_nohead, ref_z) 
             if with_clip_text_loss:
                 direction_prompt, view_dirs = [''], ['']
                 for d in self.prompt_utils.directions:
@@ -307,7 +327,7 @@ class HumanRef(BaseLift3DSystem):
                         direction_prompt.append(f', {d.name} view' if d.name != 'back' and d.name != 'side rear' else f', {d.name} view, no face')
                         view_dirs.append(d.name)
                 text = self.cfg.prompt_processor.prompt + direction_prompt[-1]
-                loss_ref += self.cfg.loss.lambda_clip * self.img_text_clip_loss(pred_rgb.permute(0,3,1,2), text, view_dirs[-1])
+                loss_ref += self.cfg.loss.lambda_clip * self.clip_features.similarity_loss(pred_z, self.clip_features.encode_text(text))
             # self.log("train/loss_ref", loss_ref.item())
             loss += loss_ref
 
@@ -394,8 +414,9 @@ class HumanRef(BaseLift3DSystem):
                 prompt_utils=self.prompt_utils, **batch, 
                 rgb_as_latents=False,
                 ref_rgb=rgb_ref.permute(0,3,1,2), 
+                ref_rgb_key=None if bg_key is None else ("ref",) + bg_key,
                 ref_text=[text, view_dirs[-1]] if use_clip_loss and with_clip_text_loss else [self.cfg.prompt_processor.prompt, ''], 
-                clip_model=self.clip_model,
+                clip_features=self.clip_features if use_clip_loss else None,
                 with_clip_loss=use_clip_loss,
                 rendered_region=rendered_region,
                 with_clip_text_loss=with_clip_text_loss,
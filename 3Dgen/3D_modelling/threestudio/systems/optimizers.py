@@ -0,0 +1,252 @@
+import inspect
+import math
+
+import torch
+from torch.optim import Optimizer
+
+import threestudio
+from threestudio.utils.typing import *
+
+
+class Adan(Optimizer):
+    """
+    Adan: Adaptive Nesterov Momentum Algorithm (Xie et al., 2022).
+    With foreach=True all parameters of a group are updated with multi-tensor
+    torch._foreach_* kernels instead of one small kernel chain per tensor.
+    """
+
+    def __init__(
+        self,
+        params,
+        lr: float = 1e-3,
+        betas: Tuple[float, float, float] = (0.98, 0.92, 0.99),
+        eps: float = 1e-8,
+        weight_decay: float = 0.0,
+        max_grad_norm: float = 0.0,
+        no_prox: bool = False,
+        foreach: Optional[bool] = None,
+    ):
+        if not 0.0 <= max_grad_norm:
+            raise ValueError(f"Invalid max_grad_norm: {max_grad_norm}")
+        if not 0.0 <= lr:
+            raise ValueError(f"Invalid learning rate: {lr}")
+        if not 0.0 <= eps:
+            raise ValueError(f"Invalid epsilon value: {eps}")
+        for i, beta in enumerate(betas):
+            if not 0.0 <= beta < 1.0:
+                raise ValueError(f"Invalid beta parameter at index {i}: {beta}")
+        defaults = dict(
+            lr=lr,
+            betas=betas,
+            eps=eps,
+            weight_decay=weight_decay,
+            max_grad_norm=max_grad_norm,
+            no_prox=no_prox,
+            foreach=foreach,
+        )
+        super().__init__(params, defaults)
+
+    @torch.no_grad()
+    def restart_opt(self):
+        for group in self.param_groups:
+            group["step"] = 0
+            for p in group["params"]:
+                if p.requires_grad:
+                    state = self.state[p]
+                    state["exp_avg"] = torch.zeros_like(p)
+                    state["exp_avg_sq"] = torch.zeros_like(p)
+                    state["exp_avg_diff"] = torch.zeros_like(p)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        if self.defaults["max_grad_norm"] > 0:
+            grads = [
+                p.grad for group in self.param_groups for p in group["params"] if p.grad is not None
+            ]
+            global_grad_norm = torch.linalg.vector_norm(
+                torch.stack([torch.linalg.vector_norm(g) for g in grads])
+            ) if len(grads) > 0 else torch.zeros(())
+            clip_global_grad_norm = torch.clamp(
+                self.defaults["max_grad_norm"] / (global_grad_norm + self.defaults["eps"]),
+                max=1.0,
+            )
+        else:
+            clip_global_grad_norm = 1.0
+
+        for group in self.param_groups:
+            params, grads, exp_avgs, exp_avg_sqs, exp_avg_diffs, pre_grads = [], [], [], [], [], []
+            beta1, beta2, beta3 = group["betas"]
+            group["step"] = group.get("step", 0) + 1
+
+            for p in group["params"]:
+                if p.grad is None:
+                    continue
+                if p.grad.is_sparse:
+                    raise RuntimeError("Adan does not support sparse gradients")
+                state = self.state[p]
+                if len(state) == 0:
+                    state["exp_avg"] = torch.zeros_like(p)
+                    state["exp_avg_sq"] = torch.zeros_like(p)
+                    state["exp_avg_diff"] = torch.zeros_like(p)
+                if "pre_grad" not in state or group["step"] == 1:
+                    state["pre_grad"] = p.grad.mul(clip_global_grad_norm)
+
+                params.append(p)
+                grads.append(p.grad)
+                exp_avgs.append(state["exp_avg"])
+                exp_avg_sqs.append(state["exp_avg_sq"])
+                exp_avg_diffs.append(state["exp_avg_diff"])
+                pre_grads.append(state["pre_grad"])
+
+            if len(params) == 0:
+                continue
+
+            kwargs = dict(
+                beta1=beta1,
+                beta2=beta2,
+                beta3=beta3,
+                bias_correction1=1.0 - beta1 ** group["step"],
+                bias_correction2=1.0 - beta2 ** group["step"],
+                bias_correction3_sqrt=math.sqrt(1.0 - beta3 ** group["step"]),
+                lr=group["lr"],
+                weight_decay=group["weight_decay"],
+                eps=group["eps"],
+                no_prox=group["no_prox"],
+                clip_global_grad_norm=clip_global_grad_norm,
+            )
+            foreach = group["foreach"]
+            if foreach is None:
+                foreach = all(p.is_cuda for p in params)
+            if foreach:
+                _multi_tensor_adan(params, grads, exp_avgs, exp_avg_sqs, exp_avg_diffs, pre_grads, **kwargs)
+            else:
+                _single_tensor_adan(params, grads, exp_avgs, exp_avg_sqs, exp_avg_diffs, pre_grads, **kwargs)
+
+        return loss
+
+
+def _single_tensor_adan(
+    params, grads, exp_avgs, exp_avg_sqs, exp_avg_diffs, pre_grads, *, beta1, beta2, beta3,
+    bias_correction1, bias_correction2, bias_correction3_sqrt, lr, weight_decay, eps, no_prox,
+    clip_global_grad_norm,
+):
+    for param, grad, exp_avg, exp_avg_sq, exp_avg_diff, pre_grad in zip(
+        params, grads, exp_avgs, exp_avg_sqs, exp_avg_diffs, pre_grads
+    ):
+        grad = grad.mul(clip_global_grad_norm)
+        diff = grad - pre_grad
+        update = grad + beta2 * diff
+
+        exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)  # m_t
+        exp_avg_diff.mul_(beta2).add_(diff, alpha=1 - beta2)  # diff_t
+        exp_avg_sq.mul_(beta3).addcmul_(update, update, value=1 - beta3)  # n_t
+
+        denom = (exp_avg_sq.sqrt() / bias_correction3_sqrt).add_(eps)
+        update = (
+            exp_avg / bias_correction1 + beta2 * exp_avg_diff / bias_correction2
+        ).div_(denom)
+
+        if no_prox:
+            param.mul_(1 - lr * weight_decay)
+            param.add_(update, alpha=-lr)
+        else:
+            param.add_(update, alpha=-lr)
+            param.div_(1 + lr * weight_decay)
+
+        pre_grad.copy_(grad)
+
+
+def _multi_tensor_adan(
+    params, grads, exp_avgs, exp_avg_sqs, exp_avg_diffs, pre_grads, *, beta1, beta2, beta3,
+    bias_correction1, bias_correction2, bias_correction3_sqrt, lr, weight_decay, eps, no_prox,
+    clip_global_grad_norm,
+):
+    grads = torch._foreach_mul(grads, clip_global_grad_norm)
+    diffs = torch._foreach_sub(grads, pre_grads)
+    updates = torch._foreach_add(grads, diffs, alpha=beta2)
+
+    torch._foreach_mul_(exp_avgs, beta1)
+    torch._foreach_add_(exp_avgs, grads, alpha=1 - beta1)  # m_t
+    torch._foreach_mul_(exp_avg_diffs, beta2)
+    torch._foreach_add_(exp_avg_diffs, diffs, alpha=1 - beta2)  # diff_t
+    torch._foreach_mul_(exp_avg_sqs, beta3)
+    torch._foreach_addcmul_(exp_avg_sqs, updates, updates, value=1 - beta3)  # n_t
+
+    denom = torch._foreach_sqrt(exp_avg_sqs)
+    torch._foreach_div_(denom, bias_correction3_sqrt)
+    torch._foreach_add_(denom, eps)
+
+    updates = torch._foreach_div(exp_avgs, bias_correction1)
+    torch._foreach_add_(
+        updates, torch._foreach_div(exp_avg_diffs, bias_correction2), alpha=beta2
+    )
+    torch._foreach_div_(updates, denom)
+
+    if no_prox:
+        torch._foreach_mul_(params, 1 - lr * weight_decay)
+        torch._foreach_add_(params, updates, alpha=-lr)
+    else:
+        torch._foreach_add_(params, updates, alpha=-lr)
+        torch._foreach_div_(params, 1 + lr * weight_decay)
+
+    for pre_grad, grad in zip(pre_grads, grads):
+        pre_grad.copy_(grad)
+
+
+# optimizers implemented here, the rest is looked up in torch.optim
+OPTIMIZERS: Dict[str, type] = {"Adan": Adan}
+
+
+def get_optimizer_cls(name: str) -> type:
+    if name in OPTIMIZERS:
+        return OPTIMIZERS[name]
+    if name == "FusedAdam":
+        # apex is optional, torch.optim.Adam picks its fused kernel in make_optimizer
+        try:
+            import apex
+
+            return apex.optimizers.FusedAdam
+        except ImportError:
+            threestudio.warn("apex is not installed, using torch.optim.Adam for FusedAdam")
+            return torch.optim.Adam
+    if hasattr(torch.optim, name):
+        return getattr(torch.optim, name)
+    raise ValueError(f"Unknown optimizer {name}")
+
+
+def make_optimizer(name: str, params, **kwargs) -> Optimizer:
+    """
+    Build optimizer name, enabling the fused (all parameters on cuda) or
+    foreach (multi-tensor) implementation when the class supports it and
+    the config does not choose one itself.
+    """
+    cls = get_optimizer_cls(name)
+    params = list(params)
+    tensors = [
+        p
+        for group in params
+        for p in (group["params"] if isinstance(group, dict) else [group])
+    ]
+    supported = inspect.signature(cls.__init__).parameters
+
+    if "fused" not in kwargs and "foreach" not in kwargs and len(tensors) > 0:
+        if (
+            "fused" in supported
+            and all(p.is_cuda and p.is_floating_point() for p in tensors)
+        ):
+            kwargs["fused"] = True
+        elif "foreach" in supported:
+            kwargs["foreach"] = True
+
+    optim = cls(params, **kwargs)
+    threestudio.debug(
+        f"Optimizer {cls.__name__}"
+        + (" (fused)" if kwargs.get("fused") else "")
+        + (" (foreach)" if kwargs.get("foreach") else "")
+    )
+    return optim
@@ -2,11 +2,11 @@ import sys
 import warnings
 from bisect import bisect_right
 
-import torch
 import torch.nn as nn
 from torch.optim import lr_scheduler
 
 import threestudio
+from threestudio.systems.optimizers import make_optimizer
 
 
 def get_scheduler(name):
@@ -27,36 +27,32 @@ def get_parameters(model, name):
     if isinstance(module, nn.Module):
         return module.parameters()
     elif isinstance(module, nn.Parameter):
-        return module
+        return [module]
     return []
 
 
 def parse_optimizer(config, model):
     if hasattr(config, "params"):
-        params = []
+        params, matched, unmatched = [], [], []
         for name, args in config.params.items():
             try:
-                params.append({"params": get_parameters(model, name), "name": name, **args})
-            except:
-                pass
-        # params = [
-        #     {"params": get_parameters(model, name), "name": name, **args}
-        #     for name, args in config.params.items()
-        # ]
-        threestudio.debug(f"Specify optimizer params: {config.params}")
+                group_params = list(get_parameters(model, name))
+            except AttributeError:
+                unmatched.append(name)
+                continue
+            if len(group_params) == 0:
+                unmatched.append(name)
+                continue
+            params.append({"params": group_params, "name": name, **args})
+            matched.append(f"{name} ({sum(p.numel() for p in group_params)})")
+        threestudio.info(f"Optimizer param groups: {', '.join(matched)}")
+        if len(unmatched) > 0:
+            threestudio.warn(
+                f"Optimizer param groups without parameters, skipped: {', '.join(unmatched)}"
+            )
     else:
         params = model.parameters()
-    if config.name in ["FusedAdam"]:
-        import apex
-
-        optim = getattr(apex.optimizers, config.name)(params, **config.args)
-    elif config.name in ["Adan"]:
-        from threestudio.systems import optimizers
-
-        optim = getattr(optimizers, config.name)(params, **config.args)
-    else:
-        optim = getattr(torch.optim, config.name)(params, **config.args)
-    return optim
+    return make_optimizer(config.name, params, **config.args)
 
 
 def parse_scheduler(config, optimizer):
@@ -1,8 +1,11 @@
+import functools
+import time
 from dataclasses import dataclass
 
 import torch
 import torch.nn as nn
 
+import threestudio
 from threestudio.utils.config import parse_structured
 from threestudio.utils.misc import get_device, load_module_weights
 from threestudio.utils.typing import *
@@ -18,6 +21,35 @@ class Configurable:
         self.cfg = parse_structured(self.Config, cfg)
 
 
+class lazy_module:
+    """
+    Attribute built by the decorated method on first access instead of in configure().
+    The result is stored in the instance __dict__ without being registered as a submodule,
+    so it is excluded from state_dict / checkpoints and is never loaded by modes
+    (test, export, ...) that do not use it.
+    """
+
+    def __init__(self, builder: Callable) -> None:
+        self.builder = builder
+        self.name = builder.__name__
+        functools.update_wrapper(self, builder)
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        tic = time.time()
+        value = self.builder(instance)
+        instance.__dict__[self.name] = value
+        threestudio.info(f"Loaded {self.name} in {time.time() - tic:.2f}s")
+        return value
+
+    def is_built(self, instance) -> bool:
+        return self.name in instance.__dict__
+
+
 class Updateable:
     def do_update_step(
         self, epoch: int, global_step: int, on_load_weights: bool = False
@@ -25,6 +57,9 @@ class Updateable:
         for attr in self.__dir__():
             if attr.startswith("_"):
                 continue
+            lazy = getattr(type(self), attr, None)
+            if isinstance(lazy, lazy_module) and not lazy.is_built(self):
+                continue  # do not build lazy attributes just to update them
             try:
                 module = getattr(self, attr)
             except:
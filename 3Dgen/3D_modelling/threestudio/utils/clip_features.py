@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+import torch
+import torchvision.transforms as T
+
+from threestudio.utils.typing import *
+
+
+class ClipFeatures:
+    """
+    CLIP embeddings shared by a system and its guidance for the CLIP image / text losses.
+        1. all images of one loss term go through a single encode_image forward
+        2. reference image embeddings are cached by a caller-given key
+            (rendered region, background color, ...)
+        3. normalized text embeddings are cached by prompt
+    """
+
+    def __init__(self, clip_model, device, cache_size: int = 256) -> None:
+        self.clip_model = clip_model
+        self.device = device
+        self.cache_size = cache_size
+        self.aug = T.Compose([
+            T.Resize((224, 224)),
+            T.Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711)),
+        ])
+        self.image_latents = OrderedDict()
+        self.text_latents = {}
+
+    def encode_images(self, *imgs: Float[Tensor, "B 3 H W"]) -> List[Float[Tensor, "B C"]]:
+        sizes = [img.shape[0] for img in imgs]
+        image_z = self.clip_model.encode_image(self.aug(torch.cat(imgs, dim=0)))
+        image_z = image_z / image_z.norm(dim=-1, keepdim=True) # normalize features
+        return list(image_z.split(sizes, dim=0))
+
+    @torch.no_grad()
+    def encode_reference(self, img: Float[Tensor, "B 3 H W"], key: Optional[Any] = None) -> Float[Tensor, "B C"]:
+        if key is None:
+            return self.encode_images(img)[0]
+        if key not in self.image_latents:
+            self.image_latents[key] = self.encode_images(img)[0]
+            while len(self.image_latents) > self.cache_size:
+                self.image_latents.popitem(last=False)
+        self.image_latents.move_to_end(key)
+        return self.image_latents[key]
+
+    @torch.no_grad()
+    def encode_text(self, prompt: str) -> Float[Tensor, "1 C"]:
+        if prompt not in self.text_latents:
+            import clip
+            text = clip.tokenize(prompt).to(self.device)
+            text_z = self.clip_model.encode_text(text)
+            self.text_latents[prompt] = text_z / text_z.norm(dim=-1, keepdim=True)
+        return self.text_latents[prompt]
+
+    @staticmethod
+    def similarity_loss(z1: Float[Tensor, "B C"], z2: Float[Tensor, "B C"]) -> Float[Tensor, ""]:
+        return - (z1 * z2).sum(-1).mean()
+
+    def clear(self) -> None:
+        self.image_latents.clear()
+        self.text_latents.clear()
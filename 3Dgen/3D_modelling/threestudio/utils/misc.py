@@ -92,6 +92,69 @@ def cleanup():
     tcnn.free_temporary_memory()
 
 
+class CleanupPolicy:
+    """
+    Runs cleanup() only when it is likely to pay off instead of after every step:
+        1. step(): when the caching allocator holds more than reserved_threshold of the
+            device memory, or more than fragmentation_threshold of the reserved memory
+            sits in free pieces of split blocks (inactive_split_bytes). Whole cached
+            blocks freed by the last batch are the allocator's normal reuse and do not
+            count.
+        2. force(): unconditionally, e.g. at epoch boundaries
+    Thresholds <= 0 always fire and reproduce a cleanup after every step (also without cuda).
+    """
+
+    def __init__(
+        self, reserved_threshold: float = 0.9, fragmentation_threshold: float = 0.5
+    ) -> None:
+        self.reserved_threshold = reserved_threshold
+        self.fragmentation_threshold = fragmentation_threshold
+        self.n_steps = 0
+        self.n_fired: Dict[str, int] = {"pressure": 0, "forced": 0}
+        self.reclaimed = 0
+
+    def under_pressure(self) -> bool:
+        if self.reserved_threshold <= 0 or self.fragmentation_threshold <= 0:
+            return True
+        if not torch.cuda.is_available():
+            return False
+        reserved = torch.cuda.memory_reserved()
+        if reserved == 0:
+            return False
+        total = torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory
+        fragmentation = (
+            torch.cuda.memory_stats().get("inactive_split_bytes.all.current", 0)
+            / reserved
+        )
+        return (
+            reserved / total >= self.reserved_threshold
+            or fragmentation >= self.fragmentation_threshold
+        )
+
+    def _run(self, reason: str) -> None:
+        reserved = torch.cuda.memory_reserved() if torch.cuda.is_available() else 0
+        cleanup()
+        if torch.cuda.is_available():
+            self.reclaimed += max(0, reserved - torch.cuda.memory_reserved())
+        self.n_fired[reason] += 1
+
+    def step(self) -> bool:
+        self.n_steps += 1
+        if self.under_pressure():
+            self._run("pressure")
+            return True
+        return False
+
+    def force(self) -> None:
+        self._run("forced")
+
+    def report(self) -> str:
+        return (
+            f"cleanup fired {self.n_fired['pressure']}/{self.n_steps} steps under memory pressure, "
+            f"{self.n_fired['forced']} forced, reclaimed {self.reclaimed / 2**20:.1f} MiB"
+        )
+
+
 def finish_with_cleanup(func: Callable):
     def wrapper(*args, **kwargs):
         out = func(*args, **kwargs)
@@ -1,18 +1,177 @@
-import nvdiffrast.torch as dr
 import torch
 
 from threestudio.utils.typing import *
 
+try:
+    import nvdiffrast.torch as dr
+except ImportError:
+    # GPU-less nodes can still use context_type "torch"
+    dr = None
+
+
+def _resolution_hw(resolution: Union[int, Tuple[int, int]]) -> Tuple[int, int]:
+    if isinstance(resolution, int):
+        return resolution, resolution
+    return int(resolution[0]), int(resolution[1])
+
+
+def rasterize_torch(
+    pos: Float[Tensor, "B Nv 4"],
+    tri: Integer[Tensor, "Nf 3"],
+    resolution: Union[int, Tuple[int, int]],
+    max_elements: int = 2**24,
+) -> Tuple[Float[Tensor, "B H W 4"], Float[Tensor, "B H W 4"]]:
+    """
+    Vectorized PyTorch triangle rasterizer with the nvdiffrast output conventions:
+    (u, v, z/w, triangle_id + 1) per pixel with perspective-correct barycentrics,
+    0 for empty pixels, row 0 at ndc y = -1 and the smallest z/w kept per pixel.
+    Triangles with a vertex behind the camera (w <= 0) are skipped instead of clipped,
+    the image-space derivatives (rast_db) are returned as zeros.
+    """
+    H, W = _resolution_hw(resolution)
+    B = pos.shape[0]
+    Nf = tri.shape[0]
+    device = pos.device
+    tri = tri.long()
+
+    v = pos.float()[:, tri]  # B Nf 3 4
+    w = v[..., 3]
+    valid = (w > 1e-8).all(dim=-1)
+    w = torch.where(w > 1e-8, w, torch.ones_like(w))
+    z = v[..., 2] / w
+    # pixel space, pixel centers at integer positions
+    sx = (v[..., 0] / w + 1.0) * 0.5 * W - 0.5
+    sy = (v[..., 1] / w + 1.0) * 0.5 * H - 0.5
+    area = (sx[..., 1] - sx[..., 0]) * (sy[..., 2] - sy[..., 0]) - (
+        sx[..., 2] - sx[..., 0]
+    ) * (sy[..., 1] - sy[..., 0])
+    valid = valid & (area.abs() > 1e-12)
+
+    # flatten the batch, only valid triangles are rasterized
+    flat_ids = valid.flatten().nonzero()[:, 0]
+    sx, sy, z, w, area = [
+        t.reshape(B * Nf, *t.shape[2:])[flat_ids] for t in (sx, sy, z, w, area)
+    ]
+    with torch.no_grad():
+        bbox_min = torch.stack(
+            [sx.min(dim=-1)[0].ceil().clamp(0, W - 1), sy.min(dim=-1)[0].ceil().clamp(0, H - 1)],
+            dim=-1,
+        ).long()
+        bbox_max = torch.stack(
+            [sx.max(dim=-1)[0].floor().clamp(0, W - 1), sy.max(dim=-1)[0].floor().clamp(0, H - 1)],
+            dim=-1,
+        ).long()
+        extent = (bbox_max - bbox_min + 1).clamp(min=0)
+
+    # similar sized triangles are rasterized together over a shared pixel offset box
+    pix_lst, tri_lst, values_lst = [], [], []
+    order = extent.prod(dim=-1).argsort()
+    start = 0
+    while start < len(order):
+        idx = order[
+            start : start
+            + max(1, max_elements // int(extent[order[start]].clamp(min=1).prod()))
+        ]
+        box = extent[idx].amax(dim=0).clamp(min=1)
+        while len(idx) > 1 and int(box.prod()) * len(idx) > max_elements:
+            idx = idx[: len(idx) // 2]
+            box = extent[idx].amax(dim=0).clamp(min=1)
+        start += len(idx)
+
+        offsets = torch.stack(
+            torch.meshgrid(
+                torch.arange(int(box[0]), device=device),
+                torch.arange(int(box[1]), device=device),
+                indexing="ij",
+            ),
+            dim=-1,
+        ).reshape(-1, 2)
+        px = bbox_min[idx, None, :] + offsets[None]  # N K 2
+        n_ids, k_ids = (px <= bbox_max[idx, None, :]).all(dim=-1).nonzero(as_tuple=True)
+        t_ids = idx[n_ids]
+        px = px[n_ids, k_ids].float()
+
+        tx, ty = sx[t_ids], sy[t_ids]
+        b0 = (
+            (tx[:, 1] - px[:, 0]) * (ty[:, 2] - px[:, 1])
+            - (tx[:, 2] - px[:, 0]) * (ty[:, 1] - px[:, 1])
+        ) / area[t_ids]
+        b1 = (
+            (tx[:, 2] - px[:, 0]) * (ty[:, 0] - px[:, 1])
+            - (tx[:, 0] - px[:, 0]) * (ty[:, 2] - px[:, 1])
+        ) / area[t_ids]
+        b = torch.stack([b0, b1, 1.0 - b0 - b1], dim=-1)
+        depth = (b * z[t_ids]).sum(dim=-1)
+        inside = (b >= 0).all(dim=-1) & (depth >= -1.0) & (depth <= 1.0)
+
+        b, depth, t_ids, px = b[inside], depth[inside], t_ids[inside], px[inside].long()
+        # perspective-correct barycentrics
+        b = b / w[t_ids]
+        b = b / b.sum(dim=-1, keepdim=True)
+
+        batch_ids = flat_ids[t_ids] // Nf
+        pix_lst.append((batch_ids * H + px[:, 1]) * W + px[:, 0])
+        tri_lst.append(flat_ids[t_ids] % Nf)
+        values_lst.append(torch.stack([b[:, 0], b[:, 1], depth], dim=-1))
+
+    rast = pos.new_zeros(B * H * W, 4, dtype=torch.float32)
+    if len(pix_lst) > 0:
+        pix, tri_ids, values = torch.cat(pix_lst), torch.cat(tri_lst), torch.cat(values_lst)
+
+        # depth test: closest candidate per pixel, ties go to the highest triangle id
+        with torch.no_grad():
+            depth = values[:, 2]
+            zbuf = torch.full((B * H * W,), float("inf"), device=device)
+            zbuf = zbuf.scatter_reduce(0, pix, depth, reduce="amin")
+            front = depth == zbuf[pix]
+            tbuf = torch.full((B * H * W,), -1, dtype=torch.long, device=device)
+            tbuf = tbuf.scatter_reduce(0, pix[front], tri_ids[front], reduce="amax")
+            win = (front & (tri_ids == tbuf[pix])).nonzero()[:, 0]
+
+        rast = rast.index_put(
+            (pix[win],),
+            torch.cat([values[win], (tri_ids[win] + 1).float()[:, None]], dim=-1),
+        )
+
+    rast = rast.reshape(B, H, W, 4)
+    return rast, torch.zeros_like(rast)
+
+
+def interpolate_torch(
+    attr: Float[Tensor, "B Nv C"],
+    rast: Float[Tensor, "B H W 4"],
+    tri: Integer[Tensor, "Nf 3"],
+) -> Float[Tensor, "B H W C"]:
+    """dr.interpolate counterpart without attribute derivatives, attr may have batch size 1"""
+    B, H, W = rast.shape[:3]
+    attr = attr.float().expand(B, -1, -1)
+    tri_ids = rast[..., 3].long().reshape(B, -1)  # 0 for empty pixels
+    covered = tri_ids > 0
+    face = tri.long()[(tri_ids - 1).clamp(min=0)]  # B HW 3
+    attr_face = torch.gather(
+        attr[:, None].expand(-1, face.shape[1], -1, -1),
+        2,
+        face[..., None].expand(-1, -1, -1, attr.shape[-1]),
+    )  # B HW 3 C
+    u, v = rast[..., 0].reshape(B, -1, 1), rast[..., 1].reshape(B, -1, 1)
+    out = (
+        u * attr_face[:, :, 0] + v * attr_face[:, :, 1] + (1 - u - v) * attr_face[:, :, 2]
+    )
+    out = out * covered[..., None]
+    return out.reshape(B, H, W, -1)
+
 
 class NVDiffRasterizerContext:
     def __init__(self, context_type: str, device: torch.device) -> None:
         self.device = device
         self.ctx = self.initialize_context(context_type, device)
 
-    def initialize_context(
-        self, context_type: str, device: torch.device
-    ) -> Union[dr.RasterizeGLContext, dr.RasterizeCudaContext]:
-        if context_type == "gl":
+    def initialize_context(self, context_type: str, device: torch.device) -> Any:
+        # "torch": software rasterizer above, runs on any device including cpu
+        self.context_type = context_type
+        if context_type == "torch":
+            return None
+        elif context_type == "gl":
             return dr.RasterizeGLContext(device=device)
         elif context_type == "cuda":
             return dr.RasterizeCudaContext(device=device)
@@ -34,6 +193,8 @@ class NVDiffRasterizerContext:
         resolution: Union[int, Tuple[int, int]],
     ):
         # rasterize in instance mode (single topology)
+        if self.ctx is None:
+            return rasterize_torch(pos, tri, resolution)
         return dr.rasterize(self.ctx, pos.float(), tri.int(), resolution, grad_db=True)
 
     def rasterize_one(
@@ -53,6 +214,9 @@ class NVDiffRasterizerContext:
         pos: Float[Tensor, "B Nv 4"],
         tri: Integer[Tensor, "Nf 3"],
     ) -> Float[Tensor, "B H W C"]:
+        if self.ctx is None:
+            # no analytic antialiasing in the software rasterizer
+            return color.float()
         return dr.antialias(color.float(), rast, pos.float(), tri.int())
 
     def interpolate(
@@ -63,6 +227,9 @@ class NVDiffRasterizerContext:
         rast_db=None,
         diff_attrs=None,
     ) -> Float[Tensor, "B H W C"]:
+        if self.ctx is None:
+            out = interpolate_torch(attr, rast, tri)
+            return out, out.new_zeros(*out.shape[:3], 0)
         return dr.interpolate(
             attr.float(), rast, tri.int(), rast_db=rast_db, diff_attrs=diff_attrs
         )
@@ -0,0 +1,87 @@
+"""
+Parity check and benchmark of the "torch" software rasterizer against nvdiffrast:
+
+    python -m threestudio.utils.rasterize_check --resolution 512 --n-faces 20000
+
+Reports the coverage / triangle id agreement, barycentric and interpolation differences
+(on pixels where both pick the same triangle) and the timings of both backends.
+"""
+import argparse
+import time
+
+import torch
+
+from threestudio.utils.rasterize import NVDiffRasterizerContext, dr
+
+
+def random_scene(n_faces: int, batch_size: int, device: torch.device):
+    # small random triangles in front of a perspective camera, plus a uv-space layout (w = 1)
+    centers = torch.rand(n_faces, 1, 3, device=device) * 2.0 - 1.0
+    verts = (centers + torch.randn(n_faces, 3, 3, device=device) * 0.05).reshape(-1, 3)
+    tri = torch.arange(n_faces * 3, device=device, dtype=torch.int32).reshape(-1, 3)
+    w = torch.rand(batch_size, verts.shape[0], 1, device=device) * 0.5 + 1.0
+    pos = torch.cat(
+        [verts[None, :, :2] * w, verts[None, :, 2:] * 0.5 * w, w], dim=-1
+    )
+    attr = torch.rand(1, verts.shape[0], 3, device=device)
+    return pos, tri, attr
+
+
+def timeit(fn, n_iter: int, device: torch.device) -> float:
+    fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    tic = time.perf_counter()
+    for _ in range(n_iter):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return (time.perf_counter() - tic) / n_iter * 1e3
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resolution", type=int, default=512)
+    parser.add_argument("--n-faces", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--n-iter", type=int, default=5)
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    cpu = torch.device("cpu")
+    pos, tri, attr = random_scene(args.n_faces, args.batch_size, cpu)
+    res = (args.resolution, args.resolution)
+
+    ctx_torch = NVDiffRasterizerContext("torch", cpu)
+    rast, _ = ctx_torch.rasterize(pos, tri, res)
+    out, _ = ctx_torch.interpolate(attr, rast, tri)
+    t_cpu = timeit(lambda: ctx_torch.rasterize(pos, tri, res), args.n_iter, cpu)
+    print(f"torch (cpu): {t_cpu:.1f} ms, coverage {(rast[..., 3] > 0).float().mean():.4f}")
+
+    if dr is None or not torch.cuda.is_available():
+        print("nvdiffrast / cuda not available, skipping the parity check")
+        exit()
+
+    cuda = torch.device("cuda")
+    ctx_cuda = NVDiffRasterizerContext("cuda", cuda)
+    rast_ref, _ = ctx_cuda.rasterize(pos.to(cuda), tri.to(cuda), res)
+    out_ref, _ = ctx_cuda.interpolate(attr.to(cuda), rast_ref, tri.to(cuda))
+    rast_ref, out_ref = rast_ref.cpu(), out_ref.cpu()
+    t_cuda = timeit(
+        lambda: ctx_cuda.rasterize(pos.to(cuda), tri.to(cuda), res), args.n_iter, cuda
+    )
+    print(f"nvdiffrast (cuda): {t_cuda:.1f} ms")
+
+    covered, covered_ref = rast[..., 3] > 0, rast_ref[..., 3] > 0
+    same = rast[..., 3] == rast_ref[..., 3]
+    both = covered & covered_ref & same
+    print(
+        f"coverage agreement {(covered == covered_ref).float().mean():.5f}, "
+        f"triangle id agreement {same[covered_ref].float().mean():.5f}"
+    )
+    if both.any():
+        print(
+            f"max |uv - uv_ref| {(rast[..., :2] - rast_ref[..., :2])[both].abs().max():.2e}, "
+            f"max |z - z_ref| {(rast[..., 2] - rast_ref[..., 2])[both].abs().max():.2e}, "
+            f"max |attr - attr_ref| {(out - out_ref)[both].abs().max():.2e}"
+        )
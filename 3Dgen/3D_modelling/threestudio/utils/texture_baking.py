@@ -0,0 +1,84 @@
+import torch
+import torch.nn.functional as F
+
+from threestudio.utils.ops import chunk_batch
+from threestudio.utils.rasterize import NVDiffRasterizerContext
+from threestudio.utils.typing import *
+
+
+def push_pull_fill(
+    image: Float[Tensor, "H W C"], mask: Bool[Tensor, "H W"]
+) -> Float[Tensor, "H W C"]:
+    """
+    Fill the uncovered texels of a texture atlas on-device (UV seam padding).
+    The covered texels are averaged down a mip pyramid (push) and every hole takes
+    the value of the finest level that covers it, bilinearly upsampled (pull).
+    """
+    x = image.permute(2, 0, 1)[None] * mask[None, None]
+    w = mask[None, None].to(image.dtype)
+
+    pyramid = [(x, w)]
+    while min(x.shape[-2:]) > 1:
+        x = F.avg_pool2d(x, 2, ceil_mode=True)
+        w = F.avg_pool2d(w, 2, ceil_mode=True)
+        pyramid.append((x, w))
+
+    filled = x / w.clamp(min=1e-8)
+    for x, w in reversed(pyramid[:-1]):
+        up = F.interpolate(filled, size=x.shape[-2:], mode="bilinear", align_corners=False)
+        filled = torch.where(w > 0, x / w.clamp(min=1e-8), up)
+
+    return torch.where(mask[..., None], image, filled[0].permute(1, 2, 0))
+
+
+def bake_textures(
+    ctx: NVDiffRasterizerContext,
+    v_pos: Float[Tensor, "Nv 3"],
+    t_pos_idx: Integer[Tensor, "Nf 3"],
+    v_tex: Float[Tensor, "Nt 2"],
+    t_tex_idx: Integer[Tensor, "Nf 3"],
+    texture_size: int,
+    query_fn: Callable[[Float[Tensor, "N 3"]], Dict[str, Float[Tensor, "N C"]]],
+    chunk_size: int = 0,
+    padding: bool = True,
+) -> Dict[str, Float[Tensor, "H W C"]]:
+    """
+    Bake the maps returned by query_fn(points) into a texture_size^2 atlas.
+        1. only the texels covered by the UV charts are queried, in chunks of chunk_size
+        2. all maps come from the same query pass and are scattered back into the atlas
+        3. the holes are filled on-device with push_pull_fill
+    """
+    # clip space transform, padded to four component coordinate
+    uv_clip = v_tex * 2.0 - 1.0
+    uv_clip4 = torch.cat(
+        (
+            uv_clip,
+            torch.zeros_like(uv_clip[..., 0:1]),
+            torch.ones_like(uv_clip[..., 0:1]),
+        ),
+        dim=-1,
+    )
+    rast, _ = ctx.rasterize_one(uv_clip4, t_tex_idx, (texture_size, texture_size))
+    covered = rast[:, :, 3] > 0
+
+    # world space position of the covered texels
+    gb_pos, _ = ctx.interpolate_one(v_pos, rast[None, ...], t_pos_idx)
+    points = gb_pos[0][covered]
+
+    def query_covered(points):
+        # only per-point outputs can be scattered into the atlas
+        return {
+            k: v
+            for k, v in query_fn(points).items()
+            if isinstance(v, torch.Tensor) and v.shape[:1] == points.shape[:1]
+        }
+
+    with torch.no_grad():
+        values = chunk_batch(query_covered, chunk_size, points)
+
+    maps = {}
+    for k, v in values.items():
+        texture = v.new_zeros(texture_size, texture_size, v.shape[-1])
+        texture[covered] = v
+        maps[k] = push_pull_fill(texture, covered) if padding else texture
+    return maps
@@ -413,6 +413,9 @@ class BaseTrainer:
 
                     if i % 10 == 0:
 
+                        # train_discriminator / train_generator may return device tensors,
+                        # they are only synchronized here
+                        d_loss, g_loss = float(d_loss), float(g_loss)
                         self.training_stats.update()
                         tqdm.write(f"[Exp: {self.output_dir}]"
                                    f"[Epoch: {self.discriminator.epoch}/{self.opt.n_epochs}]"
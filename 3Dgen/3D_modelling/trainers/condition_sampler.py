@@ -0,0 +1,131 @@
+import torch
+from torch.utils.data import DataLoader, Sampler
+
+
+class InfiniteSampler(Sampler):
+    """
+    endless stream of dataset indices for one rank, reshuffled with a new seed every
+    epoch, so the DataLoader iterator (and its workers) never has to be recreated
+    """
+
+    def __init__(self, dataset_size, rank=0, world_size=1, shuffle=True, seed=0):
+
+        self.dataset_size = dataset_size
+        self.rank = rank
+        self.world_size = world_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+
+        while True:
+            if self.shuffle:
+                generator = torch.Generator()
+                generator.manual_seed(self.seed + self.epoch)
+                order = torch.randperm(self.dataset_size, generator=generator)
+            else:
+                order = torch.arange(self.dataset_size)
+            yield from order[self.rank::self.world_size].tolist()
+            self.epoch += 1
+
+
+class ConditionSampler:
+    """
+    condition batches of any size from a persistent DataLoader
+        1. the dataset of loader is read through an InfiniteSampler, the workers are started
+            once and stay alive
+        2. batches are copied into a pinned ring buffer, sample(n) returns exactly n samples
+            as views of the buffer (or a gather when they wrap around) instead of
+            concatenating and slicing loader batches
+        3. copies to the gpu are non-blocking, the buffer is only overwritten after they finished
+    """
+
+    def __init__(self, loader, rank=0, world_size=1, shuffle=True, seed=0, prefetch_factor=2):
+
+        self.dataset = loader.dataset
+        self.batch_size = loader.batch_size
+        self.pin_memory = torch.cuda.is_available()
+
+        worker_kwargs = {}
+        if loader.num_workers > 0:
+            worker_kwargs = dict(persistent_workers=True, prefetch_factor=prefetch_factor)
+        self.loader = DataLoader(
+            loader.dataset,
+            batch_size=loader.batch_size,
+            sampler=InfiniteSampler(len(loader.dataset), rank, world_size, shuffle, seed),
+            num_workers=loader.num_workers,
+            collate_fn=loader.collate_fn,
+            worker_init_fn=loader.worker_init_fn,
+            **worker_kwargs,
+        )
+        self.iterator = iter(self.loader)
+
+        self.buffers = None
+        self.capacity = 0
+        self.read_pos = 0
+        self.available = 0
+        self.copy_event = None
+
+    def _allocate(self, batch, capacity):
+
+        buffers = {
+            k: torch.empty((capacity, *v.shape[1:]), dtype=v.dtype, pin_memory=self.pin_memory)
+            for k, v in batch.items()
+        }
+        if self.buffers is not None:
+            # keep the samples which were not read yet at the front of the new buffers
+            self._wait_copies()
+            index = (self.read_pos + torch.arange(self.available)) % self.capacity
+            for k, buffer in buffers.items():
+                torch.index_select(self.buffers[k], 0, index, out=buffer[:self.available])
+        self.buffers = buffers
+        self.capacity = capacity
+        self.read_pos = 0
+
+    def _wait_copies(self):
+
+        if self.copy_event is not None:
+            self.copy_event.synchronize()
+            self.copy_event = None
+
+    def _push(self, batch):
+
+        size = next(iter(batch.values())).shape[0]
+        if self.buffers is None or self.available + size > self.capacity:
+            self._allocate(batch, max(2 * self.capacity, self.available + size))
+
+        self._wait_copies()
+        write_pos = (self.read_pos + self.available) % self.capacity
+        first = min(size, self.capacity - write_pos)
+        for k, v in batch.items():
+            self.buffers[k][write_pos:write_pos + first].copy_(v[:first])
+            self.buffers[k][:size - first].copy_(v[first:])
+        self.available += size
+
+    def sample(self, num_samples, device="cpu"):
+        """
+        returns a dict with num_samples entries of every condition on device
+        """
+
+        while self.available < num_samples:
+            self._push(next(self.iterator))
+
+        if self.read_pos + num_samples <= self.capacity:
+            samples = {k: v[self.read_pos:self.read_pos + num_samples] for k, v in self.buffers.items()}
+        else:
+            index = (self.read_pos + torch.arange(num_samples)) % self.capacity
+            samples = {k: v[index] for k, v in self.buffers.items()}
+        self.read_pos = (self.read_pos + num_samples) % self.capacity
+        self.available -= num_samples
+
+        device = torch.device(device)
+        if device.type == "cuda":
+            samples = {k: v.to(device, non_blocking=True) for k, v in samples.items()}
+            self.copy_event = torch.cuda.Event()
+            self.copy_event.record(torch.cuda.current_stream(device))
+        else:
+            # views of the buffer would be overwritten by the next batches
+            samples = {k: v.to(device, copy=True) for k, v in samples.items()}
+
+        return samples
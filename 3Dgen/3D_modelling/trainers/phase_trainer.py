@@ -3,6 +3,7 @@ import glob
 import math
 import numpy as np
 import random
+from contextlib import nullcontext
 
 import torch
 import torch.nn.functional as F
@@ -12,6 +13,8 @@ from lib.components import training_stats
 import copy
 
 from lib.trainers.base_trainer import BaseTrainer, z_sampler
+from lib.trainers.condition_sampler import ConditionSampler
+from lib.trainers.segmentation_loss import segmentation_loss
 from lib.components.perceptual_loss import VGGPerceptualLoss
 from lib.components.util import normalize_2nd_moment
 from lib.data import get_dataset, get_dataset_distributed, get_preprocessor
@@ -123,40 +126,14 @@ class PhaseTrainer (BaseTrainer):
         dataloader, _ = get_dataset_distributed(
             meta['dataset'], self.world_size, self.rank, self.proc_batch_size, shuffle=True, as_condition_sampler=True, **meta)
         self.condition_loader = dataloader
-        self.condition_sampler = iter(dataloader)
+        self.condition_sampler = ConditionSampler(dataloader, self.rank, self.world_size, shuffle=True, seed=meta.get("seed", 0))
 
 
     def sample_conditions(self, num_samples, meta, device="cpu"):
 
-        num_sampled = 0
-        images = []
-        conditions = {}
+        conditions = self.condition_sampler.sample(num_samples, device)
 
-        while num_sampled < num_samples:
-
-            try:
-                data = next(self.condition_sampler)
-            except:
-                self.init_condition_sampler(meta)
-                data = next(self.condition_sampler)
-
-            images.append(data["images"])
-            for k, v in data.items():
-                if k == "images": continue
-                if k in conditions:
-                    conditions[k].append(v)
-                else:
-                    conditions[k] = [v]
-
-            num_sampled += len(data["images"])
-
-        images = torch.cat(images, dim=0)[:num_samples].to(device, non_blocking=True)
-        for k, v in conditions.items():
-            conditions[k] = torch.cat(v, dim=0)[:num_samples].to(device, non_blocking=True)
-
-        conditions["images"] = images
-
-        return images, conditions
+        return conditions["images"], conditions
 
 
     def _get_disc_input_real(self, real_images, alpha, phase, meta):
@@ -208,7 +185,7 @@ class PhaseTrainer (BaseTrainer):
 
         mode = meta.get("segmentation_loss_mode", "cross_entropy_balanced")
         prior_weights = meta.get("segmentation_weights", [1. for _ in range(meta["label_dim"])])
-        prior_weights = torch.tensor(prior_weights, dtype=segments.dtype, device=self.device)
+        prior_weights = torch.tensor(prior_weights, dtype=torch.float32, device=self.device)
         prior_weights = prior_weights / prior_weights.mean()
 
         B, _, H, W = segments.shape
@@ -219,41 +196,21 @@ class PhaseTrainer (BaseTrainer):
                 gt_segments = F.interpolate(gt_segments, (H, W), mode="nearest")
                 gt_segments = gt_segments.squeeze(1).long()
 
-        if mode == "cross_entropy":
-            loss = F.cross_entropy(segments, gt_segments)
-        elif mode == "cross_entropy_multiclass":
-            gt_one_hot = F.one_hot(gt_segments, num_classes=meta['label_dim']).permute(0, 3, 1, 2)
-            gt_one_hot[:, 1, :, :][gt_segments > 0] = 1
-            loss = F.binary_cross_entropy_with_logits(segments, gt_one_hot.to(segments.dtype))
-        elif mode == "cross_entropy_balanced":
-            if torch.any(gt_segments > 0):
-                gt_one_hot = F.one_hot(gt_segments, num_classes=meta['label_dim']).permute(0, 3, 1, 2)
-                class_occurence = torch.sum(gt_one_hot, dim=(0, 2, 3))
-                class_occurence[0] = 0
-                num_classes_occur = torch.count_nonzero(class_occurence)
-                coefficients = torch.reciprocal(class_occurence.to(segments.dtype)) * torch.numel(gt_one_hot) / (num_classes_occur * gt_one_hot.shape[1])
-                coefficients[0] = 0
-                coefficients[torch.isinf(coefficients)] = 0
-                coefficients = coefficients * prior_weights
-                weight_map = coefficients[gt_segments]
-                loss = F.cross_entropy(segments, gt_segments, reduction="none")
-                loss = (loss * weight_map).mean()
-            else:
-                loss = F.cross_entropy(segments, gt_segments)
-        elif mode == "softplus":
-            gt_one_hot = F.one_hot(gt_segments, num_classes=meta['label_dim']).permute(0, 3, 1, 2)
-            gt_one_hot[:, 1, :, :][gt_segments > 0] = 1
-            match = (gt_one_hot > 0)
-            loss = segments.clone()
-            loss[match] = -segments[match]
-            loss = F.softplus(loss[:, 0]).mean() + F.softplus(loss[:, 1]).mean() + F.softplus(loss[:, 2:]).mean()
-            loss = loss / 3
+        return segmentation_loss(segments, gt_segments, meta["label_dim"], mode, prior_weights)
+
 
-        real_prob = (1 - torch.softmax(segments, dim=1)[:, 0, :, :]).mean()
-        pred_labels = torch.argmax(segments[:, 1:, :, :], dim=1) + 1
-        accurracy = (pred_labels == gt_segments).float().mean()
+    def _lazy_r1_interval(self, phase, meta):
+        """
+        StyleGAN2 lazy regularization: the R1 penalty of a do_r1 phase is only computed
+        on every r1_interval-th step of that phase and scaled up by r1_interval, returns
+        the scale of this step's penalty (0 when it is skipped)
+        """
 
-        return loss, accurracy, real_prob
+        if not phase["do_r1"]:
+            return 0
+        r1_interval = max(1, int(meta.get("r1_interval", 1)))
+        phase_step = self.discriminator.step // len(meta['phases'])
+        return r1_interval if phase_step % r1_interval == 0 else 0
 
 
     def _calculate_r1_regularization(self, disc_input_real, disc_output_real, phase, meta):
@@ -314,8 +271,10 @@ class PhaseTrainer (BaseTrainer):
             self.scaler.unscale_(self.optimizer_D)
             torch.nn.utils.clip_grad_norm_(self.discriminator_ddp.parameters(), meta['grad_clip'])
             self.scaler.step(self.optimizer_D)
+            # kept on device, the loss is only copied to the host when it is logged
+            d_loss = d_loss.detach()
 
-        return d_loss.detach().item()
+        return d_loss
 
 
     def train_generator(self, data, alpha, meta):
@@ -381,17 +340,19 @@ class PhaseTrainer (BaseTrainer):
                 for k in gen_outputs.keys():
                     gen_outputs[k] = torch.cat(gen_outputs[k], dim=0)
 
+            r1_scale = self._lazy_r1_interval(phase, meta)
+
             disc_input_real = self._get_disc_input_real(real_images, alpha, phase, meta)
-            disc_input_real.requires_grad = True
+            disc_input_real.requires_grad = r1_scale > 0
 
             disc_mode = "real" if phase["rotate"] else ("real" if random.random() > meta.get("disc_mode_switch_p", 0.5) else "gen")
             disc_output_real = self.discriminator_ddp(disc_input_real, data, alpha=alpha, mode=disc_mode, **meta)
             pred_real = disc_output_real["prediction"]
             if gan_lambda > 0: training_stats.report("real_signs_" + phase["name"], pred_real.sign())
 
-        grad_penalty = 4 * self._calculate_r1_regularization(disc_input_real, disc_output_real, phase, meta) if phase["do_r1"] else 0.
-        if phase["do_r1"] and self.rank == 0:
-            training_stats.report('r1_' + phase["name"], grad_penalty / 4.)
+        grad_penalty = 4 * r1_scale * self._calculate_r1_regularization(disc_input_real, disc_output_real, phase, meta) if r1_scale > 0 else 0.
+        if r1_scale > 0 and self.rank == 0:
+            training_stats.report('r1_' + phase["name"], grad_penalty / (4. * r1_scale))
 
         with torch.cuda.amp.autocast(enabled=self.amp):
 
@@ -415,7 +376,7 @@ class PhaseTrainer (BaseTrainer):
                     training_stats.report("segmentation_acc_real", acc_real)
                     training_stats.report("segmentation_prob_real", prob_real)
                     training_stats.report("segmentation_prob_gen", prob_gen)
-                    training_stats.report("segmentation_signs", math.log((prob_real.item() + 1e-3) / (prob_gen.item() + 1e-3)))
+                    training_stats.report("segmentation_signs", torch.log((prob_real.detach() + 1e-3) / (prob_gen.detach() + 1e-3)))
                 else:
                     segmentation_loss = (disc_output_real["segments"].sum() + disc_output_gen["segments"].sum()) * 0
             else:
@@ -455,11 +416,17 @@ class PhaseTrainer (BaseTrainer):
         real_z = data["latents"]
         split_batch_size = real_images.shape[0] // self.batch_split
 
-        g_loss_total = 0.
+        g_loss_total = torch.zeros((), device=self.device)
 
         for split in range(self.batch_split):
 
-            with torch.cuda.amp.autocast(enabled=self.amp):
+            # gradients of the micro-batches are accumulated locally and all-reduced once by
+            # the backward of the last one, the discriminator gradients of the generator step
+            # are discarded (optimizer_D.zero_grad) and never synchronized
+            last_split = split == self.batch_split - 1
+            with nullcontext() if last_split else self.generator_ddp.no_sync(), \
+                    self.discriminator_ddp.no_sync(), \
+                    torch.cuda.amp.autocast(enabled=self.amp):
 
                 subset_z = z[split * split_batch_size:(split + 1) * split_batch_size]
                 subset_real_images = real_images[split * split_batch_size:(split + 1) * split_batch_size]
@@ -543,9 +510,9 @@ class PhaseTrainer (BaseTrainer):
                 g_loss = gan_loss + perceptual_loss + photometric_loss + latent_loss + segmentation_loss
                 g_loss = g_loss * loss_scale / self.batch_split
 
-                g_loss_scaled = self.scaler.scale(g_loss)
-                g_loss_scaled.backward(retain_graph=True)
-                g_loss_total += g_loss.detach().item()
+                # every micro-batch has its own graph, nothing has to be retained
+                self.scaler.scale(g_loss).backward()
+                g_loss_total += g_loss.detach()
 
         return g_loss_total, topk_num
 
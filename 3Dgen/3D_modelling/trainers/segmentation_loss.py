@@ -0,0 +1,75 @@
+import torch
+import torch.nn.functional as F
+
+
+SEGMENTATION_LOSS_MODES = ["cross_entropy", "cross_entropy_multiclass", "cross_entropy_balanced", "softplus"]
+
+
+def balanced_class_weights(gt_segments, label_dim, prior_weights=None):
+    """
+    gt_segments: batch_size, height, width
+    inverse class frequencies of the labels > 0 (label 0 = fake gets weight 0), normalized
+    as with a dense one-hot count, from a scatter_add_ count instead of a one-hot tensor
+    (torch.bincount would read the max label on the host to size its output)
+    returns the per-class weights and the number of occurring labels > 0 (both on device)
+    """
+
+    flat = gt_segments.flatten()
+    counts = torch.zeros(label_dim, dtype=torch.float32, device=flat.device)
+    counts.scatter_add_(0, flat, torch.ones_like(flat, dtype=torch.float32))
+    counts[0] = 0
+    num_classes_occur = torch.count_nonzero(counts)
+    denom = counts * num_classes_occur
+    weights = torch.where(denom > 0, gt_segments.numel() / denom.clamp(min=1), torch.zeros_like(denom))
+    if prior_weights is not None:
+        weights = weights * prior_weights.to(weights.dtype)
+    return weights, num_classes_occur
+
+
+def segmentation_loss(segments, gt_segments, label_dim, mode="cross_entropy_balanced", prior_weights=None):
+    """
+    segments: batch_size, num_labels, height, width (logits)
+    gt_segments: batch_size, height, width (same resolution)
+    all modes share one log_softmax and gather the target entries instead of building a
+    batch_size x num_labels x height x width one-hot tensor, nothing is synchronized with the host
+    returns loss, accuracy and the mean probability of not being fake
+    """
+
+    if mode not in SEGMENTATION_LOSS_MODES:
+        raise ValueError(f"unknown segmentation_loss_mode {mode}")
+
+    logits = segments.float()
+    log_probs = F.log_softmax(logits, dim=1)
+    gt_index = gt_segments.unsqueeze(1)
+
+    if mode == "cross_entropy":
+        loss = -log_probs.gather(1, gt_index).mean()
+
+    elif mode == "cross_entropy_balanced":
+        ce = -log_probs.gather(1, gt_index).squeeze(1)
+        weights, num_classes_occur = balanced_class_weights(gt_segments, label_dim, prior_weights)
+        loss = torch.where(num_classes_occur > 0, (ce * weights[gt_segments]).mean(), ce.mean())
+
+    else:
+        # sigmoid modes, targets are the one-hot labels with channel 1 (real) set for every label > 0:
+        # softplus(x * (1 - 2 t)) = softplus(x) - x * t
+        logits_gt = logits.gather(1, gt_index).squeeze(1)
+        real = (gt_segments > 0).to(logits.dtype)
+        softplus = F.softplus(logits)
+
+        if mode == "cross_entropy_multiclass":
+            target_logits = logits_gt * (gt_segments != 1).to(logits.dtype) + logits[:, 1] * real
+            loss = (softplus.sum() - target_logits.sum()) / logits.numel()
+        else:
+            loss_fake = softplus[:, 0].mean() - (logits_gt * (gt_segments == 0).to(logits.dtype)).mean()
+            loss_real = softplus[:, 1].mean() - (logits[:, 1] * real).mean()
+            loss_labels = (softplus[:, 2:].sum() - (logits_gt * (gt_segments >= 2).to(logits.dtype)).sum()) \
+                / softplus[:, 2:].numel()
+            loss = (loss_fake + loss_real + loss_labels) / 3
+
+    with torch.no_grad():
+        real_prob = (1 - log_probs[:, 0].exp()).mean()
+        pred_labels = torch.argmax(logits[:, 1:], dim=1) + 1
+        accuracy = (pred_labels == gt_segments).float().mean()
+
+    return loss, accuracy, real_prob